@@ -0,0 +1,104 @@
+"""Импорт и экспорт большого набора команд: время и пиковая память.
+
+Для каждого формата (JSON, JSONL, CSV) генерируется файл из 200 тыс. команд
+с долей ошибочных записей, импортируется в пустое SQLite-хранилище, затем
+повторно с конфликтами и выгружается обратно. Пиковая память разбора
+меряется tracemalloc отдельным проходом. Скрипт завершается с ошибкой, если
+она растёт вместе с файлом (больше MEMORY_BUDGET_MB) или если выгрузка не
+совпала с импортом.
+
+Запуск: python benchmarks/bench_command_import.py
+"""
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import SqliteCommandStore, export_commands, import_commands
+
+COMMANDS = 200_000
+CATEGORIES = 20
+INVALID_EVERY = 1000
+MEMORY_BUDGET_MB = 8.0
+
+
+def make_rows(count, action_suffix=''):
+    for i in range(count):
+        action = f"system:echo {i}{action_suffix}"
+        if i % INVALID_EVERY == 0:
+            action = f"ftp:{i}"
+        yield f"категория {i % CATEGORIES}", f"команда номер {i}", action
+
+
+def write_file(path, fmt, rows):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if fmt == 'jsonl':
+            for category, phrase, action in rows:
+                f.write(json.dumps({'category': category, 'phrase': phrase, 'action': action},
+                                   ensure_ascii=False) + '\n')
+        elif fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(('category', 'phrase', 'action'))
+            writer.writerows(rows)
+        else:
+            commands = {}
+            for category, phrase, action in rows:
+                commands.setdefault(category, {})[phrase] = action
+            json.dump(commands, f, ensure_ascii=False, indent=4)
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return result, (time.perf_counter() - started) * 1000
+
+
+def main():
+    failed = []
+    print(f"{'формат':>6} | {'файл, МБ':>8} | {'импорт, мс':>10} | {'повтор, мс':>10} | "
+          f"{'конфликтов':>10} | {'экспорт, мс':>11} | {'пик, МБ':>7}")
+    with tempfile.TemporaryDirectory() as directory:
+        for fmt in ('json', 'jsonl', 'csv'):
+            source = os.path.join(directory, f"commands.{fmt}")
+            changed = os.path.join(directory, f"changed.{fmt}")
+            exported = os.path.join(directory, f"exported.{fmt}")
+            write_file(source, fmt, make_rows(COMMANDS))
+            write_file(changed, fmt, make_rows(COMMANDS // 10, action_suffix=' v2'))
+
+            store = SqliteCommandStore(os.path.join(directory, f"{fmt}.db"))
+            report, imported = timed(lambda: import_commands(store, source))
+            again, reimported = timed(lambda: import_commands(store, changed, on_conflict='skip'))
+            count, export = timed(lambda: export_commands(store, exported))
+            expected = COMMANDS - COMMANDS // INVALID_EVERY
+            if report.added != expected or report.invalid != COMMANDS // INVALID_EVERY:
+                failed.append(f"{fmt}: импорт {report.summary()}")
+            if count != expected or len(store) != expected:
+                failed.append(f"{fmt}: выгружено {count}, в хранилище {len(store)}, ожидалось {expected}")
+            store.close()
+
+            # Пиковая память - на новом хранилище, чтобы замер не включал кэш SQLite
+            store = SqliteCommandStore(os.path.join(directory, f"{fmt}-memory.db"))
+            tracemalloc.start()
+            import_commands(store, source)
+            peak = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+            store.close()
+            if peak > MEMORY_BUDGET_MB:
+                failed.append(f"{fmt}: пик памяти {peak:.1f} МБ")
+
+            size = os.path.getsize(source) / 2**20
+            print(f"{fmt:>6} | {size:>8.1f} | {imported:>10.0f} | {reimported:>10.0f} | "
+                  f"{again.conflict_count:>10} | {export:>11.0f} | {peak:>7.1f}")
+
+    if failed:
+        sys.exit('\n'.join(failed))
+    print(f"OK: выгрузка совпала с импортом, пик памяти не больше {MEMORY_BUDGET_MB:.0f} МБ")
+
+
+if __name__ == '__main__':
+    main()
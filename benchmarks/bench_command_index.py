@@ -0,0 +1,54 @@
+"""Микро-бенчмарк поиска команды: индекс против перебора категорий.
+
+Запуск: python benchmarks/bench_command_index.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import CommandIndex
+
+SIZES = (10, 1_000, 100_000)
+CATEGORIES = 20
+LOOKUPS = 10_000
+
+
+def make_commands(count):
+    commands = {}
+    for i in range(count):
+        category = f"категория {i % CATEGORIES}"
+        commands.setdefault(category, {})[f"команда номер {i}"] = f"system:echo {i}"
+    return commands
+
+
+def scan_lookup(commands, text):
+    # Прежний путь executeCommand: обход всех категорий
+    for category, phrases in commands.items():
+        if text in phrases:
+            return phrases[text]
+    return None
+
+
+def main():
+    print(f"{'команд':>8} | {'индекс, мкс':>12} | {'перебор, мкс':>13} | {'промах, мкс':>12}")
+    for size in SIZES:
+        commands = make_commands(size)
+        index = CommandIndex()
+        index.rebuild(commands)
+
+        # Худший случай для перебора: фраза из последней категории
+        target = f"Команда номер {size - 1}!"
+        plain_target = f"команда номер {size - 1}"
+
+        hit = timeit.timeit(lambda: index.lookup(target), number=LOOKUPS) / LOOKUPS
+        scan = timeit.timeit(lambda: scan_lookup(commands, plain_target), number=LOOKUPS) / LOOKUPS
+        miss = timeit.timeit(lambda: index.lookup("несуществующая команда"), number=LOOKUPS) / LOOKUPS
+
+        assert index.lookup(target) is not None
+        print(f"{size:>8} | {hit * 1e6:>12.2f} | {scan * 1e6:>13.2f} | {miss * 1e6:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Время фильтра редактора команд на одно нажатие клавиши.
+
+Запросы набираются посимвольно в таблицу из 100 тыс. команд с подключённым
+QTableView. Каждое нажатие - setFilterText плюс обработка событий
+представления. Скрипт завершается с ошибкой, если какое-либо нажатие
+дольше 16 мс (один кадр при 60 Гц).
+
+Запуск: QT_QPA_PLATFORM=offscreen python benchmarks/bench_command_search.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication, QTableView
+
+from main import CommandTableModel
+
+COMMANDS = 100_000
+CATEGORIES = 20
+BUDGET_MS = 16.0
+QUERIES = ("команда номер 99999", "echo 4242", "категория 7", "ЗАПУСК", "несуществующая строка")
+
+
+def make_commands(count):
+    commands = {}
+    for i in range(count):
+        commands.setdefault(f"категория {i % CATEGORIES}", {})[f"команда номер {i}"] = f"system:echo {i}"
+    return commands
+
+
+def main():
+    app = QApplication(sys.argv)
+    model = CommandTableModel()
+    view = QTableView()
+    view.setModel(model)
+    view.show()
+    model.reset(make_commands(COMMANDS))
+    app.processEvents()
+
+    worst = 0.0
+    print(f"{'запрос':>24} | {'нажатий':>7} | {'среднее, мс':>11} | {'худшее, мс':>10} | {'строк':>6}")
+    for query in QUERIES:
+        timings = []
+        for length in range(1, len(query) + 1):
+            started = time.perf_counter()
+            model.setFilterText(query[:length])
+            app.processEvents()
+            timings.append((time.perf_counter() - started) * 1000)
+        model.fetchAll()
+        rows = model.rowCount()
+        model.setFilterText('')
+        app.processEvents()
+        worst = max(worst, max(timings))
+        print(f"{query:>24} | {len(timings):>7} | {sum(timings) / len(timings):>11.2f} | "
+              f"{max(timings):>10.2f} | {rows:>6}")
+
+    view.close()
+    if worst > BUDGET_MS:
+        sys.exit(f"Нажатие обрабатывалось {worst:.1f} мс, бюджет {BUDGET_MS:.0f} мс")
+    print(f"OK: не дольше {BUDGET_MS:.0f} мс на нажатие")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""Нагрузка на сервер текстовых команд: запросов в секунду и задержка.
+
+Каждое соединение шлёт запросы {"id", "text"}, не дожидаясь ответов: не
+больше --window неотвеченных на соединение, либо с общим темпом --rate
+запросов в секунду. Задержка - от записи строки до получения ответа с тем
+же id. Первые --warmup секунд (запуск процессов скриптов) не учитываются,
+в конце печатаются устойчивый темп, перцентили задержки и статусы ответов.
+
+С --spawn скрипт сам запускает main.py --headless --ipc во временном
+каталоге с тестовой командой "эхо {n}" (скрипт возвращает n), фразы
+запросов - смесь одной команды, двух через "и" и несуществующей. Без
+--spawn подключается к работающему приложению по --address, фразы - из
+--text, токен - из --token или settings.json в текущем каталоге.
+
+Запуск: python benchmarks/bench_command_server.py --spawn [--duration 10] [--connections 4]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, 'main.py')
+
+TEST_COMMAND = {'category': 'тест', 'phrase': 'эхо {n}', 'action': "script:result = slots['n']"}
+
+
+def spawn_texts():
+    for i in itertools.count():
+        if i % 10 == 8:
+            yield f"эхо {i} и эхо {i + 1}"
+        elif i % 10 == 9:
+            yield "несуществующая команда"
+        else:
+            yield f"эхо {i}"
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.server_latencies = []
+        self.statuses = {}
+        self.lost = 0
+
+    def record(self, latency, response):
+        self.latencies.append(latency)
+        self.server_latencies.append(response.get('latency_ms', 0.0))
+        status = response.get('status')
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+async def open_connection(address):
+    if address.startswith('unix:'):
+        return await asyncio.open_unix_connection(address[len('unix:'):])
+    host, _, port = address.rpartition(':')
+    return await asyncio.open_connection(host.strip('[]'), int(port))
+
+
+async def run_connection(address, token, texts, ids, warm_until, stop_at, window, interval, stats, execute):
+    reader, writer = await open_connection(address)
+    sent = {}
+    slots = asyncio.Semaphore(window)
+
+    async def read_responses():
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            response = json.loads(line)
+            started = sent.pop(response.get('id'), None)
+            if started is not None:
+                if started >= warm_until:
+                    stats.record((time.perf_counter() - started) * 1000, response)
+                slots.release()
+
+    reading = asyncio.ensure_future(read_responses())
+    next_send = time.perf_counter()
+    while time.perf_counter() < stop_at:
+        await slots.acquire()
+        if interval:
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_send += interval
+        request_id = next(ids)
+        request = {'id': request_id, 'token': token, 'text': next(texts)}
+        if not execute:
+            request['execute'] = False
+        sent[request_id] = time.perf_counter()
+        writer.write(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+        await writer.drain()
+
+    # Оставшиеся ответы ждём не дольше 10 секунд
+    deadline = time.perf_counter() + 10
+    while sent and time.perf_counter() < deadline and not reading.done():
+        await asyncio.sleep(0.01)
+    stats.lost += len(sent)
+    reading.cancel()
+    writer.close()
+
+
+async def run_load(args, texts):
+    stats = Stats()
+    ids = itertools.count(1)
+    interval = args.connections / args.rate if args.rate else 0.0
+    warm_until = time.perf_counter() + args.warmup
+    stop_at = warm_until + args.duration
+    await asyncio.gather(*(run_connection(args.address, args.token, texts, ids, warm_until, stop_at, args.window,
+                                          interval, stats, not args.no_execute)
+                           for _ in range(args.connections)))
+    return stats, time.perf_counter() - warm_until
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def spawn_app(directory, token):
+    """Приложение в фоновом режиме с тестовой командой и токеном, возвращает (процесс, адрес)"""
+    with open(os.path.join(directory, 'settings.json'), 'w', encoding='utf-8') as f:
+        json.dump({'version': 1, 'command_server_token': token}, f)
+    commands = os.path.join(directory, 'commands.jsonl')
+    with open(commands, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(TEST_COMMAND, ensure_ascii=False) + '\n')
+    subprocess.run([sys.executable, MAIN, '--import', commands], cwd=directory, check=True,
+                   stdout=subprocess.DEVNULL)
+
+    address = f"127.0.0.1:{free_port()}"
+    log = open(os.path.join(directory, 'headless.log'), 'w')
+    process = subprocess.Popen([sys.executable, MAIN, '--headless', '--ipc', address],
+                               cwd=directory, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Приложение завершилось с кодом {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', int(address.rpartition(':')[2])), timeout=0.2).close()
+            return process, address
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Сервер команд не ответил на {address} за 30 с")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(stats, elapsed):
+    count = len(stats.latencies)
+    if not count:
+        print("Ответов нет")
+        return
+    print(f"Ответов: {count} за {elapsed:.1f} с, потеряно: {stats.lost}")
+    print(f"Устойчивый темп: {count / elapsed:.0f} запросов/с")
+    print("Задержка клиента, мс: " + ', '.join(
+        f"{name} {percentile(stats.latencies, fraction):.2f}"
+        for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))) + f", max {max(stats.latencies):.2f}")
+    print(f"Задержка на сервере, мс: p50 {statistics.median(stats.server_latencies):.2f}")
+    print("Статусы: " + ', '.join(f"{status}: {n}" for status, n in sorted(stats.statuses.items(), key=str)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--address', default='localhost:8765', help='адрес работающего сервера команд')
+    parser.add_argument('--spawn', action='store_true', help='запустить приложение в фоновом режиме самому')
+    parser.add_argument('--text', action='append', help='фраза запроса, можно несколько раз')
+    parser.add_argument('--token', help='токен сервера команд (command_server_token в settings.json)')
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--window', type=int, default=32, help='неотвеченных запросов на соединение')
+    parser.add_argument('--rate', type=float, default=0.0, help='запросов в секунду на все соединения, 0 - без ограничения')
+    parser.add_argument('--duration', type=float, default=10.0, help='секунд нагрузки')
+    parser.add_argument('--warmup', type=float, default=2.0, help='секунд нагрузки без учёта в итогах')
+    parser.add_argument('--no-execute', action='store_true', help='только сопоставление, без выполнения')
+    args = parser.parse_args()
+
+    if not args.spawn and not args.text:
+        parser.error('без --spawn нужна хотя бы одна фраза --text')
+    if args.spawn:
+        args.token = secrets.token_urlsafe(24)
+    elif not args.token:
+        try:
+            with open('settings.json', encoding='utf-8') as f:
+                args.token = json.load(f)['command_server_token']
+        except (OSError, ValueError, KeyError):
+            parser.error('без --spawn нужен --token или settings.json с command_server_token')
+
+    with tempfile.TemporaryDirectory() as directory:
+        process = None
+        if args.spawn:
+            process, args.address = spawn_app(directory, args.token)
+            texts = spawn_texts()
+        else:
+            texts = itertools.cycle(args.text)
+        try:
+            stats, elapsed = asyncio.run(run_load(args, texts))
+        finally:
+            if process is not None:
+                # Обычное завершение по SIGTERM, как у службы
+                process.terminate()
+                process.wait(10)
+        report(stats, elapsed)
+        if process is not None:
+            print(f"Код выхода приложения: {process.returncode}")
+
+
+if __name__ == '__main__':
+    main()
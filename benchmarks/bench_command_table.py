@@ -0,0 +1,86 @@
+"""Таблица команд: CommandTableModel против перестроения QTableWidget.
+
+Для каждого размера замеряются полная загрузка, добавление и удаление
+одной команды. Прежний путь пересоздавал всю таблицу на каждое изменение,
+поэтому для него добавление и удаление стоят как полная загрузка.
+
+Запуск: QT_QPA_PLATFORM=offscreen python benchmarks/bench_command_table.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication, QTableView, QTableWidget, QTableWidgetItem
+
+from main import CommandTableModel
+
+SIZES = (1_000, 10_000, 100_000)
+CATEGORIES = 20
+
+
+def make_commands(count):
+    commands = {}
+    for i in range(count):
+        commands.setdefault(f"категория {i % CATEGORIES}", {})[f"команда номер {i}"] = f"system:echo {i}"
+    return commands
+
+
+def rebuild_widget(table, commands):
+    # Прежний updateCommandTable
+    table.setRowCount(0)
+    row = 0
+    for category, phrases in commands.items():
+        for phrase, action in phrases.items():
+            table.insertRow(row)
+            table.setItem(row, 0, QTableWidgetItem(category))
+            table.setItem(row, 1, QTableWidgetItem(phrase))
+            table.setItem(row, 2, QTableWidgetItem(action))
+            row += 1
+
+
+def timed(func):
+    started = time.perf_counter()
+    func()
+    QApplication.processEvents()
+    return (time.perf_counter() - started) * 1000
+
+
+def main():
+    app = QApplication(sys.argv)
+    print(f"{'строк':>8} | {'модель: загрузка':>17} | {'добавление':>11} | {'удаление':>9} | "
+          f"{'QTableWidget: загрузка':>22}")
+    for size in SIZES:
+        commands = make_commands(size)
+        model = CommandTableModel()
+        view = QTableView()
+        view.setModel(model)
+        view.show()
+
+        load = timed(lambda: model.reset(commands))
+
+        def add():
+            commands["новая"] = {"новая команда": "system:echo new"}
+            model.commandAdded("новая", "новая команда")
+
+        def remove():
+            del commands["категория 0"]["команда номер 0"]
+            model.commandRemoved("категория 0", "команда номер 0")
+
+        added = timed(add)
+        removed = timed(remove)
+
+        table = QTableWidget()
+        table.setColumnCount(3)
+        table.show()
+        widget = timed(lambda: rebuild_widget(table, commands))
+        table.close()
+        view.close()
+
+        print(f"{size:>8} | {load:>14.2f} мс | {added:>8.2f} мс | {removed:>6.2f} мс | {widget:>19.2f} мс")
+    app.quit()
+
+
+if __name__ == '__main__':
+    main()
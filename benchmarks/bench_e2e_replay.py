@@ -0,0 +1,364 @@
+"""Офлайн-прогон всего голосового конвейера на записанных WAV-файлах.
+
+Фрагменты читаются через sr.AudioFile и идут тем же путём, что и в
+VoiceThread: VAD, RecognitionPipeline, recognizeHypotheses, onRecognized,
+сигнал hypothesesDetected, MainWindow.onHypothesesDetected и executeCommand. Вместо Google
+подставляется заглушка, которая возвращает заданный текст после задержки,
+а действия и ответ голосом не выполняются, только фиксируются.
+
+Тексты берутся из transcripts.json в каталоге корпуса:
+    {"01.wav": "открой браузер", "02.wav": {"text": "время", "delay": 0.4}}
+или из файла рядом с записью с тем же именем и расширением .txt. Пустой
+текст или null означает «речь не распознана».
+
+Окно создаётся во временном каталоге, поэтому commands.db, settings.json и
+журнал пользователя не затрагиваются. Результат пишется в JSON, при
+--compare печатается сравнение с прошлым прогоном.
+
+Запуск: QT_QPA_PLATFORM=offscreen python benchmarks/bench_e2e_replay.py каталог_wav
+            [--delay 0.3] [--jitter 0.1] [--workers 2] [--repeat 5]
+            [--output e2e_results.json] [--compare прошлый.json]
+        QT_QPA_PLATFORM=offscreen python benchmarks/bench_e2e_replay.py --generate 20
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import wave
+from collections import Counter, deque
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import speech_recognition as sr
+from PyQt5.QtWidgets import QApplication
+
+from main import DEFAULT_COMMANDS, METRICS, MainWindow, RecognitionPipeline
+
+MANIFEST = 'transcripts.json'
+SAMPLE_RATE = 16000
+QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+def load_corpus(directory):
+    """Список (имя, текст или None, задержка или None)"""
+    manifest = {}
+    path = os.path.join(directory, MANIFEST)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    corpus, missing = [], []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith('.wav'):
+            continue
+        entry = manifest.get(name)
+        sidecar = os.path.join(directory, os.path.splitext(name)[0] + '.txt')
+        if entry is None and os.path.exists(sidecar):
+            with open(sidecar, 'r', encoding='utf-8') as f:
+                entry = f.read().strip()
+        if entry is None and name not in manifest:
+            missing.append(name)
+            continue
+        if isinstance(entry, dict):
+            corpus.append((name, entry.get('text') or None, entry.get('delay')))
+        else:
+            corpus.append((name, entry or None, None))
+    if missing:
+        sys.exit(f"Нет текста для записей: {', '.join(missing)}")
+    return corpus
+
+
+def generate_corpus(directory, count, seed):
+    """Синтетические фразы: гармоники с огибающей слогов и паузами по краям"""
+    rng = np.random.default_rng(seed)
+    phrases = [phrase for group in DEFAULT_COMMANDS.values() for phrase in group]
+    manifest = {}
+    for i in range(count):
+        duration = rng.uniform(0.8, 2.0)
+        t = np.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE
+        pitch = rng.uniform(110, 220)
+        voice = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 6))
+        envelope = 0.5 + 0.5 * np.sin(2 * np.pi * rng.uniform(3, 5) * t) ** 2
+        signal = voice * envelope * 0.3 + rng.normal(0, 0.005, t.size)
+        silence = np.zeros(int(0.3 * SAMPLE_RATE))
+        samples = np.concatenate([silence, signal, silence])
+        pcm = (np.clip(samples, -1, 1) * 32767).astype('<i2')
+
+        name = f'{i:04d}.wav'
+        with wave.open(os.path.join(directory, name), 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(SAMPLE_RATE)
+            f.writeframes(pcm.tobytes())
+        # Каждая десятая фраза не распознаётся, каждая седьмая не совпадает с командой
+        if i % 10 == 9:
+            manifest[name] = None
+        elif i % 7 == 6:
+            manifest[name] = f'посторонняя фраза {i}'
+        else:
+            manifest[name] = phrases[i % len(phrases)]
+    with open(os.path.join(directory, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+
+
+def read_segments(directory, corpus):
+    recognizer = sr.Recognizer()
+    segments = []
+    for name, text, delay in corpus:
+        with sr.AudioFile(os.path.join(directory, name)) as source:
+            segments.append((name, recognizer.record(source), text, delay))
+    return segments
+
+
+def distribution(values):
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+    result = {'count': len(values), 'mean': sum(values) / len(values),
+              'min': values[0], 'max': values[-1]}
+    for q in QUANTILES:
+        result[f'p{round(q * 100)}'] = values[min(len(values) - 1, int(q * len(values)))]
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def replay(app, window, segments, args):
+    voice_thread = window.voice_thread
+    voice_thread.prepare()
+    voice_thread.vad_enabled = not args.no_vad
+    voice_thread.vad.segments_total = voice_thread.vad.segments_dropped = 0
+    rng = random.Random(args.seed)
+    script = {}
+
+    def recognize_stub(audio, language):
+        text, delay = script[id(audio)]
+        time.sleep(max(0.0, delay + rng.uniform(-args.jitter, args.jitter)))
+        if text is None:
+            raise sr.UnknownValueError()
+        return text
+
+    voice_thread.recognize_backend = recognize_stub
+
+    # Действия и речь только фиксируются
+    actions = Counter()
+    window.action_executor.submit = lambda action, context=None, timeout=None, tag=None: actions.update([action.kind])
+    window.speech_worker.say = lambda text, priority=False, key=None: None
+
+    lock = threading.Lock()
+    state = {'accepted': 0, 'results': 0, 'recognized': 0, 'delivered': 0, 'submitted': False}
+    in_flight = deque()  # время записи распознанных фрагментов в порядке выдачи
+    latencies = []
+
+    def on_result(seq, captured_at, hypotheses, error):
+        with lock:
+            state['results'] += 1
+            if error is None:
+                state['recognized'] += 1
+                in_flight.append(captured_at)
+        voice_thread.onRecognized(seq, captured_at, hypotheses, error)
+
+    def after_command(hypotheses):
+        # Подключён после onHypothesesDetected, поэтому вызывается, когда команда уже отработала
+        latencies.append(time.monotonic() - in_flight.popleft())
+        state['delivered'] += 1
+
+    voice_thread.hypothesesDetected.connect(after_command)
+    pipeline = RecognitionPipeline(voice_thread.recognizeHypotheses, on_result,
+                                   workers=args.workers, max_pending=args.max_pending,
+                                   policy=args.policy)
+
+    def capture():
+        # Как VoiceThread.captureContinuous, только фрагменты берутся из файлов
+        for name, audio, text, delay in segments:
+            if voice_thread.vad_enabled and not voice_thread.vad.accept(audio):
+                continue
+            script[id(audio)] = (text, args.delay if delay is None else delay)
+            with lock:
+                state['accepted'] += 1
+            pipeline.submit(audio)
+            time.sleep(args.interval)
+        state['submitted'] = True
+
+    METRICS.reset()
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    pipeline.start()
+    capturer = threading.Thread(target=capture, name='replay-capture', daemon=True)
+    started = time.monotonic()
+    capturer.start()
+    while True:
+        app.processEvents()
+        with lock:
+            done = (state['submitted'] and state['results'] == state['accepted']
+                    and state['delivered'] == state['recognized'])
+        if done:
+            break
+        time.sleep(0.001)
+    elapsed = time.monotonic() - started
+    pipeline.stop()
+    voice_thread.hypothesesDetected.disconnect(after_command)
+
+    return {
+        'segments': len(segments),
+        'vad_rejected': voice_thread.vad.segments_dropped,
+        'accepted': state['accepted'],
+        'recognized': state['recognized'],
+        'dropped': pipeline.dropped,
+        'actions': sum(actions.values()),
+        'actions_by_kind': dict(actions),
+        'elapsed_seconds': elapsed,
+        'throughput_per_second': state['accepted'] / elapsed if elapsed else 0.0,
+        'end_to_end_seconds': distribution(latencies),
+        'stages': {stage: values for stage, values in METRICS.snapshot().items() if values['count']},
+        'python_heap_peak_bytes': tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None,
+    }
+
+
+def compare(previous, current):
+    rows = (
+        ('фраз/с', lambda r: r['throughput_per_second'], True),
+        ('e2e p50, мс', lambda r: r['end_to_end_seconds'].get('p50', 0) * 1000, False),
+        ('e2e p95, мс', lambda r: r['end_to_end_seconds'].get('p95', 0) * 1000, False),
+        ('e2e p99, мс', lambda r: r['end_to_end_seconds'].get('p99', 0) * 1000, False),
+        ('куча Python, МБ', lambda r: (r['python_heap_peak_bytes'] or 0) / 2 ** 20, False),
+        ('RSS, МБ', lambda r: (r['max_rss_bytes'] or 0) / 2 ** 20, False),
+    )
+    print(f"\nСравнение с {previous.get('revision') or 'прошлым прогоном'}:")
+    print(f"{'показатель':>16} | {'было':>10} | {'стало':>10} | {'изменение':>9}")
+    for title, value, higher_is_better in rows:
+        before, after = value(previous['results']), value(current['results'])
+        change = (after - before) / before * 100 if before else 0.0
+        better = change > 0 if higher_is_better else change < 0
+        mark = '' if abs(change) < 5 else (' +' if better else ' -')
+        print(f"{title:>16} | {before:>10.2f} | {after:>10.2f} | {change:>8.1f}%{mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory', nargs='?', help='каталог с WAV-файлами и текстами')
+    parser.add_argument('--generate', type=int, metavar='N', help='синтезировать N фраз вместо корпуса')
+    parser.add_argument('--commands', help='commands.json для прогона, по умолчанию встроенные команды')
+    parser.add_argument('--delay', type=float, default=0.3, help='задержка заглушки по умолчанию, с')
+    parser.add_argument('--jitter', type=float, default=0.0, help='разброс задержки, ±с')
+    parser.add_argument('--interval', type=float, default=0.0, help='пауза между фрагментами, с')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--max-pending', type=int, default=8)
+    parser.add_argument('--policy', default=RecognitionPipeline.POLICY_BLOCK,
+                        choices=(RecognitionPipeline.POLICY_BLOCK, RecognitionPipeline.POLICY_DROP_OLDEST))
+    parser.add_argument('--fuzzy', type=int, metavar='ПОРОГ', help='включить нечёткий поиск с порогом, %%')
+    parser.add_argument('--no-vad', action='store_true')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-trace-memory', action='store_true',
+                        help='не считать пик кучи Python (tracemalloc замедляет прогон)')
+    parser.add_argument('--output', default='e2e_results.json')
+    parser.add_argument('--compare', help='JSON прошлого прогона')
+    args = parser.parse_args()
+    if not args.directory and not args.generate:
+        parser.error('нужен каталог корпуса или --generate')
+
+    output = os.path.abspath(args.output)
+    commands = os.path.abspath(args.commands) if args.commands else None
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+
+    workdir = tempfile.mkdtemp(prefix='e2e_replay_')
+    corpus_dir = os.path.abspath(args.directory) if args.directory else os.path.join(workdir, 'corpus')
+    if args.generate:
+        os.makedirs(corpus_dir, exist_ok=True)
+        generate_corpus(corpus_dir, args.generate, args.seed)
+    corpus = load_corpus(corpus_dir)
+    if not corpus:
+        sys.exit('В каталоге нет WAV-файлов')
+    segments = read_segments(corpus_dir, corpus) * args.repeat
+
+    cwd = os.getcwd()
+    app = QApplication(sys.argv)
+    try:
+        # Окно со своими commands.db, settings.json и журналом
+        os.chdir(workdir)
+        if commands:
+            shutil.copy(commands, 'commands.json')
+        window = MainWindow()
+        if args.fuzzy is not None:
+            window.fuzzy_matching.setChecked(True)
+            window.fuzzy_threshold.setValue(args.fuzzy)
+        METRICS.enabled = True
+        if not args.no_trace_memory:
+            tracemalloc.start()
+        try:
+            results = replay(app, window, segments, args)
+        finally:
+            tracemalloc.stop()
+            window.shutdown()
+            for handler in window.log_listener.handlers:
+                handler.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results['max_rss_bytes'] = None
+    if resource is not None:
+        # В Linux ru_maxrss в килобайтах, в macOS в байтах
+        scale = 1 if sys.platform == 'darwin' else 1024
+        results['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus': args.directory or f'generated:{args.generate}',
+        'parameters': {key: value for key, value in vars(args).items()
+                       if key not in ('directory', 'output', 'compare')},
+        'results': results,
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+
+    e2e = results['end_to_end_seconds']
+    print(f"Фрагментов: {results['segments']}, отсеяно VAD: {results['vad_rejected']}, "
+          f"распознано: {results['recognized']}, отброшено: {results['dropped']}, "
+          f"действий: {results['actions']}")
+    print(f"Время: {results['elapsed_seconds']:.2f} с, {results['throughput_per_second']:.2f} фраз/с")
+    if e2e['count']:
+        print("От записи до действия, мс: " + ", ".join(
+            f"{key} {e2e[key] * 1000:.1f}" for key in ('mean', 'p50', 'p90', 'p95', 'p99', 'max')))
+    for stage, values in results['stages'].items():
+        print(f"  {stage:>10}: p50 {values['p50'] * 1000:.2f} мс, p95 {values['p95'] * 1000:.2f} мс "
+              f"({values['count']})")
+    if results['python_heap_peak_bytes'] is not None:
+        print(f"Пик кучи Python: {results['python_heap_peak_bytes'] / 2 ** 20:.1f} МБ")
+    if results['max_rss_bytes'] is not None:
+        print(f"Пик RSS процесса: {results['max_rss_bytes'] / 2 ** 20:.1f} МБ")
+    print(f"Результаты: {output}")
+    if previous is not None:
+        compare(previous, report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Бенчмарк нечёткого сопоставления: индекс триграмм против полного перебора.
+
+Запуск: python benchmarks/bench_fuzzy_match.py [число фраз]
+"""
+import difflib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import CommandIndex, normalize_phrase
+
+VERBS = ['открыть', 'закрыть', 'запустить', 'включить', 'выключить',
+         'показать', 'найти', 'перейти на', 'сделать', 'поставить']
+LETTERS = 'абвгдежзиклмнопрстуфхцчшэюя'
+THRESHOLD = 0.7
+QUERIES = 1000
+BRUTE_FORCE_QUERIES = 20
+
+
+def make_commands(count, rng):
+    words = [''.join(rng.choice(LETTERS) for _ in range(rng.randint(4, 9))) for _ in range(3000)]
+    commands = {}
+    for i in range(count):
+        phrase = f"{rng.choice(VERBS)} {rng.choice(words)} {rng.choice(words)}"
+        commands.setdefault(f"категория {i % 30}", {})[phrase] = f"system:echo {i}"
+    return commands
+
+
+def mishear(phrase, rng):
+    # Одна ошибочно распознанная буква, как у recognize_google
+    i = rng.randrange(len(phrase))
+    return phrase[:i] + rng.choice('аоеи') + phrase[i + 1:]
+
+
+def brute_force(keys, query):
+    return max(keys, key=lambda key: difflib.SequenceMatcher(None, query, key).ratio())
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    rng = random.Random(42)
+    commands = make_commands(count, rng)
+    phrases = [phrase for category in commands.values() for phrase in category]
+
+    queries = [mishear(rng.choice(phrases), rng) for _ in range(QUERIES)]
+
+    # Индекс триграмм строится в фоне после rebuild(): первый запрос сразу
+    # после загрузки ждёт его, запрос после построения - нет
+    index = CommandIndex()
+    started = time.perf_counter()
+    index.rebuild(commands)
+    rebuilt = time.perf_counter()
+    index.match(queries[0], THRESHOLD)
+    first = time.perf_counter()
+    print(f"Фраз: {len(index)}, rebuild: {(rebuilt - started) * 1e3:.1f} мс, "
+          f"первый нечёткий запрос сразу после него: {(first - rebuilt) * 1e3:.1f} мс")
+
+    index = CommandIndex()
+    index.rebuild(commands)
+    started = time.perf_counter()
+    index.waitFuzzy()
+    print(f"Фоновое построение индекса триграмм: ещё {(time.perf_counter() - started) * 1e3:.1f} мс после rebuild")
+    started = time.perf_counter()
+    index.match(queries[0], THRESHOLD)
+    print(f"Первый нечёткий запрос после построения: {(time.perf_counter() - started) * 1e3:.3f} мс")
+
+    started = time.perf_counter()
+    hits = sum(index.match(query, THRESHOLD)[0] is not None for query in queries)
+    elapsed = time.perf_counter() - started
+    print(f"Индекс: {elapsed / QUERIES * 1e3:.3f} мс на запрос, найдено {hits}/{QUERIES}")
+
+    keys = [normalize_phrase(phrase) for phrase in phrases]
+    started = time.perf_counter()
+    for query in queries[:BRUTE_FORCE_QUERIES]:
+        brute_force(keys, normalize_phrase(query))
+    elapsed = time.perf_counter() - started
+    print(f"Перебор: {elapsed / BRUTE_FORCE_QUERIES * 1e3:.1f} мс на запрос")
+
+    # Инкрементальное обновление, как при правке в редакторе команд
+    started = time.perf_counter()
+    index.add("новые", "открыть новую команду", "url:https://example.com")
+    index.remove("новые", "открыть новую команду")
+    print(f"Добавление и удаление фразы: {(time.perf_counter() - started) * 1e3:.3f} мс")
+
+
+if __name__ == '__main__':
+    main()
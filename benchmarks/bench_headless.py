@@ -0,0 +1,87 @@
+"""Запуск окна и фонового режима (--headless): время и память.
+
+Каждый режим запускается RUNS раз с --profile-startup в пустом временном
+каталоге: приложение печатает профиль этапов и выходит, как только
+готово слушать (распознаватель и список устройств загружены). Из профиля
+берётся момент готовности, снаружи меряется полное время процесса и пик
+RSS (os.wait4, только Linux и macOS). В таблице - медианы.
+
+Запуск: QT_QPA_PLATFORM=offscreen python benchmarks/bench_headless.py [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, 'main.py')
+READY = 'фоновая инициализация завершена'
+
+MODES = (
+    ('окно', []),
+    ('--headless', ['--headless']),
+)
+
+
+def run_once(extra, directory):
+    """(готовность по профилю, мс; время процесса, мс; пик RSS, МБ или None)"""
+    # -X importtime отключает повторный запуск для профиля импортов внутри --profile-startup
+    command = [sys.executable, '-X', 'importtime', MAIN, '--profile-startup'] + extra
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=directory, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, text=True)
+    output = process.stdout.read()
+    if hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        # В Linux ru_maxrss в килобайтах, в macOS в байтах
+        rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024) / 2 ** 20
+    else:
+        process.wait()
+        rss = None
+    elapsed = (time.perf_counter() - started) * 1000
+    if process.returncode:
+        raise RuntimeError(f"{' '.join(extra) or 'окно'}: код выхода {process.returncode}\n{output}")
+
+    ready = None
+    for line in output.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 4 and fields[3] == READY:
+            ready = float(fields[0])
+    if ready is None:
+        raise RuntimeError(f"В профиле нет этапа '{READY}':\n{output}")
+    return ready, elapsed, rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    for name, extra in MODES:
+        samples = []
+        for _ in range(args.runs):
+            with tempfile.TemporaryDirectory() as directory:
+                samples.append(run_once(extra, directory))
+        results[name] = [statistics.median(values) if None not in values else None
+                         for values in zip(*samples)]
+
+    print(f"{'режим':>12} | {'готовность, мс':>14} | {'процесс, мс':>11} | {'пик RSS, МБ':>11}")
+    for name, (ready, elapsed, rss) in results.items():
+        memory = f"{rss:>11.1f}" if rss is not None else f"{'-':>11}"
+        print(f"{name:>12} | {ready:>14.1f} | {elapsed:>11.1f} | {memory}")
+
+    gui, headless = results['окно'], results['--headless']
+    print(f"\nФоновый режим: готовность {headless[0] - gui[0]:+.1f} мс", end='')
+    if gui[2] is not None:
+        print(f", память {headless[2] - gui[2]:+.1f} МБ ({(headless[2] / gui[2] - 1) * 100:+.0f}%)")
+    else:
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""Несколько команд в одной фразе: разбиение и параллельное выполнение.
+
+Сначала проверяется разбиение фраз на этапы, общее подтверждение и
+сопоставление фраз, где параметр шаблона мог бы захватить следующую
+команду ("громкость 5 потом открыть блокнот"). Затем
+через ActionExecutor выполняются скрипты, каждый из которых спит DELAY
+секунд: независимые действия должны уложиться примерно в одну задержку,
+"потом" - в сумму задержек этапов, а ошибка на этапе - отменить следующие.
+Скрипт завершается с ошибкой, если разбиение или время не совпали.
+
+Запуск: QT_QPA_PLATFORM=offscreen python benchmarks/bench_multi_command.py
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtCore import QCoreApplication, Qt
+
+from main import (ActionExecutor, AssistantCore, CommandIndex, ParsedAction, UtteranceSplitter,
+                  combine_replies)
+
+DELAY = 0.2
+TOLERANCE = 0.1
+
+SPLITS = (
+    ("открыть браузер", [["открыть браузер"]]),
+    ("открыть браузер и открыть блокнот", [["открыть браузер", "открыть блокнот"]]),
+    ("Открыть браузер И открыть блокнот, а также выключить звук",
+     [["Открыть браузер", "открыть блокнот", "выключить звук"]]),
+    ("открыть браузер потом открыть блокнот", [["открыть браузер"], ["открыть блокнот"]]),
+    ("открыть браузер и открыть почту и потом открыть блокнот затем выключить компьютер",
+     [["открыть браузер", "открыть почту"], ["открыть блокнот"], ["выключить компьютер"]]),
+    ("потом открыть блокнот и", [["открыть блокнот"]]),
+    # Союз внутри слова не разделяет фразу
+    ("играть музыку", [["играть музыку"]]),
+)
+
+REPLIES = (
+    ([["Открываю браузер"]], "Открываю браузер"),
+    ([["Открываю браузер", "Открываю блокнот"]], "Открываю браузер и открываю блокнот"),
+    ([["Выполняю скрипт", "Выполняю скрипт"], ["Открываю блокнот"]], "Выполняю скрипт, потом открываю блокнот"),
+)
+
+
+TEMPLATE_COMMANDS = {
+    'система': {'громкость {n}': 'system:vol {n}', 'открыть блокнот': 'app:notepad'},
+    'интернет': {'открыть сайт {site}': 'url:https://{site}', 'найти {query}': 'url:https://ya.ru/?q={query}'},
+}
+
+# Фраза -> этапы действий после сопоставления
+TEMPLATE_CASES = (
+    ("громкость 5 потом открыть блокнот", [["vol 5"], ["notepad"]]),
+    ("открыть сайт youtube.com и открыть блокнот", [["https://youtube.com", "notepad"]]),
+    ("громкость 5", [["vol 5"]]),
+    # Второй фрагмент не команда - союз остаётся частью параметра
+    ("найти кошки и собаки", [["https://ya.ru/?q=%D0%BA%D0%BE%D1%88%D0%BA%D0%B8%20%D0%B8%20"
+                               "%D1%81%D0%BE%D0%B1%D0%B0%D0%BA%D0%B8"]]),
+)
+
+
+class Matcher(AssistantCore):
+    """Только сопоставление команд, без окна и исполнителя"""
+
+    def __init__(self, commands):
+        self.command_index = CommandIndex()
+        self.command_index.rebuild(commands)
+        self.command_splitter = UtteranceSplitter()
+
+
+def check_templates():
+    failed = []
+    matcher = Matcher(TEMPLATE_COMMANDS)
+    texts = [text for text, _ in TEMPLATE_CASES]
+    for (text, expected), stages in zip(TEMPLATE_CASES, matcher.matchStages(texts, None)):
+        actions = [[entry.action.argument if entry else None for _, entry, _ in stage] for stage in stages]
+        if actions != expected:
+            failed.append(f"{text!r}: {actions}, ожидалось {expected}")
+    print(f"Шаблоны и союзы: {len(TEMPLATE_CASES)} фраз")
+    return failed
+
+
+def check_splitting():
+    failed = []
+    splitter = UtteranceSplitter()
+    for text, expected in SPLITS:
+        stages = splitter.split(text)
+        if stages != expected:
+            failed.append(f"{text!r}: {stages}, ожидалось {expected}")
+    custom = UtteranceSplitter(['плюс']).split("открыть браузер плюс открыть блокнот и ещё")
+    if custom != [["открыть браузер", "открыть блокнот и ещё"]]:
+        failed.append(f"свои союзы: {custom}")
+    for stages, expected in REPLIES:
+        reply = combine_replies(stages)
+        if reply != expected:
+            failed.append(f"подтверждение {reply!r}, ожидалось {expected!r}")
+    print(f"Разбиение: {len(SPLITS) + 1} фраз, подтверждения: {len(REPLIES)}")
+    return failed
+
+
+def run_stages(executor, stages):
+    """Время до завершения всех действий и их итоги"""
+    total = sum(map(len, stages))
+    results = []
+    done = threading.Event()
+
+    def finished(result):
+        results.append(result)
+        if len(results) == total:
+            done.set()
+
+    # Итоги приходят из потоков исполнителя, цикл событий здесь не крутится
+    executor.actionFinished.connect(finished, Qt.DirectConnection)
+    started = time.perf_counter()
+    executor.submitStages(stages)
+    done.wait(10)
+    elapsed = time.perf_counter() - started
+    executor.actionFinished.disconnect(finished)
+    return elapsed, results
+
+
+def check_dispatch():
+    sleep = f"import time; time.sleep({DELAY})"
+    broken = "raise RuntimeError('ошибка')"
+
+    def action(source):
+        return ParsedAction('script', source, f'script:{source}'), {'slots': {}}
+
+    executor = ActionExecutor(max_concurrent=4)
+    cases = (
+        ("3 независимых", [[action(sleep)] * 3], DELAY),
+        ("2 и потом 1", [[action(sleep)] * 2, [action(sleep)]], 2 * DELAY),
+        ("1 потом 1 потом 1", [[action(sleep)], [action(sleep)], [action(sleep)]], 3 * DELAY),
+    )
+    failed = []
+    print(f"{'этапы':>18} | {'время, мс':>9} | {'ожидалось, мс':>13} | {'последовательно, мс':>19}")
+    for name, stages, expected in cases:
+        elapsed, results = run_stages(executor, stages)
+        sequential = sum(map(len, stages)) * DELAY
+        print(f"{name:>18} | {elapsed * 1000:>9.0f} | {expected * 1000:>13.0f} | {sequential * 1000:>19.0f}")
+        if abs(elapsed - expected) > TOLERANCE or any(r.status != ActionExecutor.STATUS_OK for r in results):
+            failed.append(f"{name}: {elapsed * 1000:.0f} мс, ожидалось {expected * 1000:.0f} мс")
+
+    # Ошибка на первом этапе отменяет второй, независимое действие первого этапа выполняется
+    elapsed, results = run_stages(executor, [[action(broken), action(sleep)], [action(sleep)]])
+    statuses = sorted(r.status for r in results)
+    expected = sorted([ActionExecutor.STATUS_ERROR, ActionExecutor.STATUS_OK, ActionExecutor.STATUS_CANCELLED])
+    print(f"{'ошибка, потом 1':>18} | {elapsed * 1000:>9.0f} | {', '.join(statuses)}")
+    if statuses != expected:
+        failed.append(f"ошибка на этапе: {statuses}, ожидалось {expected}")
+    executor.shutdown()
+    return failed
+
+
+def main():
+    app = QCoreApplication(sys.argv)
+    failed = check_splitting()
+    failed += check_templates()
+    failed += check_dispatch()
+    app.quit()
+    if failed:
+        sys.exit('\n'.join(failed))
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Выбор среди вариантов распознавания: сколько фраз не придётся повторять.
+
+Распознаватель отдаёт несколько вариантов (recognize_google с show_all=True).
+Для набора таких ответов сравнивается команда, которую дал бы только первый
+вариант, и команда, выбранная AssistantCore.onHypothesesDetected по всем
+вариантам. Проверка идёт без нечёткого сопоставления и с порогом 75%.
+Затем меряется время сопоставления пяти вариантов одним проходом
+(matchStages) против отдельного executeCommand на каждый вариант на индексе
+из COMMANDS команд. Скрипт завершается с ошибкой, если выбрана не та команда.
+
+Запуск: python benchmarks/bench_nbest.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import AssistantCore, CommandIndex, UtteranceSplitter, parse_hypotheses
+
+COMMANDS = 5000
+REPEAT = 2000
+
+BASE_COMMANDS = {
+    'браузер': {'открыть браузер': 'url:http://google.com', 'закрыть браузер': 'system:taskkill /im chrome.exe'},
+    'приложения': {'открыть блокнот': 'app:notepad', 'открыть калькулятор': 'app:calc'},
+    'звук': {'выключить звук': 'system:nircmd mutesysvolume 1', 'громкость {n}': 'system:nircmd setsysvolume {n}'},
+}
+
+
+def google(*alternatives):
+    """Ответ recognize_google(show_all=True): уверенность есть только у первого варианта"""
+    first, *rest = alternatives
+    return {'alternative': [{'transcript': first[0], 'confidence': first[1]}]
+            + [{'transcript': text} for text in rest], 'final': True}
+
+
+# (ответ распознавателя, ожидаемые фразы команд; пустой список - команды нет)
+CASES = (
+    (google(("открыть браузер", 0.93), "открыть браузера"), ["открыть браузер"]),
+    (google(("открыть брауз", 0.71), "открыть браузер", "открыть брауза"), ["открыть браузер"]),
+    (google(("открыть блокнод", 0.64), "открыть блокнот"), ["открыть блокнот"]),
+    (google(("выключи звук", 0.58), "выключить звук", "выключил звук"), ["выключить звук"]),
+    (google(("громкость сорок", 0.80), "громкость 40"), ["громкость {n}"]),
+    (google(("открыть браузер и открыть блокнод", 0.66), "открыть браузер и открыть блокнот"),
+     ["открыть браузер", "открыть блокнот"]),
+    (google(("закрыть браузер", 0.88), "открыть браузер"), ["закрыть браузер"]),
+    (google(("какая погода", 0.90), "какая погода в москве"), []),
+)
+
+
+class Assistant(AssistantCore):
+    """Только сопоставление: без окна, речи и исполнителя"""
+
+    def __init__(self, commands, threshold):
+        self.command_index = CommandIndex()
+        self.command_index.rebuild(commands)
+        self.command_splitter = UtteranceSplitter()
+        self.threshold = threshold
+        self.log = []
+        self.chosen = None
+
+    def fuzzyThreshold(self):
+        return self.threshold
+
+    def logMessage(self, message):
+        self.log.append(message)
+
+    def executeCommand(self, text, tag=None, execute=True, confirm=True, matches=None):
+        dispatch = super().executeCommand(text, execute=False, matches=matches)
+        self.chosen = [entry.phrase for _, entry, _ in dispatch.matches if entry is not None]
+        return dispatch
+
+
+def check_parsing():
+    failed = []
+    hypotheses = parse_hypotheses(google(("Открыть Браузер", 0.9), "открыть браузер", "открыть брауза"))
+    if [(h.text, h.confidence, h.rank) for h in hypotheses] != [("открыть браузер", 0.9, 0), ("открыть брауза", None, 1)]:
+        failed.append(f"разбор ответа: {hypotheses}")
+    if [h.text for h in parse_hypotheses("Открыть Блокнот")] != ["открыть блокнот"]:
+        failed.append("разбор строки")
+    for empty in ([], {}, {'alternative': []}):
+        try:
+            parse_hypotheses(empty)
+            failed.append(f"пустой ответ {empty!r} не отклонён")
+        except Exception as e:
+            if type(e).__name__ != 'UnknownValueError':
+                failed.append(f"пустой ответ {empty!r}: {e!r}")
+    return failed
+
+
+def check_choice(threshold):
+    assistant = Assistant(BASE_COMMANDS, threshold)
+    failed = []
+    top_correct = chosen_correct = moved = 0
+    for response, expected in CASES:
+        hypotheses = parse_hypotheses(response)
+        top = [entry.phrase for _, entry, _ in
+               (m for stage in assistant.matchStages([hypotheses[0].text], threshold)[0] for m in stage)
+               if entry is not None]
+        assistant.onHypothesesDetected(hypotheses)
+        top_correct += top == expected
+        chosen_correct += assistant.chosen == expected
+        moved += '(вариант 1 ' not in assistant.log[-1] and len(hypotheses) > 1
+        if assistant.chosen != expected:
+            failed.append(f"порог {threshold}: {assistant.log[-1]} -> {assistant.chosen}, ожидалось {expected}")
+    name = f"{threshold:.0%}" if threshold else "нет"
+    print(f"{name:>14} | {f'{top_correct}/{len(CASES)}':>14} | {f'{chosen_correct}/{len(CASES)}':>12} | {moved:>16}")
+    return failed
+
+
+def check_speed():
+    commands = {f"категория {i % 20}": {} for i in range(20)}
+    for i in range(COMMANDS):
+        commands[f"категория {i % 20}"][f"команда номер {i}"] = f"system:echo {i}"
+    assistant = Assistant(commands, 0.75)
+    texts = [f"команда номер {n}" for n in (17, 170, 1700)] + ["команда номер семнадцать", "команда намер 17"]
+    assistant.command_index.waitFuzzy()  # фоновое построение индекса триграмм не входит в замер
+
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        assistant.matchStages(texts, 0.75)
+    batched = (time.perf_counter() - started) / REPEAT * 1e6
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        for text in texts:
+            super(Assistant, assistant).executeCommand(text, execute=False)
+    separate = (time.perf_counter() - started) / REPEAT * 1e6
+    print(f"\n{len(texts)} вариантов, индекс из {COMMANDS} команд: одним проходом {batched:.0f} мкс, "
+          f"по одному {separate:.0f} мкс")
+
+
+def main():
+    failed = check_parsing()
+    print(f"{'нечёткий порог':>14} | {'первый вариант':>14} | {'все варианты':>12} | {'выбран не первый':>16}")
+    failed += check_choice(None)
+    failed += check_choice(0.75)
+    check_speed()
+    if failed:
+        sys.exit('\n'.join(failed))
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
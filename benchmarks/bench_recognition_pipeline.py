@@ -0,0 +1,94 @@
+"""Пропускная способность конвейера распознавания на записанных WAV-файлах.
+
+Фрагменты из каталога подаются в RecognitionPipeline подряд, как команды,
+сказанные одна за другой. По умолчанию вместо Google используется заглушка
+с фиксированной задержкой.
+
+Запуск: python benchmarks/bench_recognition_pipeline.py каталог_wav [--google] [--delay 0.8]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import speech_recognition as sr
+
+from main import RecognitionPipeline
+
+
+def load_segments(directory):
+    recognizer = sr.Recognizer()
+    segments = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith('.wav'):
+            with sr.AudioFile(os.path.join(directory, name)) as source:
+                segments.append((name, recognizer.record(source)))
+    return segments
+
+
+def run(segments, recognize, workers, policy, max_pending, interval):
+    results = []
+    finished = threading.Event()
+
+    def on_result(seq, captured_at, text, error):
+        results.append((seq, time.monotonic() - captured_at, error))
+        if len(results) == len(segments):
+            finished.set()
+
+    pipeline = RecognitionPipeline(recognize, on_result, workers=workers,
+                                   max_pending=max_pending, policy=policy)
+    pipeline.start()
+    started = time.monotonic()
+    for _, audio in segments:
+        pipeline.submit(audio)
+        # Пауза между командами - время самой фразы, запись не ждёт распознавания
+        time.sleep(interval)
+    finished.wait(timeout=600)
+    elapsed = time.monotonic() - started
+    pipeline.stop()
+
+    assert [seq for seq, _, _ in results] == sorted(seq for seq, _, _ in results)
+    latencies = sorted(latency for _, latency, error in results if error is None)
+    p50 = latencies[len(latencies) // 2] if latencies else 0.0
+    return elapsed, len(latencies), pipeline.dropped, p50
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory')
+    parser.add_argument('--google', action='store_true', help='распознавать через recognize_google')
+    parser.add_argument('--delay', type=float, default=0.8, help='задержка заглушки, с')
+    parser.add_argument('--interval', type=float, default=0.2, help='пауза между фрагментами, с')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-pending', type=int, default=8)
+    args = parser.parse_args()
+
+    segments = load_segments(args.directory) * args.repeat
+    if not segments:
+        sys.exit('В каталоге нет WAV-файлов')
+
+    if args.google:
+        recognizer = sr.Recognizer()
+
+        def recognize(audio):
+            return recognizer.recognize_google(audio, language='ru-RU')
+    else:
+        def recognize(audio):
+            time.sleep(args.delay)
+            return 'заглушка'
+
+    print(f"Фрагментов: {len(segments)}")
+    print(f"{'потоки':>6} | {'политика':>12} | {'время, с':>8} | {'фраз/с':>6} | {'распознано':>10} | {'отброшено':>9} | {'p50, с':>6}")
+    for policy in (RecognitionPipeline.POLICY_BLOCK, RecognitionPipeline.POLICY_DROP_OLDEST):
+        for workers in (1, 2, 4, 8):
+            elapsed, done, dropped, p50 = run(segments, recognize, workers, policy,
+                                              args.max_pending, args.interval)
+            print(f"{workers:>6} | {policy:>12} | {elapsed:>8.2f} | {done / elapsed:>6.2f} | "
+                  f"{done:>10} | {dropped:>9} | {p50:>6.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Задержка script:-действий от запуска до завершения.
+
+Сравниваются три пути:
+  exec       - прежний: exec исходного текста в процессе GUI на каждый запуск;
+  кэш кода   - exec скомпилированного один раз кода из ScriptCache;
+  процессы   - ScriptProcessPool: код по хэшу в заранее запущенном процессе.
+
+Затем проверяется вытеснение: через процесс проходит больше
+CODES_PER_WORKER разных скриптов, после чего вытесненные скрипты
+запускаются снова. Процесс должен пережить это и вернуть верные результаты,
+иначе скрипт завершается с ошибкой.
+
+Запуск: python benchmarks/bench_script_actions.py
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import ScriptCache, ScriptProcessPool
+
+SCRIPTS = {
+    'присваивание': "result = 1",
+    'строки': "result = ' '.join(word.capitalize() for word in 'открыть сайт youtube'.split())",
+    'json': "import json\nresult = json.dumps({'slots': slots, 'items': list(range(50))})",
+    'цикл 10k': "total = 0\nfor i in range(10000):\n    total += i * i\nresult = total",
+    'функции': ("def volume(n):\n    return max(0, min(100, int(n)))\n"
+                "levels = []\nfor value in ('10', '150', '-5', slots['n']):\n"
+                "    levels.append(volume(value))\nresult = levels"),
+}
+RUNS = 300
+SLOTS = {'site': 'youtube.com', 'n': '42'}
+
+
+def measure(run):
+    timings = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+def check_eviction(cache, pool, never):
+    """Вытесненный из кэша процесса скрипт передаётся ему заново"""
+    sources = [f"result = slots['n'] + {i}" for i in range(ScriptProcessPool.CODES_PER_WORKER + 44)]
+    failed = []
+    for round_ in range(2):
+        for i, source in enumerate(sources):
+            status, result, error = pool.run(cache.get(source), {'n': 1}, time.monotonic() + 10, never)
+            if error is not None or result != i + 1:
+                failed.append(f"проход {round_ + 1}, скрипт {i}: {status} {result!r} {error}")
+    print(f"\nВытеснение: {len(sources)} разных скриптов дважды, "
+          f"лимит кэша {ScriptProcessPool.CODES_PER_WORKER}: {'OK' if not failed else 'ошибки'}")
+    return failed
+
+
+def main():
+    cache = ScriptCache()
+    pool = ScriptProcessPool(size=1)
+    started = time.perf_counter()
+    pool.start()
+    never = threading.Event()
+    # Первый вызов ждёт окончания запуска процесса
+    pool.run(cache.get("result = None"), {}, time.monotonic() + 60, never)
+    print(f"Запуск процесса с импортами: {(time.perf_counter() - started) * 1000:.0f} мс\n")
+
+    print(f"{'скрипт':>14} | {'exec, мкс':>16} | {'кэш кода, мкс':>16} | {'процессы, мкс':>16}")
+    print(f"{'':>14} | {'p50 / p95':>16} | {'p50 / p95':>16} | {'p50 / p95':>16}")
+    try:
+        for name, source in SCRIPTS.items():
+            def run_exec():
+                exec(source, globals(), {'slots': SLOTS})
+
+            def run_cached():
+                exec(cache.get(source)[1], globals(), {'slots': SLOTS})
+
+            def run_pool():
+                status, _, error = pool.run(cache.get(source), SLOTS, time.monotonic() + 10, never)
+                assert error is None, error
+
+            cells = []
+            for run in (run_exec, run_cached, run_pool):
+                p50, p95 = measure(run)
+                cells.append(f"{p50 * 1e6:>7.1f} / {p95 * 1e6:<7.1f}")
+            print(f"{name:>14} | " + " | ".join(f"{cell:>16}" for cell in cells))
+        failed = check_eviction(cache, pool, never)
+    finally:
+        pool.shutdown()
+    if failed:
+        sys.exit('\n'.join(failed[:10]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Проверка, что цикл событий Qt не блокируется во время длинной фразы.
+
+Таймер тикает каждые 10 мс, пока SpeechWorker с кэшем речи прогревает
+кэш постоянных фраз, произносит длинный текст и затем фразу из кэша.
+Максимальный разрыв между тиками должен оставаться в пределах пары кадров,
+а обе фразы - прозвучать до таймаута (зависший прогрев кэша их не пустит).
+
+Запуск: python benchmarks/check_speech_nonblocking.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtCore import QCoreApplication, Qt, QTimer
+
+from main import CACHED_PHRASES, SpeechCache, SpeechWorker
+
+LONG_PHRASE = ("Это длинная фраза для проверки того, что интерфейс продолжает "
+               "обрабатывать события, пока ассистент говорит. ") * 5
+MAX_GAP_MS = 50
+TIMEOUT_MS = 120_000
+
+
+def main():
+    app = QCoreApplication(sys.argv)
+    worker = SpeechWorker(SpeechCache())
+    ticks = []
+    finished = []
+
+    timer = QTimer()
+    timer.timeout.connect(lambda: ticks.append(time.perf_counter()))
+    timer.start(10)
+
+    def on_finished(text, completed):
+        finished.append(text)
+        if len(finished) == 2:
+            timer.stop()
+            QTimer.singleShot(0, app.quit)
+
+    def on_error(error):
+        print(f"Ошибка синтеза: {error}")
+        # Ошибка может прийти до app.exec_(), а quit() вне цикла событий ничего не делает
+        QTimer.singleShot(0, app.quit)
+
+    worker.phraseFinished.connect(on_finished, Qt.QueuedConnection)
+    worker.speechError.connect(on_error, Qt.QueuedConnection)
+    worker.start()
+
+    started = time.perf_counter()
+    worker.say(LONG_PHRASE)
+    worker.say(CACHED_PHRASES[0])
+    enqueue_ms = (time.perf_counter() - started) * 1000
+    QTimer.singleShot(TIMEOUT_MS, app.quit)
+    app.exec_()
+    worker.shutdown()
+
+    gaps = [(b - a) * 1000 for a, b in zip(ticks, ticks[1:])]
+    max_gap = max(gaps) if gaps else float('inf')
+    print(f"Постановка в очередь: {enqueue_ms:.2f} мс")
+    print(f"Длительность речи: {time.perf_counter() - started:.1f} с, тиков таймера: {len(ticks)}")
+    print(f"Максимальный разрыв между тиками: {max_gap:.1f} мс")
+    if len(finished) < 2:
+        sys.exit(f"Прозвучало фраз: {len(finished)} из 2 за {TIMEOUT_MS // 1000} с")
+    if max_gap > MAX_GAP_MS:
+        sys.exit(f"Цикл событий блокировался дольше {MAX_GAP_MS} мс")
+    print("OK: цикл событий не блокировался")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,118 @@
+import time
+
+# Начало отсчёта для профиля запуска
+_MODULE_STARTED = time.perf_counter()
+
 import warnings
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
 from PyQt5.QtWidgets import *
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QSize
+from PyQt5.QtCore import Qt, QCoreApplication, QObject, QSocketNotifier, QThread, QTimer, pyqtSignal, QSize, QAbstractTableModel, QAbstractListModel, QModelIndex
 from PyQt5.QtGui import QIcon, QFont, QKeyEvent
-import speech_recognition as sr
-import pyttsx3
+import importlib
 import json
 import os
+import re
+import math
+import queue
+import threading
+import bisect
+import subprocess
+import multiprocessing
+import marshal
+import pickle
+import traceback
+import hashlib
+import tempfile
+import wave
 import logging
+import logging.handlers
+import sqlite3
+import csv
+import argparse
+import socket
+import signal
+import secrets
+import hmac
+import ctypes
+from collections import namedtuple, deque, OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
-import pyautogui
-import webbrowser
 import sys
+from urllib.parse import quote
 import winreg as reg
-import sounddevice as sd
+
+
+class StartupProfile:
+    """Этапы запуска и ленивые импорты, время от начала загрузки модуля.
+
+    Замеры пишутся всегда, их немного; отчёт печатается по флагу
+    --profile-startup.
+    """
+
+    def __init__(self, started):
+        self.started = started
+        self.events = []  # (начало, длительность или None, поток, название)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, started, time.perf_counter() - started)
+
+    def mark(self, name):
+        self.add(name, time.perf_counter(), None)
+
+    def add(self, name, started, duration):
+        with self._lock:
+            self.events.append((started - self.started, duration, threading.current_thread().name, name))
+
+    def report(self):
+        lines = ["Профиль запуска, мс от начала загрузки модуля:",
+                 f"{'начало':>9} | {'длит.':>8} | {'поток':<16} | этап"]
+        with self._lock:
+            events = sorted(self.events)
+        for offset, duration, thread, name in events:
+            length = f"{duration * 1000:.1f}" if duration is not None else ''
+            lines.append(f"{offset * 1000:>9.1f} | {length:>8} | {thread[:16]:<16} | {name}")
+        return '\n'.join(lines)
+
+
+STARTUP = StartupProfile(_MODULE_STARTED)
+
+
+class LazyModule:
+    """Модуль, который импортируется при первом обращении к атрибуту.
+
+    Тяжёлые зависимости (распознавание, синтез речи, звук, numpy) нужны не
+    для показа окна, поэтому их импорт откладывается до первого
+    использования или до фоновой инициализации после показа окна.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            with STARTUP.phase(f"import {self._name}"):
+                self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self.load(), attribute)
+
+
+sr = LazyModule('speech_recognition')
+pyttsx3 = LazyModule('pyttsx3')
+webbrowser = LazyModule('webbrowser')
+sd = LazyModule('sounddevice')
+np = LazyModule('numpy')
+asyncio = LazyModule('asyncio')
 
 
 class ThemeManager:
@@ -51,11 +148,11 @@ class ThemeManager:
             QPushButton:hover {
                 background-color: #1976D2;
             }
-            QTableWidget {
+            QTableView {
                 background: white;
                 border: 1px solid #ddd;
             }
-            QTextEdit {
+            QTextEdit, QListView {
                 background: white;
                 border: 1px solid #ddd;
                 border-radius: 4px;
@@ -109,12 +206,12 @@ class ThemeManager:
             QPushButton:hover {
                 background-color: #1565c0;
             }
-            QTableWidget {
+            QTableView {
                 background: #2d2d2d;
                 color: #ddd;
                 border: 1px solid #333;
             }
-            QTextEdit {
+            QTextEdit, QListView {
                 background: #2d2d2d;
                 color: #ddd;
                 border: 1px solid #333;
@@ -140,54 +237,3675 @@ class ThemeManager:
         """
 
 
+_NON_WORD_RE = re.compile(r'[\W_]+')
+
+
+def normalize_phrase(text):
+    """Ключ фразы для индекса: без регистра, ё→е, без пунктуации и пробелов"""
+    return _NON_WORD_RE.sub('', text.casefold().replace('ё', 'е'))
+
+
+_SLOT_RE = re.compile(r'\{(\w+)\}')
+# Символы, которыми значение параметра могло бы добавить к system: свою команду
+_SHELL_UNSAFE_RE = re.compile(r'[&|<>^%!"`$;()\r\n]')
+
+
+def is_template(phrase):
+    return _SLOT_RE.search(phrase) is not None
+
+
+def normalize_template_text(text):
+    # Для шаблонов пунктуация сохраняется: она может быть частью значения (youtube.com)
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+def compile_template(phrase, group_prefix='s'):
+    """Шаблон "открыть сайт {site}" -> (регулярное выражение, имена параметров)"""
+    parts = _SLOT_RE.split(normalize_template_text(phrase))
+    literals, slots = parts[0::2], parts[1::2]
+    if len(set(slots)) != len(slots):
+        raise ValueError(f'Параметр повторяется в шаблоне "{phrase}"')
+    if not ''.join(literals).strip():
+        raise ValueError(f'Шаблон "{phrase}" не содержит слов')
+
+    pattern = []
+    for i, literal in enumerate(literals):
+        pattern.append(re.escape(literal).replace('\\ ', r'\s+'))
+        if i < len(slots):
+            pattern.append(f'(?P<{group_prefix}{i}>.+?)')
+    return ''.join(pattern), slots
+
+
+class ParsedAction:
+    """Действие команды, разобранное один раз при загрузке"""
+    __slots__ = ('kind', 'argument', 'raw', 'slots')
+
+    PREFIXES = ('system', 'app', 'url', 'script')
+
+    def __init__(self, kind, argument, raw, slots=None):
+        self.kind = kind
+        self.argument = argument
+        self.raw = raw
+        self.slots = slots
+
+    @classmethod
+    def parse(cls, action):
+        prefix, separator, argument = action.partition(':')
+        if separator and prefix in cls.PREFIXES:
+            return cls(prefix, argument, action)
+        # Старые команды без префикса (shutdown, restart, browser, notepad)
+        return cls('legacy', action, action)
+
+    def bind(self, slots):
+        """Подстановка значений параметров шаблона в действие.
+
+        Для system: значение со спецсимволами оболочки - ValueError: команда
+        выполняется через оболочку, и такое значение запустило бы ещё одну.
+        """
+        argument = self.argument
+        if self.kind != 'script':
+            # Скрипт получает значения в переменной slots, а не подстановкой в код
+            for name, value in slots.items():
+                if self.kind == 'url':
+                    value = quote(value, safe=':/.')
+                elif self.kind == 'system' and _SHELL_UNSAFE_RE.search(value):
+                    raise ValueError(f"недопустимые символы в параметре {name}: {value!r}")
+                argument = argument.replace(f'{{{name}}}', value)
+        return ParsedAction(self.kind, argument, self.raw, slots)
+
+
+CommandEntry = namedtuple('CommandEntry', 'category phrase action')
+
+
+class TrigramIndex:
+    """Нечёткий поиск ключей по инвертированному индексу триграмм"""
+
+    def __init__(self):
+        self._postings = {}  # триграмма -> ключи, в которых она встречается
+        self._grams = {}     # ключ -> его триграммы
+
+    @staticmethod
+    def trigrams(key):
+        padded = f"##{key}#"
+        return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+    def add(self, key):
+        if key in self._grams:
+            return
+        grams = self.trigrams(key)
+        self._grams[key] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+        grams = self._grams.pop(key, None)
+        if grams is None:
+            return
+        for gram in grams:
+            posting = self._postings[gram]
+            posting.discard(key)
+            if not posting:
+                del self._postings[gram]
+
+    def best(self, query, threshold):
+        """Ключ с наибольшим сходством Жаккара по триграммам не ниже порога"""
+        grams = self.trigrams(query)
+        size = len(grams)
+        required = max(1, math.ceil(threshold * size))
+
+        # Фильтр по префиксу: кандидат, разделяющий с запросом required
+        # триграмм, обязан встретиться в одном из size - required + 1
+        # самых редких списков, поэтому остальные списки не просматриваются
+        postings = sorted((self._postings.get(gram, ()) for gram in grams), key=len)
+        candidates = set()
+        for posting in postings[:size - required + 1]:
+            candidates.update(posting)
+
+        min_size, max_size = threshold * size, size / threshold
+        best_key, best_score = None, 0.0
+        for key in candidates:
+            other = self._grams[key]
+            if not min_size <= len(other) <= max_size:
+                continue
+            overlap = len(grams & other)
+            score = overlap / (size + len(other) - overlap)
+            if score > best_score:
+                best_key, best_score = key, score
+
+        if best_score < threshold:
+            return None, 0.0
+        return best_key, best_score
+
+
+# Союзы между командами одной фразы и слова, после которых важен порядок
+DEFAULT_CONJUNCTIONS = ('и', 'а также')
+SEQUENCE_WORDS = ('потом', 'затем')
+
+
+class UtteranceSplitter:
+    """Разбиение фразы на несколько команд одним проходом регулярного выражения.
+
+    split() возвращает этапы - списки фрагментов. Фрагменты одного этапа
+    независимы, этапы разделены словами порядка ("открыть браузер и открыть
+    блокнот потом выключить компьютер" -> [[браузер, блокнот], [выключить]]).
+    """
+
+    def __init__(self, conjunctions=DEFAULT_CONJUNCTIONS, sequence_words=SEQUENCE_WORDS):
+        self.sequence_words = {word.casefold() for word in sequence_words}
+        words = {word.strip().casefold() for word in conjunctions if word.strip()} | self.sequence_words
+        # "и потом" - тоже слово порядка; длинные варианты раньше коротких
+        words |= {f'{word} {sequence}' for word in words for sequence in self.sequence_words}
+        alternatives = sorted(words, key=len, reverse=True)
+        self._pattern = re.compile(r'(?<!\w)(?:' + '|'.join(r'\s+'.join(map(re.escape, word.split()))
+                                                           for word in alternatives) + r')(?!\w)',
+                                   re.IGNORECASE)
+
+    def split(self, text):
+        stages = [[]]
+        position = 0
+        for match in self._pattern.finditer(text):
+            segment = text[position:match.start()].strip(' ,.;')
+            if segment:
+                stages[-1].append(segment)
+            if match.group().split()[-1].casefold() in self.sequence_words and stages[-1]:
+                stages.append([])
+            position = match.end()
+        segment = text[position:].strip(' ,.;')
+        if segment:
+            stages[-1].append(segment)
+        return [stage for stage in stages if stage]
+
+    def contains(self, text):
+        """Есть ли в тексте союз или слово порядка"""
+        return self._pattern.search(text) is not None
+
+
+class CommandIndex:
+    """Индекс команд: нормализованная фраза -> разобранное действие.
+
+    Индекс триграмм для нечёткого поиска строится при rebuild() в фоновом
+    потоке и подменяется целиком, когда готов: на 50 тыс. фраз это больше
+    секунды, которую иначе ждал бы первый нечёткий запрос в потоке GUI.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._fuzzy = TrigramIndex()
+        self._fuzzy_lock = threading.Lock()
+        self._fuzzy_ready = threading.Event()
+        self._fuzzy_ready.set()
+        self._fuzzy_pending = None  # изменения ключей, пока строится новый индекс триграмм
+        self._templates = {}  # (категория, шаблон) -> запись
+        self._template_matcher = None
+        self._template_table = []
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._entries.values()) + len(self._templates)
+
+    def rebuild(self, commands):
+        self._entries = {}
+        self._templates = {}
+        with self._fuzzy_lock:
+            # Пока строится новый индекс, изменения копятся и не трогают старый
+            self._fuzzy_pending = []
+            self._fuzzy_ready = threading.Event()
+        for category, phrases in commands.items():
+            for phrase, action in phrases.items():
+                try:
+                    self.add(category, phrase, action)
+                except ValueError as e:
+                    logging.warning(f"Шаблон пропущен: {e}")
+        self.compileTemplates()
+        with self._fuzzy_lock:
+            self._fuzzy_pending = []
+        threading.Thread(target=self._buildFuzzy, args=(list(self._entries), self._fuzzy_ready),
+                         name='fuzzy-index', daemon=True).start()
+
+    def _buildFuzzy(self, keys, ready):
+        fuzzy = TrigramIndex()
+        for key in keys:
+            fuzzy.add(key)
+        with self._fuzzy_lock:
+            if ready is self._fuzzy_ready:  # иначе уже начата следующая перестройка
+                for change, key in self._fuzzy_pending:
+                    change(fuzzy, key)
+                self._fuzzy_pending = None
+                self._fuzzy = fuzzy
+        ready.set()
+
+    def _changeFuzzy(self, change, key):
+        with self._fuzzy_lock:
+            if self._fuzzy_pending is not None:
+                self._fuzzy_pending.append((change, key))
+            else:
+                change(self._fuzzy, key)
+
+    def waitFuzzy(self, timeout=None):
+        """Ожидание фонового построения индекса триграмм; True, если готов"""
+        return self._fuzzy_ready.wait(timeout)
+
+    def compileTemplates(self):
+        """Сборка всех шаблонов в одно регулярное выражение с альтернативами"""
+        # Более конкретные шаблоны (больше постоянного текста) идут первыми
+        entries = sorted(self._templates.values(),
+                         key=lambda e: -len(_SLOT_RE.sub('', e.phrase)))
+        alternatives = []
+        self._template_table = []
+        for n, entry in enumerate(entries):
+            pattern, slots = compile_template(entry.phrase, f't{n}s')
+            alternatives.append(f'(?P<t{n}>{pattern})')
+            groups = [(slot, f't{n}s{k}') for k, slot in enumerate(slots)]
+            self._template_table.append((entry, groups))
+        self._template_matcher = re.compile('|'.join(alternatives)) if alternatives else None
+
+    def add(self, category, phrase, action):
+        entry = CommandEntry(category, phrase, ParsedAction.parse(action))
+        if is_template(phrase):
+            compile_template(phrase)  # проверка до изменения индекса
+            self._templates[(category, phrase)] = entry
+            self._template_matcher = None
+            self._template_table = None
+            return
+
+        key = normalize_phrase(phrase)
+        bucket = self._entries.get(key)
+        if bucket is None:
+            bucket = self._entries[key] = []
+            self._changeFuzzy(TrigramIndex.add, key)
+        for i, existing in enumerate(bucket):
+            if existing.category == category and existing.phrase == phrase:
+                bucket[i] = entry
+                return
+        # При совпадении ключей в разных категориях выигрывает первая
+        bucket.append(entry)
+
+    def remove(self, category, phrase):
+        if self._templates.pop((category, phrase), None) is not None:
+            self._template_matcher = None
+            self._template_table = None
+            return
+
+        key = normalize_phrase(phrase)
+        bucket = self._entries.get(key)
+        if not bucket:
+            return
+        bucket[:] = [e for e in bucket if e.category != category or e.phrase != phrase]
+        if not bucket:
+            del self._entries[key]
+            self._changeFuzzy(TrigramIndex.remove, key)
+
+    def lookup(self, text):
+        bucket = self._entries.get(normalize_phrase(text))
+        return bucket[0] if bucket else None
+
+    def matchTemplate(self, text):
+        if self._template_table is None:
+            self.compileTemplates()
+        if self._template_matcher is None:
+            return None
+        # Один проход по объединённому выражению, без перебора шаблонов
+        match = self._template_matcher.fullmatch(normalize_template_text(text))
+        if match is None:
+            return None
+        entry, groups = self._template_table[int(match.lastgroup[1:])]
+        slots = {name: match.group(group) for name, group in groups}
+        try:
+            return entry._replace(action=entry.action.bind(slots))
+        except ValueError as e:
+            logging.warning(f'Шаблон "{entry.phrase}" не применён: {e}')
+            return None
+
+    def match(self, text, fuzzy_threshold=None):
+        """Точное совпадение, затем шаблоны, затем ближайшая фраза не ниже порога.
+
+        Возвращает (запись, сходство) или (None, 0.0).
+        """
+        key = normalize_phrase(text)
+        bucket = self._entries.get(key)
+        if bucket:
+            return bucket[0], 1.0
+        entry = self.matchTemplate(text)
+        if entry is not None:
+            return entry, 1.0
+        if not fuzzy_threshold or not key:
+            return None, 0.0
+        # Запрос сразу после загрузки команд дожидается фонового построения
+        self._fuzzy_ready.wait()
+        fuzzy_key, score = self._fuzzy.best(key, fuzzy_threshold)
+        if fuzzy_key is None:
+            return None, 0.0
+        return self._entries[fuzzy_key][0], score
+
+    def matchMany(self, texts, fuzzy_threshold=None):
+        """match() для нескольких фраз сразу: [(запись, сходство)] в том же порядке.
+
+        Одинаковые с точностью до регистра и пробелов фразы сопоставляются
+        один раз (пунктуация важна для параметров шаблонов).
+        """
+        found = {}
+        results = []
+        for text in texts:
+            key = normalize_template_text(text)
+            if key not in found:
+                found[key] = self.match(text, fuzzy_threshold)
+            results.append(found[key])
+        return results
+
+
+class JsonCommandStore:
+    """Хранилище команд в одном JSON-файле, как раньше.
+
+    Любое изменение переписывает файл целиком, поэтому запись идёт через
+    временный файл и атомарную замену, а внутри transaction() - один раз
+    в конце.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._commands = {}
+        self._depth = 0
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        self._commands = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._commands = json.load(f)
+
+    def __len__(self):
+        return sum(len(phrases) for phrases in self._commands.values())
+
+    def iterCommands(self):
+        for category, phrases in self._commands.items():
+            for phrase, action in phrases.items():
+                yield category, phrase, action
+
+    def get(self, category, phrase):
+        return self._commands.get(category, {}).get(phrase)
+
+    def findPhrases(self, phrases):
+        """(категория, фраза, действие) всех команд с фразами из множества"""
+        phrases = set(phrases)
+        return [(category, phrase, entries[phrase])
+                for category, entries in self._commands.items()
+                for phrase in phrases & entries.keys()]
+
+    def upsert(self, category, phrase, action):
+        self._commands.setdefault(category, {})[phrase] = action
+        self._changed()
+
+    def upsertMany(self, rows):
+        with self.transaction():
+            for category, phrase, action in rows:
+                self.upsert(category, phrase, action)
+
+    def delete(self, category, phrase):
+        phrases = self._commands.get(category, {})
+        if phrases.pop(phrase, None) is not None:
+            if not phrases:
+                del self._commands[category]
+            self._changed()
+
+    @contextmanager
+    def transaction(self):
+        self._depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._depth -= 1
+            if not self._depth and self._dirty:
+                # Откат: файл не менялся с начала транзакции
+                self._load()
+                self._dirty = False
+            raise
+        self._depth -= 1
+        if not self._depth and self._dirty:
+            self._write()
+
+    def exportJson(self, path):
+        write_json_atomic(path, self._commands)
+
+    def close(self):
+        pass
+
+    def _changed(self):
+        self._dirty = True
+        if not self._depth:
+            self._write()
+
+    def _write(self):
+        write_json_atomic(self.path, self._commands)
+        self._dirty = False
+
+
+class SqliteCommandStore:
+    """Хранилище команд в SQLite в режиме WAL.
+
+    Добавление и удаление затрагивают одну строку, поиск по категории и
+    фразе идёт по индексам, пакетные изменения выполняются одной
+    транзакцией. Порядок команд - порядок добавления.
+    """
+
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path):
+        self.path = path
+        # Транзакции открываются явно в transaction(), одиночные запросы фиксируются сразу
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._depth = 0
+        self._migrate()
+
+    def _migrate(self):
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+        if version < 1:
+            with self.transaction():
+                self._db.execute('''
+                    CREATE TABLE IF NOT EXISTS commands (
+                        id INTEGER PRIMARY KEY,
+                        category TEXT NOT NULL,
+                        phrase TEXT NOT NULL,
+                        action TEXT NOT NULL,
+                        UNIQUE (category, phrase)
+                    )''')
+                self._db.execute('CREATE INDEX IF NOT EXISTS commands_phrase ON commands (phrase)')
+                self._db.execute('PRAGMA user_version = 1')
+        if version < 2:
+            with self.transaction():
+                # Служебные отметки: например, перенесены ли команды из commands.json
+                self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+                if version == 1 and len(self):
+                    # Базы первой версии с командами уже прошли перенос, пустые -
+                    # возможно, прервались на испорченном файле, перенос повторится
+                    self.setMeta('legacy_import', 'done')
+                self._db.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+
+    def getMeta(self, key):
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def setMeta(self, key, value):
+        self._db.execute('INSERT INTO meta (key, value) VALUES (?, ?) '
+                         'ON CONFLICT (key) DO UPDATE SET value = excluded.value', (key, value))
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM commands').fetchone()[0]
+
+    def iterCommands(self):
+        # Курсор отдаёт строки по одной, без загрузки всего набора в память
+        yield from self._db.execute('SELECT category, phrase, action FROM commands ORDER BY id')
+
+    def get(self, category, phrase):
+        row = self._db.execute('SELECT action FROM commands WHERE category = ? AND phrase = ?',
+                               (category, phrase)).fetchone()
+        return row[0] if row else None
+
+    def findPhrase(self, phrase):
+        """(категория, действие) всех команд с этой фразой"""
+        return self._db.execute('SELECT category, action FROM commands WHERE phrase = ? ORDER BY id',
+                                (phrase,)).fetchall()
+
+    def findPhrases(self, phrases):
+        """(категория, фраза, действие) всех команд с фразами из множества, по индексу phrase"""
+        phrases = list(phrases)
+        rows = []
+        # Число параметров запроса в старых сборках SQLite ограничено 999
+        for start in range(0, len(phrases), 500):
+            chunk = phrases[start:start + 500]
+            rows += self._db.execute(
+                f"SELECT category, phrase, action FROM commands WHERE phrase IN ({','.join('?' * len(chunk))})",
+                chunk).fetchall()
+        return rows
+
+    def upsert(self, category, phrase, action):
+        self._db.execute('INSERT INTO commands (category, phrase, action) VALUES (?, ?, ?) '
+                         'ON CONFLICT (category, phrase) DO UPDATE SET action = excluded.action',
+                         (category, phrase, action))
+
+    def upsertMany(self, rows):
+        with self.transaction():
+            self._db.executemany('INSERT INTO commands (category, phrase, action) VALUES (?, ?, ?) '
+                                 'ON CONFLICT (category, phrase) DO UPDATE SET action = excluded.action',
+                                 rows)
+
+    def delete(self, category, phrase):
+        self._db.execute('DELETE FROM commands WHERE category = ? AND phrase = ?', (category, phrase))
+
+    @contextmanager
+    def transaction(self):
+        """Вложенные вызовы объединяются во внешнюю транзакцию"""
+        if self._depth == 0:
+            self._db.execute('BEGIN IMMEDIATE')
+        self._depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._depth -= 1
+            if self._depth == 0:
+                self._db.execute('ROLLBACK')
+            raise
+        self._depth -= 1
+        if self._depth == 0:
+            self._db.execute('COMMIT')
+
+    def exportJson(self, path):
+        """Выгрузка в прежний формат commands.json построчно, без сборки словаря"""
+        rows = self._db.execute('''
+            SELECT c.category, c.phrase, c.action FROM commands c
+            JOIN (SELECT category, MIN(id) AS first FROM commands GROUP BY category) f
+                ON f.category = c.category
+            ORDER BY f.first, c.id''')
+        directory = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory,
+                                         suffix='.tmp', delete=False) as f:
+            current = None
+            f.write('{')
+            for category, phrase, action in rows:
+                if category != current:
+                    f.write('\n    },' if current is not None else '')
+                    f.write(f'\n    {json.dumps(category, ensure_ascii=False)}: {{')
+                    separator = ''
+                    current = category
+                f.write(f'{separator}\n        {json.dumps(phrase, ensure_ascii=False)}: '
+                        f'{json.dumps(action, ensure_ascii=False)}')
+                separator = ','
+            f.write('\n    }\n}' if current is not None else '}')
+        os.replace(f.name, path)
+
+    def close(self):
+        self._db.close()
+
+
+def write_json_atomic(path, data):
+    """Запись JSON во временный файл рядом и замена им исходного"""
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory,
+                                     suffix='.tmp', delete=False) as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f.name, path)
+
+
+def open_command_store(path, legacy_json=None):
+    """Хранилище по расширению файла; SQLite один раз переносит команды из legacy_json.
+
+    Отметка о переносе хранится в самой базе и ставится в одной транзакции с
+    командами. Если legacy_json не читается (обрезан при сбое), ошибка
+    пишется в журнал, а перенос повторяется при следующем открытии.
+    """
+    if os.path.splitext(path)[1] == '.json':
+        return JsonCommandStore(path)
+
+    store = SqliteCommandStore(path)
+    if legacy_json and store.getMeta('legacy_import') is None:
+        if not os.path.exists(legacy_json):
+            store.setMeta('legacy_import', 'none')
+            return store
+        try:
+            legacy = JsonCommandStore(legacy_json)
+            with store.transaction():
+                store.upsertMany(legacy.iterCommands())
+                store.setMeta('legacy_import', 'done')
+        except (OSError, ValueError, AttributeError, TypeError) as e:
+            # Не JSON или не словарь категорий: транзакция откатана, отметки нет
+            logging.error(f"Не удалось перенести команды из {legacy_json}: {e}. "
+                          f"Перенос будет повторён при следующем запуске")
+            return store
+        logging.info(f"Команды перенесены из {legacy_json} в {path}: {len(store)}")
+    return store
+
+
+class SettingsStore(QObject):
+    """Настройки в памяти с отложенной записью в файл.
+
+    update() сразу меняет состояние, а запись выполняет фоновый поток через
+    delay секунд после последнего изменения: серия правок даёт одну запись.
+    Файл заменяется атомарно, поэтому сбой посреди записи не оставит его
+    обрезанным. flush() дожидается записи, close() вызывается при выходе.
+    """
+    VERSION = 1
+    writeFailed = pyqtSignal(str)
+
+    def __init__(self, path, delay=1.0, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.delay = delay
+        self.data = {}
+        self.writes = 0
+        self.written_signature = None  # (mtime_ns, размер) после своей записи
+        self._changed_at = None
+        self._urgent = False
+        self._writing = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    @classmethod
+    def migrate(cls, data):
+        """Приведение файла старой схемы к текущей"""
+        version = data.get('version', 0)
+        if version < 1:
+            # Без списка устройств прежняя версия сохраняла пустые имена
+            for key in ('output_device', 'input_device'):
+                if not (data.get(key) or {}).get('name'):
+                    data.pop(key, None)
+        data['version'] = cls.VERSION
+        return data
+
+    def load(self):
+        """Чтение файла: словарь настроек без номера версии или None, если файла нет.
+
+        Для испорченного файла пробрасывается ValueError.
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError('ожидался объект JSON')
+        except FileNotFoundError:
+            return None
+        data = self.migrate(data)
+        with self._condition:
+            # Отложенная запись старого состояния затёрла бы прочитанное
+            self.data = data
+            self._changed_at = None
+        return {key: value for key, value in data.items() if key != 'version'}
+
+    def update(self, settings):
+        with self._condition:
+            self.data = {'version': self.VERSION, **settings}
+            self._changed_at = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='settings-writer', daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def flush(self, timeout=5.0):
+        with self._condition:
+            self._urgent = True
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: self._changed_at is None and not self._writing, timeout)
+            self._urgent = False
+
+    def close(self):
+        self.flush()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+
+    def isOwnWrite(self):
+        """Совпадает ли файл на диске с последней собственной записью"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        return (stat.st_mtime_ns, stat.st_size) == self.written_signature
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._changed_at is None:
+                        self._urgent = False
+                        self._condition.notify_all()
+                        if self._closed:
+                            return
+                        self._condition.wait()
+                        continue
+                    remaining = self._changed_at + self.delay - time.monotonic()
+                    if remaining <= 0 or self._urgent:
+                        break
+                    self._condition.wait(remaining)
+                data, self._changed_at, self._urgent = self.data, None, False
+                self._writing = True
+            try:
+                write_json_atomic(self.path, data)
+                stat = os.stat(self.path)
+                self.written_signature = (stat.st_mtime_ns, stat.st_size)
+                self.writes += 1
+            except OSError as e:
+                self.writeFailed.emit(str(e))
+            finally:
+                with self._condition:
+                    self._writing = False
+                    self._condition.notify_all()
+
+
+class LatencyHistogram:
+    """Гистограмма задержек с логарифмическими корзинами фиксированного размера.
+
+    Корзины растут в GROWTH раз от MIN_SECONDS, поэтому память не зависит
+    от числа замеров, а погрешность процентилей не больше шага корзины.
+    """
+
+    MIN_SECONDS = 1e-5
+    GROWTH = 1.1
+    BUCKETS = 200  # до MIN_SECONDS * GROWTH ** 199, то есть около 17 минут
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        if seconds <= self.MIN_SECONDS:
+            bucket = 0
+        else:
+            bucket = min(self.BUCKETS - 1, int(math.log(seconds / self.MIN_SECONDS, self.GROWTH)) + 1)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """Верхняя граница корзины, в которую попадает q-я доля замеров"""
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(q * self.count))
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.max, self.MIN_SECONDS * self.GROWTH ** bucket)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+class _LatencySpan:
+    __slots__ = ('metrics', 'stage', 'started')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class LatencyMetrics:
+    """Задержки этапов конвейера от микрофона до ответа.
+
+    Пока сбор выключен, span() возвращает общий пустой контекст, а record()
+    сразу выходит, так что замеры почти ничего не стоят.
+    """
+
+    STAGES = {
+        'mic_open': 'Открытие микрофона',
+        'calibration': 'Калибровка шума',
+        'listen': 'Запись фразы',
+        'recognize': 'Распознавание',
+        'lookup': 'Поиск команды',
+        'action': 'Выполнение действия',
+        'speak': 'Ответ голосом',
+    }
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._histograms = {stage: LatencyHistogram() for stage in self.STAGES}
+
+    def span(self, stage):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _LatencySpan(self, stage)
+
+    def record(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._histograms[stage].record(seconds)
+
+    def reset(self):
+        with self._lock:
+            for histogram in self._histograms.values():
+                histogram.reset()
+
+    def snapshot(self):
+        with self._lock:
+            return {stage: histogram.snapshot() for stage, histogram in self._histograms.items()}
+
+    def toJson(self):
+        return json.dumps({'timestamp': time.time(), 'stages': self.snapshot()}, indent=4)
+
+    def toPrometheus(self):
+        name = 'voice_assistant_stage_latency_seconds'
+        lines = [f'# HELP {name} Latency of voice pipeline stages.', f'# TYPE {name} summary']
+        for stage, values in self.snapshot().items():
+            for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                lines.append(f'{name}{{stage="{stage}",quantile="{quantile}"}} {values[key]:.6f}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {values["sum"]:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {values["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, destination, fmt='json'):
+        """Выгрузка в файл или в сокет вида tcp://host:port"""
+        text = self.toPrometheus() if fmt == 'prometheus' else self.toJson()
+        if destination.startswith('tcp://'):
+            host, _, port = destination[len('tcp://'):].rpartition(':')
+            with socket.create_connection((host or 'localhost', int(port)), timeout=2) as connection:
+                connection.sendall(text.encode('utf-8'))
+            return
+        directory = os.path.dirname(os.path.abspath(destination))
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory,
+                                         suffix='.tmp', delete=False) as f:
+            f.write(text)
+        os.replace(f.name, destination)
+
+
+METRICS = LatencyMetrics()
+
+
+# Вариант распознавания: текст в нижнем регистре, уверенность (None, если
+# распознаватель её не дал) и позиция в списке, 0 - лучший по мнению распознавателя
+Hypothesis = namedtuple('Hypothesis', 'text confidence rank')
+
+
+def parse_hypotheses(result):
+    """Варианты распознавания из ответа распознавателя.
+
+    Принимает строку, список строк или словарей либо ответ
+    recognize_google(show_all=True): {'alternative': [{'transcript', 'confidence'}]}.
+    Повторы отбрасываются, без вариантов - sr.UnknownValueError.
+    """
+    if isinstance(result, str):
+        alternatives = [{'transcript': result}]
+    elif isinstance(result, dict):
+        alternatives = result.get('alternative') or []
+    else:
+        # Пустой ответ Google при show_all=True - пустой список
+        alternatives = [{'transcript': item} if isinstance(item, str) else item for item in result or ()]
+
+    hypotheses, seen = [], set()
+    for alternative in alternatives:
+        text = (alternative.get('transcript') or '').strip().lower()
+        if not text or text in seen:
+            continue
+        seen.add(text)
+        hypotheses.append(Hypothesis(text, alternative.get('confidence'), len(hypotheses)))
+    if not hypotheses:
+        raise sr.UnknownValueError()
+    return hypotheses
+
+
+class SegmentDropped(Exception):
+    """Фрагмент вытеснен из переполненной очереди распознавания"""
+
+
+class RecognitionPipeline:
+    """Очередь записанных фрагментов и пул потоков распознавания.
+
+    Запись кладёт фрагменты в ограниченную очередь и сразу продолжает
+    слушать, потоки распознавания разбирают очередь параллельно, а
+    результаты выдаются строго в порядке записи.
+    """
+
+    POLICY_DROP_OLDEST = 'drop_oldest'
+    POLICY_BLOCK = 'block'
+
+    def __init__(self, recognize, on_result, workers=2, max_pending=8, policy=POLICY_DROP_OLDEST):
+        self.recognize = recognize    # audio -> текст, ошибки пробрасываются
+        self.on_result = on_result    # (номер, время записи, текст, ошибка)
+        self.workers = max(1, workers)
+        self.policy = policy
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max(1, max_pending))
+        self._threads = []
+        self._closed = False
+        self._lock = threading.Lock()
+        self._next_seq = 0
+        self._emit_seq = 0
+        self._done = {}  # буфер переупорядочивания: номер -> результат
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'recognizer-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5.0):
+        self._closed = True
+        deadline = time.monotonic() + timeout
+        for _ in self._threads:
+            try:
+                self._queue.put((None, None, None), timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+    def submit(self, audio):
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+        item = (seq, time.monotonic(), audio)
+
+        if self.policy == self.POLICY_BLOCK:
+            # Обратное давление: запись ждёт освобождения места в очереди
+            while not self._closed:
+                try:
+                    self._queue.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    pass
+            self._drop(item)
+            return
+
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._drop(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+
+    def _drop(self, item):
+        seq, captured_at, _ = item
+        self.dropped += 1
+        self._complete(seq, captured_at, None, SegmentDropped())
+
+    def _work(self):
+        while True:
+            seq, captured_at, audio = self._queue.get()
+            if seq is None:
+                return
+            try:
+                self._complete(seq, captured_at, self.recognize(audio), None)
+            except Exception as e:
+                self._complete(seq, captured_at, None, e)
+
+    def _complete(self, seq, captured_at, text, error):
+        # Выдача под блокировкой, чтобы порядок не нарушился между потоками
+        with self._lock:
+            self._done[seq] = (captured_at, text, error)
+            while self._emit_seq in self._done:
+                result = self._done.pop(self._emit_seq)
+                self.on_result(self._emit_seq, *result)
+                self._emit_seq += 1
+
+
+class VoiceActivityDetector:
+    """Отсев фрагментов без речи по признакам кадров 30 мс.
+
+    Кадр считается речевым, если его энергия заметно выше фона фрагмента,
+    спектр не плоский (не шум и не удар) и частота переходов через ноль
+    не слишком велика. Фрагмент пропускается дальше, только если в нём
+    есть непрерывный участок речи не короче min_speech_ms.
+    """
+
+    SAMPLE_RATE = 16000
+    FRAME_MS = 30
+
+    def __init__(self, energy_margin_db=10.0, min_energy_db=-50.0, flatness_max=0.4,
+                 zcr_max=0.3, min_speech_ms=150):
+        self.energy_margin_db = energy_margin_db
+        self.min_energy_db = min_energy_db
+        self.flatness_max = flatness_max
+        self.zcr_max = zcr_max
+        self.min_speech_ms = min_speech_ms
+        self.frame_size = self.SAMPLE_RATE * self.FRAME_MS // 1000
+        self._window = np.hanning(self.frame_size).astype(np.float32)
+        self.segments_total = 0
+        self.segments_dropped = 0
+
+    def frameFeatures(self, samples):
+        """Энергия (дБ), доля переходов через ноль и спектральная плоскость по кадрам"""
+        count = len(samples) // self.frame_size
+        frames = samples[:count * self.frame_size].reshape(count, self.frame_size)
+        frames = frames.astype(np.float32) / 32768.0
+
+        energy_db = 10.0 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+        signs = np.signbit(frames)
+        zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+        power = np.abs(np.fft.rfft(frames * self._window, axis=1)) ** 2 + 1e-10
+        flatness = np.exp(np.mean(np.log(power), axis=1)) / np.mean(power, axis=1)
+        return energy_db, zcr, flatness
+
+    def speechFrames(self, samples):
+        energy_db, zcr, flatness = self.frameFeatures(samples)
+        # Фон оценивается по самым тихим кадрам самого фрагмента
+        threshold = max(np.percentile(energy_db, 10) + self.energy_margin_db, self.min_energy_db)
+        return (energy_db > threshold) & (flatness < self.flatness_max) & (zcr < self.zcr_max)
+
+    def containsSpeech(self, samples):
+        if len(samples) < self.frame_size:
+            return False
+        speech = self.speechFrames(samples)
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], speech.astype(np.int8), [0]))))
+        runs = edges[1::2] - edges[0::2]
+        longest = runs.max() if runs.size else 0
+        return longest * self.FRAME_MS >= self.min_speech_ms
+
+    def accept(self, audio):
+        """Проверка фрагмента sr.AudioData с учётом счётчиков"""
+        raw = audio.get_raw_data(convert_rate=self.SAMPLE_RATE, convert_width=2)
+        has_speech = self.containsSpeech(np.frombuffer(raw, dtype=np.int16))
+        self.segments_total += 1
+        if not has_speech:
+            self.segments_dropped += 1
+        return has_speech
+
+
 class VoiceThread(QThread):
-    textDetected = pyqtSignal(str)
+    # Варианты распознавания одной фразы [Hypothesis], лучший первым
+    hypothesesDetected = pyqtSignal(list)
     statusUpdate = pyqtSignal(str)
 
     def __init__(self):
         super().__init__()
-        self.recognizer = sr.Recognizer()
+        # Распознаватель и VAD создаются в prepare(), не при построении окна
+        self.recognizer = None
+        self._prepare_lock = threading.Lock()
         self.is_listening = False
         self.recognition_language = 'ru-RU'
         self.microphone = None
+        self.input_device_index = None  # None - устройство ввода по умолчанию
+        # Один поток записи на весь сеанс вместо переоткрытия на каждую фразу
+        self.continuous_capture = True
+        self.start_requested_at = None
+        self._calibrated = False
+        # Параметры конвейера распознавания в непрерывном режиме
+        self.recognizer_workers = 2
+        self.max_pending_segments = 8
+        self.overflow_policy = RecognitionPipeline.POLICY_DROP_OLDEST
+        # Фрагменты без речи не отправляются на распознавание
+        self.vad = None
+        self.vad_enabled = True
+        # Распознаватель: функция (audio, язык) -> текст или варианты, None - Google
+        self.recognize_backend = None
+
+    def prepare(self):
+        """Создание распознавателя и VAD вместе с импортом их зависимостей"""
+        with self._prepare_lock:
+            if self.recognizer is None:
+                self.recognizer = sr.Recognizer()
+            if self.vad is None:
+                self.vad = VoiceActivityDetector()
 
     def run(self):
+        self.prepare()
         self.is_listening = True
+        self._session_started = self.start_requested_at or time.monotonic()
+        self._first_capture = True
+        self._last_phrase_done = None
+        self._rearm_times = []
+        self.vad.segments_total = self.vad.segments_dropped = 0
+
+        if self.continuous_capture:
+            self.runContinuous()
+        else:
+            self.runPerPhrase()
+
+        if self.vad.segments_total:
+            self.statusUpdate.emit(f"Отсеяно фрагментов без речи: {self.vad.segments_dropped} "
+                                   f"из {self.vad.segments_total}")
+
+        if self._rearm_times:
+            average = sum(self._rearm_times) / len(self._rearm_times) * 1000
+            mode = "непрерывный" if self.continuous_capture else "по фразам"
+            self.statusUpdate.emit(f"Средняя пауза между фразами: {average:.0f} мс (режим: {mode})")
+
+    def runContinuous(self):
+        pipeline = RecognitionPipeline(self.recognizeHypotheses, self.onRecognized,
+                                       workers=self.recognizer_workers,
+                                       max_pending=self.max_pending_segments,
+                                       policy=self.overflow_policy)
+        pipeline.start()
+        try:
+            self.captureContinuous(pipeline)
+        finally:
+            pipeline.stop()
+            if pipeline.dropped:
+                self.statusUpdate.emit(f"Пропущено фрагментов из-за переполнения очереди: {pipeline.dropped}")
+
+    def captureContinuous(self, pipeline):
+        while self.is_listening:
+            try:
+                if self.microphone is None:
+                    self.microphone = sr.Microphone(device_index=self.input_device_index)
+                    self._calibrated = False
+                microphone = self.microphone
+
+                opened_at = time.perf_counter()
+                with microphone as source:
+                    METRICS.record('mic_open', time.perf_counter() - opened_at)
+                    # Калибровка один раз, дальше порог отслеживается скользящей
+                    # оценкой по тихим участкам внутри listen
+                    self.recognizer.dynamic_energy_threshold = True
+                    if not self._calibrated:
+                        with METRICS.span('calibration'):
+                            self.recognizer.adjust_for_ambient_noise(source, duration=0.5)
+                        self._calibrated = True
+
+                    self.statusUpdate.emit("Слушаю...")
+                    # Выход из цикла при смене устройства в настройках
+                    while self.is_listening and self.microphone is microphone:
+                        self.markCaptureStart()
+                        try:
+                            with METRICS.span('listen'):
+                                audio = self.recognizer.listen(source, timeout=5)
+                        except sr.WaitTimeoutError:
+                            continue
+                        if self.vad_enabled and not self.vad.accept(audio):
+                            continue
+                        # Распознавание идёт в пуле, запись сразу продолжается
+                        pipeline.submit(audio)
+                        self._last_phrase_done = time.monotonic()
+            except Exception as e:
+                self.statusUpdate.emit(f"Ошибка: {str(e)}")
+                self.msleep(500)
+
+    def runPerPhrase(self):
         while self.is_listening:
             try:
                 if self.microphone is None:
-                    self.microphone = sr.Microphone()
+                    self.microphone = sr.Microphone(device_index=self.input_device_index)
 
+                opened_at = time.perf_counter()
                 with self.microphone as source:
+                    METRICS.record('mic_open', time.perf_counter() - opened_at)
                     self.statusUpdate.emit("Слушаю...")
-                    self.recognizer.adjust_for_ambient_noise(source, duration=0.5)
-                    audio = self.recognizer.listen(source, timeout=5)
+                    with METRICS.span('calibration'):
+                        self.recognizer.adjust_for_ambient_noise(source, duration=0.5)
+                    self.markCaptureStart()
+                    with METRICS.span('listen'):
+                        audio = self.recognizer.listen(source, timeout=5)
+                    if self.vad_enabled and not self.vad.accept(audio):
+                        continue
                     self.statusUpdate.emit("Обработка речи...")
-                    text = self.recognizer.recognize_google(audio, language=self.recognition_language)
-                    self.textDetected.emit(text.lower())
-            except sr.UnknownValueError:
-                self.statusUpdate.emit("Речь не распознана")
-            except sr.RequestError:
-                self.statusUpdate.emit("Ошибка сервиса распознавания")
+                    self.recognize(audio)
             except Exception as e:
                 self.statusUpdate.emit(f"Ошибка: {str(e)}")
 
+    def recognizeHypotheses(self, audio):
+        with METRICS.span('recognize'):
+            if self.recognize_backend is not None:
+                result = self.recognize_backend(audio, self.recognition_language)
+            else:
+                # Все варианты, а не только первый: нужная команда бывает на втором-третьем месте
+                result = self.recognizer.recognize_google(audio, language=self.recognition_language,
+                                                          show_all=True)
+        return parse_hypotheses(result)
+
+    def onRecognized(self, seq, captured_at, hypotheses, error):
+        if error is None:
+            self.hypothesesDetected.emit(hypotheses)
+        elif isinstance(error, sr.UnknownValueError):
+            self.statusUpdate.emit("Речь не распознана")
+        elif isinstance(error, sr.RequestError):
+            self.statusUpdate.emit("Ошибка сервиса распознавания")
+        elif not isinstance(error, SegmentDropped):
+            self.statusUpdate.emit(f"Ошибка: {str(error)}")
+
+    def recognize(self, audio):
+        try:
+            self.hypothesesDetected.emit(self.recognizeHypotheses(audio))
+        except sr.UnknownValueError:
+            self.statusUpdate.emit("Речь не распознана")
+        except sr.RequestError:
+            self.statusUpdate.emit("Ошибка сервиса распознавания")
+        finally:
+            self._last_phrase_done = time.monotonic()
+
+    def markCaptureStart(self):
+        """Замер задержки до фактического начала записи"""
+        now = time.monotonic()
+        if self._first_capture:
+            self._first_capture = False
+            elapsed = (now - self._session_started) * 1000
+            mode = "непрерывный" if self.continuous_capture else "по фразам"
+            self.statusUpdate.emit(f"От запуска до начала записи: {elapsed:.0f} мс (режим: {mode})")
+        elif self._last_phrase_done is not None:
+            self._rearm_times.append(now - self._last_phrase_done)
+            self._last_phrase_done = None
+
     def stop(self):
         self.is_listening = False
         self.wait()
 
-class MainWindow(QMainWindow):
+# Постоянные ответы ассистента, которые синтезируются один раз и берутся из кэша
+CACHED_PHRASES = (
+    "Выполняю системную команду",
+    "Запускаю приложение",
+    "Открываю веб-страницу",
+    "Выполняю скрипт",
+    "Компьютер будет выключен через минуту",
+    "Компьютер будет перезагружен через минуту",
+    "Открываю браузер",
+    "Открываю блокнот",
+    "Произошла ошибка при выполнении команды",
+)
+
+
+class SpeechCache:
+    """Синтезированные фразы в виде PCM в памяти с вытеснением LRU и копией на диске"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory  # None - без сохранения на диск
+        self._items = OrderedDict()  # (текст, скорость, громкость) -> (PCM, частота)
+        self._size = 0
+
+    @staticmethod
+    def key(text, rate, volume):
+        return text, int(rate), round(float(volume), 2)
+
+    def pathFor(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f'{digest}.wav')
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is not None:
+            self._items.move_to_end(key)
+            return item
+        if self.directory:
+            path = self.pathFor(key)
+            if os.path.exists(path):
+                return self.loadFile(key, path)
+        return None
+
+    def loadFile(self, key, path):
+        with wave.open(path, 'rb') as f:
+            width = f.getsampwidth()
+            channels = f.getnchannels()
+            samplerate = f.getframerate()
+            frames = f.readframes(f.getnframes())
+        if width not in (2, 4) or not frames:
+            return None
+        samples = np.frombuffer(frames, dtype=np.int16 if width == 2 else np.int32)
+        item = (samples.reshape(-1, channels), samplerate)
+        self.put(key, *item)
+        return item
+
+    def put(self, key, samples, samplerate):
+        old = self._items.pop(key, None)
+        if old is not None:
+            self._size -= old[0].nbytes
+        self._items[key] = (samples, samplerate)
+        self._size += samples.nbytes
+        while self._size > self.max_bytes and len(self._items) > 1:
+            _, (evicted, _) = self._items.popitem(last=False)
+            self._size -= evicted.nbytes
+
+    def clear(self):
+        self._items.clear()
+        self._size = 0
+
+
+class SpeechWorker(QThread):
+    """Поток синтеза речи: фразы ставятся в очередь, GUI не ждёт окончания"""
+    phraseFinished = pyqtSignal(str, bool)
+    speechError = pyqtSignal(str)
+
+    RENDER_TIMEOUT = 10.0  # с, запись фразы в файл для кэша
+
+    def __init__(self, cache=None):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = deque()  # (текст, ключ)
+        self._current = None     # фраза, которая сейчас звучит
+        self._interrupt = False
+        self._running = False
+        self._properties = {}
+        # Постоянные фразы воспроизводятся из кэша через sounddevice
+        self.cache = cache
+        self.cacheable_phrases = set(CACHED_PHRASES)
+        self.output_device = None
+        self._job = None         # (режим, текст, имя задания в движке)
+        self._job_counter = 0
+        self._play_deadline = 0.0
+        self._render_deadline = 0.0
+        self._started_at = 0.0
+        self._voice = (None, None)
+        self._prerender = deque()
+
+    def say(self, text, priority=False, key=None):
+        """Постановка фразы в очередь.
+
+        Повтор уже ожидающей или звучащей фразы отбрасывается, фраза с тем же
+        ключом заменяет ожидающую, а приоритетная прерывает текущую речь.
+        """
+        with self._lock:
+            if not priority and text == self._current:
+                return
+            self._pending = deque(item for item in self._pending
+                                  if item[0] != text and (key is None or item[1] != key))
+            if priority:
+                self._pending.appendleft((text, key))
+                self._interrupt = self._current is not None
+            else:
+                self._pending.append((text, key))
+        self._wakeup.set()
+
+    def flush(self, stop_current=True):
+        """Сброс ожидающих фраз и, при необходимости, текущей"""
+        with self._lock:
+            self._pending.clear()
+            self._interrupt = stop_current and self._current is not None
+        self._wakeup.set()
+
+    def setVoiceProperties(self, rate, volume):
+        with self._lock:
+            self._properties = {'rate': rate, 'volume': volume}
+        self._wakeup.set()
+
+    def shutdown(self):
+        self._running = False
+        self.flush()
+        self.wait()
+
+    def run(self):
+        self._running = True
+        try:
+            # Движок создаётся в этом потоке: SAPI привязан к потоку создания
+            with STARTUP.phase('инициализация pyttsx3'):
+                engine = pyttsx3.init()
+            engine.connect('finished-utterance', self._onFinished)
+            self._voice = (engine.getProperty('rate'), engine.getProperty('volume'))
+            engine.startLoop(False)
+        except Exception as e:
+            self.speechError.emit(str(e))
+            return
+
+        self._prerender = deque(self.cacheable_phrases)
+        try:
+            while self._running:
+                self._step(engine)
+        finally:
+            self._stopCurrent(engine)
+            engine.endLoop()
+
+    def _step(self, engine):
+        with self._lock:
+            properties, self._properties = self._properties, {}
+            interrupt, self._interrupt = self._interrupt, False
+
+        try:
+            if properties:
+                self._applyProperties(engine, properties)
+            if interrupt and self._current is not None:
+                self._stopCurrent(engine)
+                self._finish(False)
+            if self._job is None:
+                self._startNext(engine)
+        except Exception as e:
+            self._job = None
+            self._finish(False)
+            self.speechError.emit(str(e))
+
+        mode = self._job[0] if self._job else None
+        if mode == 'play':
+            if time.monotonic() >= self._play_deadline:
+                self._finish(True)
+            else:
+                self._wakeup.wait(0.01)
+                self._wakeup.clear()
+        elif mode is not None:
+            engine.iterate()
+            if mode.startswith('render') and time.monotonic() >= self._render_deadline:
+                # Движок так и не сообщил о записи файла - фраза звучит без кэша
+                text = self._job[1]
+                self._stopCurrent(engine)
+                if mode == 'render-play':
+                    self._job = ('speak', text, self._nextJobName())
+                    engine.say(text, self._job[2])
+            else:
+                time.sleep(0.01)
+        else:
+            self._wakeup.wait(0.2)
+            self._wakeup.clear()
+
+    def _applyProperties(self, engine, properties):
+        for name, value in properties.items():
+            engine.setProperty(name, value)
+        voice = (properties['rate'], properties['volume'])
+        if voice != self._voice:
+            # Кэш собран для прежних скорости и громкости
+            self._voice = voice
+            if self.cache is not None:
+                self.cache.clear()
+            self._prerender = deque(self.cacheable_phrases)
+
+    def _cacheKey(self, text):
+        return SpeechCache.key(text, *self._voice)
+
+    def _startNext(self, engine):
+        with self._lock:
+            item = self._pending.popleft() if self._pending else None
+            self._current = item[0] if item else None
+            self._started_at = time.perf_counter()
+
+        if item is None:
+            # Фоновый прогрев кэша, когда очередь пуста
+            while self._prerender and self.cache is not None:
+                text = self._prerender.popleft()
+                if self.cache.get(self._cacheKey(text)) is None:
+                    self._startRender(engine, text, play=False)
+                    return
+            return
+
+        text = item[0]
+        if self.cache is not None and text in self.cacheable_phrases:
+            cached = self.cache.get(self._cacheKey(text))
+            if cached is not None:
+                self._play(*cached)
+                return
+            self._startRender(engine, text, play=True)
+            return
+
+        self._job = ('speak', text, self._nextJobName())
+        engine.say(text, self._job[2])
+
+    def _nextJobName(self):
+        self._job_counter += 1
+        return f'phrase-{self._job_counter}'
+
+    def _startRender(self, engine, text, play):
+        key = self._cacheKey(text)
+        if self.cache.directory:
+            os.makedirs(self.cache.directory, exist_ok=True)
+            path = self.cache.pathFor(key)
+        else:
+            fd, path = tempfile.mkstemp(suffix='.wav')
+            os.close(fd)
+        name = self._nextJobName()
+        self._job = ('render-play' if play else 'render', text, name, key, path)
+        self._render_deadline = time.monotonic() + self.RENDER_TIMEOUT
+        engine.save_to_file(text, path, name)
+        # SAPI5 пишет файл прямо в save_to_file и не присылает finished-utterance,
+        # на это событие рассчитывать можно, только пока движок занят
+        if self._job is not None and self._job[2] == name and not engine.isBusy():
+            self._onFinished(name, True)
+
+    def _play(self, samples, samplerate):
+        self._job = ('play', self._current, None)
+        self._play_deadline = time.monotonic() + len(samples) / samplerate
+        with PORTAUDIO_LOCK:
+            sd.play(samples, samplerate, device=self.output_device)
+
+    def _stopCurrent(self, engine):
+        if self._job is None:
+            return
+        mode = self._job[0]
+        if mode == 'play':
+            with PORTAUDIO_LOCK:
+                sd.stop()
+        else:
+            engine.stop()
+            if mode.startswith('render') and not self.cache.directory:
+                try:
+                    os.remove(self._job[4])
+                except OSError:
+                    pass
+        self._job = None
+
+    def _onFinished(self, name, completed):
+        if self._job is None or self._job[2] != name:
+            return
+        mode = self._job[0]
+        if mode == 'speak':
+            self._finish(completed)
+            return
+
+        _, text, _, key, path = self._job
+        self._job = None
+        try:
+            cached = self.cache.loadFile(key, path) if completed else None
+        except (OSError, EOFError, wave.Error):
+            cached = None
+        if not self.cache.directory:
+            os.remove(path)
+        if mode == 'render-play':
+            if cached is not None:
+                self._play(*cached)
+            else:
+                self._finish(False)
+
+    def _finish(self, completed):
+        self._job = None
+        with self._lock:
+            text, self._current = self._current, None
+        if text is not None:
+            if completed:
+                METRICS.record('speak', time.perf_counter() - self._started_at)
+            self.phraseFinished.emit(text, completed)
+
+
+# Общий для воспроизведения и пересканирования устройств: переинициализация
+# PortAudio во время sd.play оборвала бы звук
+PORTAUDIO_LOCK = threading.Lock()
+
+AudioDevice = namedtuple('AudioDevice', 'name index inputs outputs')
+
+
+def _sounddevice_busy():
+    """Открыт ли поток sounddevice в любом направлении: sd.play, sd.rec или sd.playrec"""
+    try:
+        stream = sd.get_stream()
+    except RuntimeError:
+        return False  # потоков ещё не было
+    try:
+        return stream.active
+    except sd.PortAudioError:
+        return True  # состояние потока неизвестно, переинициализация откладывается
+
+
+def audio_endpoint_count():
+    """Число аудиоустройств по данным системы, None - неизвестно.
+
+    PortAudio читает список устройств один раз при инициализации, а счётчики
+    winmm меняются при подключении и отключении. Опрос дешёвый и не трогает
+    PortAudio, поэтому подходит для таймера.
+    """
+    if sys.platform != 'win32':
+        return None
+    winmm = ctypes.windll.winmm
+    return winmm.waveOutGetNumDevs() + winmm.waveInGetNumDevs()
+
+
+def scan_audio_devices(reinitialize=False):
+    """Опрос PortAudio: (имя -> AudioDevice, имя вывода и ввода по умолчанию, переинициализирован ли).
+
+    Устройства, подключённые после запуска, PortAudio показывает только после
+    переинициализации. Публичного способа для неё в sounddevice нет, поэтому
+    она выполняется только по reinitialize и откладывается, пока открыт поток
+    sounddevice. Проверка и переинициализация идут под PORTAUDIO_LOCK, под
+    которым же запускается воспроизведение, так что поток не откроется
+    посреди переинициализации. Одно и то же устройство под несколькими host
+    API хранится один раз, с первым индексом.
+    """
+    with PORTAUDIO_LOCK:
+        reinitialized = False
+        if reinitialize and not _sounddevice_busy():
+            sd._terminate()
+            sd._initialize()
+            reinitialized = True
+        devices = {}
+        for index, info in enumerate(sd.query_devices()):
+            devices.setdefault(info['name'], AudioDevice(
+                info['name'], index, info['max_input_channels'], info['max_output_channels']))
+        defaults = []
+        for kind in ('output', 'input'):
+            try:
+                defaults.append(sd.query_devices(kind=kind)['name'])
+            except (ValueError, sd.PortAudioError):
+                defaults.append(None)
+    return devices, defaults[0], defaults[1], reinitialized
+
+
+class AudioDeviceRegistry(QObject):
+    """Кэш таблицы аудиоустройств по именам с фоновым пересканированием.
+
+    Раз в interval мс отдельный поток сверяет число устройств в системе
+    (count), GUI его не ждёт. PortAudio перечитывает список только при
+    изменении этого числа или по rescan(); если в этот момент звук
+    воспроизводится, перечитывание повторяется на следующем опросе. Сигналы devicesAdded и devicesRemoved приходят в потоке GUI и только при
+    изменении набора устройств; find() отвечает из кэша без опроса.
+    """
+    devicesReady = pyqtSignal()          # первый опрос завершён
+    devicesAdded = pyqtSignal(object)    # список AudioDevice
+    devicesRemoved = pyqtSignal(object)
+    scanFailed = pyqtSignal(str)
+    _scanned = pyqtSignal(object, object, object)
+
+    def __init__(self, interval=5000, scan=scan_audio_devices, count=audio_endpoint_count, parent=None):
+        super().__init__(parent)
+        self.interval = interval
+        self.scan = scan
+        self.count = count
+        self.ready = False
+        self.default_output = None
+        self.default_input = None
+        self._devices = {}
+        self._running = False
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._scanned.connect(self._apply)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='audio-devices', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def rescan(self):
+        """Внеочередное перечитывание списка устройств PortAudio в фоне"""
+        self._wakeup.set()
+
+    def find(self, name):
+        return self._devices.get(name) if name else None
+
+    def outputs(self):
+        return [device for device in self._devices.values() if device.outputs > 0]
+
+    def inputs(self):
+        return [device for device in self._devices.values() if device.inputs > 0]
+
+    def _run(self):
+        first = True
+        reinitialize = False
+        count = self._count()
+        while self._running:
+            if first or reinitialize:
+                started = time.perf_counter()
+                try:
+                    devices, default_output, default_input, reinitialized = self.scan(reinitialize=reinitialize)
+                except Exception as e:
+                    self.scanFailed.emit(str(e))
+                else:
+                    self._scanned.emit(devices, default_output, default_input)
+                    # Во время воспроизведения PortAudio не трогается, попытка на следующем опросе
+                    reinitialize = reinitialize and not reinitialized
+                if first:
+                    STARTUP.add('список аудиоустройств', started, time.perf_counter() - started)
+                    first = False
+            requested = self._wakeup.wait(self.interval / 1000)
+            self._wakeup.clear()
+            current = self._count()
+            reinitialize = reinitialize or requested or current != count
+            count = current
+
+    def _count(self):
+        try:
+            return self.count()
+        except Exception:
+            return None
+
+    def _apply(self, devices, default_output, default_input):
+        added = [device for name, device in devices.items() if name not in self._devices]
+        removed = [device for name, device in self._devices.items() if name not in devices]
+        # Индексы могут сдвинуться и без изменения набора, кэш обновляется всегда
+        self._devices = devices
+        self.default_output = default_output
+        self.default_input = default_input
+        if not self.ready:
+            self.ready = True
+            self.devicesReady.emit()
+            return
+        if removed:
+            self.devicesRemoved.emit(removed)
+        if added:
+            self.devicesAdded.emit(added)
+
+
+COMMANDS_DB = 'commands.db'
+SETTINGS_FILE = 'settings.json'
+
+# Ключи settings.json, при изменении которых применяется соответствующая группа
+SETTINGS_GROUPS = {
+    'speech': {'voice_speed', 'voice_volume', 'speech_cache_on_disk'},
+    'capture': {'continuous_capture', 'recognizer_workers', 'overflow_policy', 'vad_enabled'},
+    'actions': {'action_timeout', 'max_concurrent_actions', 'script_processes', 'command_conjunctions'},
+    'server': {'command_server', 'command_server_address', 'command_server_token'},
+}
+
+# Значения настроек, которых нет в settings.json
+DEFAULT_SETTINGS = {
+    'theme': 'light',
+    'voice_speed': 180,
+    'voice_volume': 100,
+    'autostart': False,
+    'minimize_to_tray': True,
+    'language': 'Русский',
+    'fuzzy_matching': False,
+    'fuzzy_threshold': 75,
+    'continuous_capture': True,
+    'recognizer_workers': 2,
+    'overflow_policy': RecognitionPipeline.POLICY_DROP_OLDEST,
+    'vad_enabled': True,
+    'speech_cache_on_disk': True,
+    'action_timeout': 30,
+    'max_concurrent_actions': 4,
+    'command_conjunctions': list(DEFAULT_CONJUNCTIONS),
+    'script_processes': True,
+    'log_limit': 10000,
+    'metrics_enabled': False,
+    'output_device': None,
+    'input_device': None,
+    'command_server': False,
+    'command_server_address': 'localhost:8765',
+    'command_server_token': '',  # создаётся при первом запуске сервера
+}
+
+RECOGNITION_LANGUAGES = {'Русский': 'ru-RU', 'English': 'en-US'}
+
+# Команды нового хранилища, если переносить нечего
+DEFAULT_COMMANDS = {
+    "системные": {
+        "выключить компьютер": "shutdown",
+        "перезагрузить": "restart"
+    },
+    "приложения": {
+        "открыть браузер": "browser",
+        "открыть блокнот": "notepad"
+    }
+}
+
+# Подтверждения ассистента по типу действия
+ACTION_REPLIES = {
+    'system': "Выполняю системную команду",
+    'app': "Запускаю приложение",
+    'url': "Открываю веб-страницу",
+    'script': "Выполняю скрипт",
+}
+
+# Старые команды без префикса: (тип, аргумент, подтверждение)
+LEGACY_ACTIONS = {
+    'shutdown': ('system', 'shutdown /s /t 60', "Компьютер будет выключен через минуту"),
+    'restart': ('system', 'shutdown /r /t 60', "Компьютер будет перезагружен через минуту"),
+    'browser': ('url', 'http://google.com', "Открываю браузер"),
+    'notepad': ('app', 'notepad', "Открываю блокнот"),
+}
+
+
+# Итог executeCommand: [(фрагмент, запись или None, сходство)] и поставленные действия
+CommandDispatch = namedtuple('CommandDispatch', 'matches actions')
+
+# Выбор варианта распознавания: главное - качество совпадения с командами,
+# уверенность распознавателя и позиция в списке только разводят близкие варианты
+HYPOTHESIS_CONFIDENCE_WEIGHT = 0.1
+HYPOTHESIS_RANK_PENALTY = 0.05
+
+
+def hypothesis_score(hypothesis, stages):
+    """Оценка варианта по этапам [[(фрагмент, запись или None, сходство)]]"""
+    matches = [match for stage in stages for match in stage]
+    quality = sum(score for _, entry, score in matches if entry is not None) / len(matches)
+    confidence = hypothesis.confidence or 0.0
+    return (quality + HYPOTHESIS_CONFIDENCE_WEIGHT * confidence
+            - HYPOTHESIS_RANK_PENALTY * hypothesis.rank)
+
+
+def combine_replies(stages):
+    """Одно подтверждение на несколько команд: "Открываю браузер и открываю блокнот, потом ..." """
+    replies = []
+    for stage in stages:
+        unique = list(dict.fromkeys(stage))
+        if replies:
+            unique[0] = unique[0][:1].lower() + unique[0][1:]
+        replies.append(' и '.join([unique[0]] + [reply[:1].lower() + reply[1:] for reply in unique[1:]]))
+    return ', потом '.join(replies)
+
+
+# tag - метка из submit(), по ней вызывающий узнаёт свои действия
+ActionResult = namedtuple('ActionResult', 'job_id action status exit_code duration error output tag',
+                          defaults=(None, None))
+
+
+class ScriptCache:
+    """Скрипты, скомпилированные один раз и найденные по хэшу исходного текста"""
+
+    def __init__(self):
+        self._entries = {}  # хэш -> (хэш, код, код в формате marshal)
+        self._uses_assistant = {}  # хэш -> обращается ли скрипт к self
+
+    @staticmethod
+    def digest(source):
+        return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+    def get(self, source):
+        digest = self.digest(source)
+        entry = self._entries.get(digest)
+        if entry is None:
+            code = compile(source, f'<script {digest[:8]}>', 'exec')
+            entry = self._entries[digest] = (digest, code, marshal.dumps(code))
+        return entry
+
+    def usesAssistant(self, source):
+        """Обращается ли скрипт к self - объекту ассистента.
+
+        Такой скрипт выполняется в потоке этого процесса: в процесс-исполнитель
+        передаются только slots.
+        """
+        digest, code, _ = self.get(source)
+        uses = self._uses_assistant.get(digest)
+        if uses is None:
+            uses = self._uses_assistant[digest] = _code_uses_name(code, 'self')
+            if uses:
+                logging.info(f"Скрипт {digest[:8]} обращается к self и выполняется в процессе "
+                             f"ассистента, а не в процессе-исполнителе")
+        return uses
+
+    def invalidate(self, source):
+        digest = self.digest(source)
+        self._entries.pop(digest, None)
+        self._uses_assistant.pop(digest, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._uses_assistant.clear()
+
+
+def _code_uses_name(code, name):
+    # Имя может встречаться и во вложенных функциях и классах скрипта
+    if name in code.co_names or name in code.co_freevars:
+        return True
+    return any(isinstance(const, type(code)) and _code_uses_name(const, name)
+               for const in code.co_consts)
+
+
+def _script_worker_main(conn):
+    """Цикл процесса-исполнителя: (хэш, код или None, slots) -> (успех, результат, ошибка)"""
+    codes = OrderedDict()
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        digest, code_bytes, slots = message
+        if code_bytes is not None:
+            codes[digest] = marshal.loads(code_bytes)
+            while len(codes) > ScriptProcessPool.CODES_PER_WORKER:
+                codes.popitem(last=False)
+        elif digest not in codes:
+            # Родитель ведёт тот же LRU и сюда не попадает; ответ вместо KeyError
+            # оставляет процесс живым, если кэши всё же разошлись
+            conn.send((False, None, 'Процессу скрипта не передан код скрипта'))
+            continue
+        codes.move_to_end(digest)
+
+        # Скрипт видит те же глобальные имена, что и прежде в exec внутри GUI
+        scope = {'slots': slots}
+        try:
+            exec(codes[digest], globals(), scope)
+        except Exception as e:
+            conn.send((False, None, f'{type(e).__name__}: {e}\n{traceback.format_exc()}'))
+            continue
+        result = scope.get('result')
+        try:
+            conn.send((True, result, None))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            conn.send((True, repr(result), None))
+
+
+class ScriptProcess:
+    """Процесс пула и хэши скриптов, код которых сейчас лежит в его кэше"""
+    __slots__ = ('process', 'conn', 'known')
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.known = OrderedDict()
+
+    def remember(self, digest):
+        """Отметка передачи скрипта; True, если код уже есть у процесса.
+
+        Повторяет вытеснение в _script_worker_main: оба кэша получают одну и ту
+        же последовательность хэшей и вытесняют одни и те же записи.
+        """
+        if digest in self.known:
+            self.known.move_to_end(digest)
+            return True
+        self.known[digest] = None
+        while len(self.known) > ScriptProcessPool.CODES_PER_WORKER:
+            self.known.popitem(last=False)
+        return False
+
+
+class ScriptProcessPool:
+    """Долгоживущие процессы для script:-действий.
+
+    Процессы запускаются заранее и держат импорты загруженными. Код скрипта
+    передаётся процессу один раз и дальше вызывается по хэшу. Зависший или
+    отменённый скрипт завершается вместе с процессом, на его место сразу
+    запускается новый, а GUI-процесс от ошибок скрипта не страдает.
+    """
+
+    CODES_PER_WORKER = 256
+
+    def __init__(self, size=2):
+        self.size = max(1, size)
+        self._context = multiprocessing.get_context('spawn')
+        self._idle = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+
+    def shutdown(self, timeout=1.0):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+        deadline = time.monotonic() + timeout
+        for worker in workers:
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.conn.close()
+
+    def _spawn(self):
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_script_worker_main, args=(child_conn,),
+                                        name='script-worker', daemon=True)
+        process.start()
+        child_conn.close()
+        worker = ScriptProcess(process, conn)
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    def _replace(self, worker):
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        worker.process.kill()
+        worker.process.join()
+        worker.conn.close()
+        return self._spawn()
+
+    def run(self, entry, slots, deadline, cancelled):
+        """Выполнение скрипта в свободном процессе: (статус, результат, ошибка)"""
+        self.start()
+        worker = None
+        while worker is None:
+            if cancelled.is_set():
+                return ActionExecutor.STATUS_CANCELLED, None, None
+            if time.monotonic() >= deadline:
+                return ActionExecutor.STATUS_TIMEOUT, None, None
+            try:
+                worker = self._idle.get(timeout=0.05)
+            except queue.Empty:
+                pass
+
+        digest, _, code_bytes = entry
+        try:
+            worker.conn.send((digest, None if worker.remember(digest) else code_bytes, slots))
+            while not worker.conn.poll(0.05):
+                if cancelled.is_set():
+                    status, error = ActionExecutor.STATUS_CANCELLED, None
+                elif time.monotonic() >= deadline:
+                    status, error = ActionExecutor.STATUS_TIMEOUT, None
+                elif not worker.process.is_alive():
+                    status, error = ActionExecutor.STATUS_ERROR, 'Процесс скрипта завершился аварийно'
+                else:
+                    continue
+                worker = self._replace(worker)
+                return status, None, error
+            ok, result, error = worker.conn.recv()
+        except (EOFError, OSError):
+            worker = self._replace(worker)
+            return ActionExecutor.STATUS_ERROR, None, 'Процесс скрипта завершился аварийно'
+        finally:
+            self._idle.put(worker)
+        return (ActionExecutor.STATUS_OK if ok else ActionExecutor.STATUS_ERROR), result, error
+
+
+def kill_process_tree(process):
+    """Завершение процесса вместе с запущенными им программами.
+
+    process.kill() для system: убил бы только оболочку (cmd.exe), а
+    запущенная из неё программа продолжила бы работу.
+    """
+    if sys.platform == 'win32':
+        subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+    if process.poll() is None:
+        process.kill()
+    process.wait()
+
+
+class ActionJob:
+    """Действие в очереди исполнителя"""
+    __slots__ = ('id', 'action', 'context', 'timeout', 'cancelled', 'chain', 'tag', 'process')
+
+    def __init__(self, job_id, action, context, timeout, chain=None, tag=None):
+        self.id = job_id
+        self.action = action
+        self.context = context
+        self.timeout = timeout
+        self.cancelled = threading.Event()
+        self.chain = chain
+        self.tag = tag
+        self.process = None  # system:, оставленная работать после таймаута
+
+
+class ActionChain:
+    """Оставшиеся этапы многокомандной фразы и число незавершённых действий текущего"""
+    __slots__ = ('stages', 'timeout', 'tag', 'remaining', 'failed')
+
+    def __init__(self, stages, timeout, tag=None):
+        self.stages = deque(stages)
+        self.timeout = timeout
+        self.tag = tag
+        self.remaining = 0
+        self.failed = False
+
+
+class ActionExecutor(QObject):
+    """Выполнение действий команд вне потока GUI.
+
+    Действия разбираются из очереди не более чем max_concurrent потоками.
+    system: запускается отдельным процессом, остальные действия вызываются
+    во вспомогательном потоке. Скрипты, обращающиеся к self (окну
+    ассистента), выполняются в потоке GUI, где живут виджеты, а таймаут и
+    место в max_concurrent по-прежнему отсчитывает поток исполнителя. Каждое действие ограничено таймаутом и может
+    быть отменено, итог с длительностью и кодом выхода приходит сигналом
+    actionFinished.
+    """
+    actionFinished = pyqtSignal(object)  # ActionResult
+    _guiCall = pyqtSignal(object)  # функция для вызова в потоке GUI
+
+    STATUS_OK = 'ok'
+    STATUS_FAILED = 'failed'        # процесс завершился с ненулевым кодом
+    STATUS_ERROR = 'error'
+    STATUS_TIMEOUT = 'timeout'
+    STATUS_CANCELLED = 'cancelled'
+
+    def __init__(self, max_concurrent=4, timeout=30.0, history=200):
+        super().__init__()
+        self.max_concurrent = max(1, max_concurrent)
+        self.timeout = timeout
+        self.history = deque(maxlen=history)  # последние ActionResult
+        self._queue = queue.Queue()
+        self._jobs = {}  # номер -> ещё не завершённое задание
+        self._threads = []
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._closing = False
+        self.scripts = ScriptCache()
+        self.script_pool = None  # None - скрипты выполняются в потоке этого процесса
+        # Исполнитель создаётся в потоке GUI, поэтому вызовы из потоков-исполнителей встают в его очередь
+        self._guiCall.connect(self._callInGui, Qt.QueuedConnection)
+
+    def setScriptProcesses(self, enabled, size=2, start=True):
+        if enabled and self.script_pool is None:
+            self.script_pool = ScriptProcessPool(size)
+            # Не запущенный пул запустит процессы при первом скрипте
+            if start:
+                self.script_pool.start()
+        elif not enabled and self.script_pool is not None:
+            pool, self.script_pool = self.script_pool, None
+            pool.shutdown()
+
+    def submit(self, action, context=None, timeout=None, tag=None):
+        """Постановка действия в очередь, возвращает номер задания"""
+        return self._enqueue(action, context, timeout, tag=tag)
+
+    def submitStages(self, stages, timeout=None, tag=None):
+        """Этапы [[(действие, контекст), ...], ...]: действия этапа выполняются
+        параллельно, следующий этап ставится в очередь после завершения всех
+        действий предыдущего. Если действие не выполнено, оставшиеся этапы
+        отменяются. Возвращает номера заданий первого этапа.
+        """
+        return self._submitStage(ActionChain(stages, timeout, tag))
+
+    def _submitStage(self, chain):
+        stage = chain.stages.popleft()
+        with self._lock:
+            # Счётчик выставляется до постановки: действие может завершиться раньше следующего submit
+            chain.remaining = len(stage)
+        return [self._enqueue(action, context, chain.timeout, chain, chain.tag) for action, context in stage]
+
+    def _stageJobDone(self, chain, result):
+        with self._lock:
+            chain.remaining -= 1
+            chain.failed = chain.failed or result.status != self.STATUS_OK
+            if chain.remaining or not chain.stages:
+                return
+            dropped = list(chain.stages) if chain.failed else None
+            if dropped:
+                chain.stages.clear()
+        if dropped is None:
+            self._submitStage(chain)
+            return
+        for stage in dropped:
+            for action, _ in stage:
+                self.actionFinished.emit(ActionResult(None, action, self.STATUS_CANCELLED, None, 0.0,
+                                                      'предыдущее действие не выполнено', tag=chain.tag))
+
+    def _enqueue(self, action, context, timeout, chain=None, tag=None):
+        with self._lock:
+            self._next_id += 1
+            job = ActionJob(self._next_id, action, context, timeout or self.timeout, chain, tag)
+            self._jobs[job.id] = job
+            while len(self._threads) < self.max_concurrent:
+                thread = threading.Thread(target=self._work, name=f'action-worker-{len(self._threads)}',
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        self._queue.put(job)
+        return job.id
+
+    def setMaxConcurrent(self, count):
+        with self._lock:
+            self.max_concurrent = max(1, count)
+            surplus = len(self._threads) - self.max_concurrent
+        # Лишние потоки завершаются, когда дойдут до метки в очереди
+        for _ in range(surplus):
+            self._queue.put(None)
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.cancelled.set()
+        return job is not None
+
+    def cancelAll(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancelled.set()
+        return len(jobs)
+
+    def shutdown(self, timeout=2.0):
+        # Программы, оставленные работать после таймаута, переживают приложение
+        self._closing = True
+        self.cancelAll()
+        with self._lock:
+            threads = list(self._threads)
+        for _ in threads:
+            self._queue.put(None)
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self.setScriptProcesses(False)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                with self._lock:
+                    self._threads.remove(threading.current_thread())
+                return
+            result = self._run(job)
+            if job.tag is not None:
+                result = result._replace(tag=job.tag)
+            METRICS.record('action', result.duration)
+            if job.process is None:
+                with self._lock:
+                    self._jobs.pop(job.id, None)
+            self.history.append(result)
+            self.actionFinished.emit(result)
+            if job.chain is not None:
+                self._stageJobDone(job.chain, result)
+            if job.process is not None:
+                self._waitBackground(job)
+
+    def _waitBackground(self, job):
+        """Ожидание system:, пережившей таймаут.
+
+        cmd /c notepad ждёт закрытия блокнота, поэтому по таймауту программа
+        не завершается. Пока она работает, поток исполнителя занят ею: процесс
+        учитывается в max_concurrent, отменяется как обычное действие и
+        освобождается после завершения.
+        """
+        process = job.process
+        while process.poll() is None:
+            if job.cancelled.wait(0.5):
+                if not self._closing:
+                    kill_process_tree(process)
+                break
+        with self._lock:
+            self._jobs.pop(job.id, None)
+
+    def _run(self, job):
+        started = time.monotonic()
+        if job.cancelled.is_set():
+            return ActionResult(job.id, job.action, self.STATUS_CANCELLED, None, 0.0, None)
+
+        status, exit_code, error, output = self.STATUS_OK, None, None, None
+        try:
+            pool = self.script_pool
+            if (job.action.kind == 'script' and pool is not None
+                    and not self.scripts.usesAssistant(job.action.argument)):
+                slots = (job.context or {}).get('slots', {})
+                status, output, error = pool.run(self.scripts.get(job.action.argument), slots,
+                                                 started + job.timeout, job.cancelled)
+                return ActionResult(job.id, job.action, status, None, time.monotonic() - started,
+                                    error, output)
+
+            if job.action.kind == 'system':
+                # Своя группа процессов, чтобы отмена завершила и запущенные программы
+                process = subprocess.Popen(job.action.argument, shell=True,
+                                           start_new_session=sys.platform != 'win32')
+                finished = lambda: process.poll() is not None
+                abort = lambda: kill_process_tree(process)
+            else:
+                done = threading.Event()
+                abandoned = threading.Event()
+                outcome = []
+
+                def call():
+                    try:
+                        # Таймаут или отмена раньше, чем до вызова дошла очередь GUI
+                        if not abandoned.is_set():
+                            self._call(job)
+                    except Exception as e:
+                        outcome.append(e)
+                    finally:
+                        done.set()
+
+                if job.action.kind == 'script' and self.scripts.usesAssistant(job.action.argument):
+                    self._guiCall.emit(call)
+                else:
+                    threading.Thread(target=call, name=f'action-{job.id}', daemon=True).start()
+                finished = done.is_set
+                # Начатый вызов нельзя прервать: по таймауту или отмене он просто оставляется
+                abort = abandoned.set
+
+            deadline = started + job.timeout
+            while not finished():
+                if job.cancelled.wait(0.05):
+                    status = self.STATUS_CANCELLED
+                    break
+                if time.monotonic() >= deadline:
+                    status = self.STATUS_TIMEOUT
+                    break
+
+            if status == self.STATUS_TIMEOUT and job.action.kind == 'system':
+                job.process = process  # не завершается, см. _waitBackground
+            elif status in (self.STATUS_CANCELLED, self.STATUS_TIMEOUT):
+                abort()
+            elif job.action.kind == 'system':
+                exit_code = process.returncode
+                if exit_code:
+                    status = self.STATUS_FAILED
+            elif outcome:
+                status, error = self.STATUS_ERROR, str(outcome[0])
+            elif job.action.kind == 'script' and job.context is not None:
+                # Как из процесса-исполнителя: результат - переменная result скрипта
+                output = job.context.get('result')
+        except Exception as e:
+            status, error = self.STATUS_ERROR, str(e)
+
+        return ActionResult(job.id, job.action, status, exit_code, time.monotonic() - started, error, output)
+
+    def _callInGui(self, call):
+        call()
+
+    def _call(self, job):
+        kind, argument = job.action.kind, job.action.argument
+        if kind == 'app':
+            os.startfile(argument)
+        elif kind == 'url':
+            webbrowser.open(argument)
+        elif kind == 'script':
+            code = self.scripts.get(argument)[1]
+            exec(code, globals(), job.context if job.context is not None else {})
+        else:
+            raise ValueError(f'Неизвестное действие: {job.action.raw}')
+
+
+def parse_server_address(address):
+    """'localhost:8765' -> ('tcp', хост, порт), 'unix:/путь' -> ('unix', путь, None)"""
+    if address.startswith('unix:'):
+        return 'unix', address[len('unix:'):], None
+    host, separator, port = address.rpartition(':')
+    if not separator or not port.isdigit():
+        raise ValueError(f'Адрес "{address}": ожидается хост:порт или unix:путь')
+    host = host.strip('[]') or 'localhost'
+    # Команды запускают программы и скрипты, поэтому подключения только с этой машины
+    if host not in ('localhost', '127.0.0.1', '::1'):
+        raise ValueError(f'Сервер команд принимает только локальные подключения, а не {host}')
+    return 'tcp', host, int(port)
+
+
+class CommandRequest:
+    """Запрос к серверу команд.
+
+    Разбирается в потоке сервера, сопоставляется в потоке Qt, итоги
+    действий приходят из потоков исполнителя; ответ пишется снова в потоке
+    сервера.
+    """
+    __slots__ = ('server', 'writer', 'id', 'text', 'execute', 'wait', 'confirm', 'received',
+                 'matches', 'results', 'expected', 'error', 'responded', '_lock')
+
+    def __init__(self, server, writer, request_id, text, execute=True, wait=True, confirm=False):
+        self.server = server
+        self.writer = writer
+        self.id = request_id
+        self.text = text
+        self.execute = execute
+        self.wait = wait
+        self.confirm = confirm
+        self.received = time.perf_counter()
+        self.matches = []
+        self.results = []
+        self.expected = None  # число действий, известно после сопоставления
+        self.error = None
+        self.responded = False
+        self._lock = threading.Lock()
+
+    def dispatched(self, dispatch):
+        self.matches = dispatch.matches
+        with self._lock:
+            self.expected = len(dispatch.actions)
+            done = len(self.results) >= self.expected
+        if done or not self.wait:
+            self.server.complete(self, done)
+
+    def failed(self, error):
+        self.error = error
+        with self._lock:
+            self.expected = 0
+        self.server.complete(self, True)
+
+    def addResult(self, result):
+        with self._lock:
+            self.results.append(result)
+            done = self.expected is not None and len(self.results) >= self.expected
+        if done:
+            self.server.complete(self, True)
+
+    def status(self):
+        if self.error is not None:
+            return 'error'
+        if not any(entry is not None for _, entry, _ in self.matches):
+            return 'no_match'
+        if not self.execute:
+            return 'matched'
+        if not self.expected:
+            return 'failed'
+        if not self.wait:
+            return 'queued'
+        return 'ok' if all(r.status == ActionExecutor.STATUS_OK for r in self.results) else 'failed'
+
+    def response(self):
+        response = {'id': self.id, 'status': self.status()}
+        if self.error is not None:
+            response['error'] = self.error
+        response['matches'] = [
+            {'text': segment, 'category': entry.category, 'phrase': entry.phrase,
+             'action': entry.action.raw, 'score': round(score, 3)} if entry is not None
+            else {'text': segment, 'category': None, 'phrase': None, 'action': None, 'score': 0.0}
+            for segment, entry, score in self.matches]
+        if self.wait:
+            response['results'] = [
+                {'action': r.action.raw, 'status': r.status, 'exit_code': r.exit_code,
+                 'duration_ms': round(r.duration * 1000, 2), 'error': r.error, 'output': r.output}
+                for r in self.results]
+        response['latency_ms'] = round((time.perf_counter() - self.received) * 1000, 2)
+        return response
+
+
+class CommandServer(QObject):
+    """Локальный сервер текстовых команд: по JSON-объекту на строку.
+
+    Запрос {"id": 1, "token": "...", "text": "открыть браузер"} и
+    необязательные "execute" (false - только сопоставление), "wait" (false -
+    ответ сразу после постановки в очередь) и "confirm" (голосовое
+    подтверждение). Ответ - строка {"id", "status", "matches", "results",
+    "latency_ms"}, ответы приходят по мере готовности, id связывает их с
+    запросами.
+
+    token - общий секрет из настроек: подключиться к localhost может любая
+    программа, включая страницу в браузере. Строка, которая не является
+    JSON-объектом (например, заголовок HTTP), или неверный токен - ответ с
+    ошибкой и закрытие соединения, следующие строки не читаются.
+
+    asyncio-цикл работает в своём потоке. Запросы, пришедшие за один проход
+    цикла, передаются в поток Qt одной пачкой сигналом commandsReceived.
+    Одновременно обрабатывается не больше max_in_flight запросов, включая
+    ещё не выполненные действия: пока место не освободится, сервер не
+    читает сокеты и клиенты упираются в буфер соединения.
+    """
+    commandsReceived = pyqtSignal(list)  # [CommandRequest]
+    listening = pyqtSignal(str)
+    serverFailed = pyqtSignal(str)
+
+    MAX_LINE = 64 * 1024
+
+    def __init__(self, address, token, max_in_flight=256, parent=None):
+        super().__init__(parent)
+        if not token:
+            raise ValueError('Сервер команд не запускается без токена')
+        self.address = address
+        self.token = token
+        self.max_in_flight = max_in_flight
+        self.requests_total = 0
+        self._loop = None
+        self._thread = None
+        self._stop_requested = False
+        self._stopping = None
+        self._slots = None
+        self._batch = []
+        self._writers = set()
+
+    def start(self):
+        parse_server_address(self.address)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name='command-server', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._requestStop)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def onActionFinished(self, result):
+        # Вызывается в потоке исполнителя, чужие действия пропускаются
+        if isinstance(result.tag, CommandRequest) and result.tag.server is self:
+            result.tag.addResult(result)
+
+    def complete(self, request, final):
+        """Ответ на запрос; final - все действия завершены и место освобождается"""
+        try:
+            self._loop.call_soon_threadsafe(self._respond, request, final)
+        except RuntimeError:
+            pass  # цикл сервера уже закрыт
+
+    def _run(self):
+        try:
+            self._loop.run_until_complete(self._serve())
+        except Exception as e:
+            self.serverFailed.emit(f"{self.address}: {str(e)}")
+        finally:
+            self._loop.close()
+
+    async def _serve(self):
+        self._stopping = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        kind, host, port = parse_server_address(self.address)
+        if kind == 'unix':
+            if os.path.exists(host):
+                os.unlink(host)
+            server = await asyncio.start_unix_server(self._handle, host, limit=self.MAX_LINE)
+        else:
+            server = await asyncio.start_server(self._handle, host, port, limit=self.MAX_LINE)
+        self.listening.emit(self.address)
+        if not self._stop_requested:
+            await self._stopping.wait()
+        server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await server.wait_closed()
+        if kind == 'unix' and os.path.exists(host):
+            os.unlink(host)
+
+    def _requestStop(self):
+        self._stop_requested = True
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                # Нет места - следующая строка не читается, пока не завершится чей-то запрос
+                await self._slots.acquire()
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    line = b''
+                if not line.strip():
+                    self._slots.release()
+                    if not line:
+                        break
+                    continue
+                request, fatal = self._parse(line, writer)
+                if request.error is not None:
+                    self._respond(request, True)
+                    if fatal:
+                        await writer.drain()
+                        break
+                    continue
+                self.requests_total += 1
+                if not self._batch:
+                    self._loop.call_soon(self._flush)
+                self._batch.append(request)
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def _parse(self, line, writer):
+        """(запрос, закрыть ли соединение после ответа с ошибкой)"""
+        try:
+            message = json.loads(line)
+        except ValueError:
+            message = None
+        if not isinstance(message, dict):
+            request = CommandRequest(self, writer, None, '')
+            request.error = 'ожидается JSON-объект, соединение закрыто'
+            return request, True
+        token = message.get('token')
+        if not isinstance(token, str) or not hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8')):
+            request = CommandRequest(self, writer, message.get('id'), '')
+            request.error = 'неверный токен, соединение закрыто'
+            return request, True
+        text = message.get('text')
+        if not isinstance(text, str) or not text.strip():
+            request = CommandRequest(self, writer, message.get('id'), '')
+            request.error = 'ожидается JSON-объект с непустым полем text'
+            return request, False
+        return CommandRequest(self, writer, message.get('id'), text,
+                              execute=bool(message.get('execute', True)), wait=bool(message.get('wait', True)),
+                              confirm=bool(message.get('confirm', False))), False
+
+    def _flush(self):
+        batch, self._batch = self._batch, []
+        self.commandsReceived.emit(batch)
+
+    def _respond(self, request, final):
+        if not request.responded:
+            request.responded = True
+            if not request.writer.is_closing():
+                request.writer.write(json.dumps(request.response(), ensure_ascii=False).encode('utf-8') + b'\n')
+        if final:
+            self._slots.release()
+
+
+def diff_commands(old, new):
+    """Различия двух наборов команд: ([(категория, фраза, действие)], [(категория, фраза)])"""
+    upserts = [(category, phrase, action)
+               for category, phrases in new.items()
+               for phrase, action in phrases.items()
+               if old.get(category, {}).get(phrase) != action]
+    removals = [(category, phrase)
+                for category, phrases in old.items()
+                for phrase in phrases
+                if phrase not in new.get(category, {})]
+    return upserts, removals
+
+
+def read_command_overlay(path):
+    """Наложение команд из commands.json: {категория: {фраза: действие}}, без файла - {}.
+
+    После переноса в commands.db этот файл - не копия хранилища, а правки
+    внешних инструментов поверх него. Неверный JSON или структура - ValueError.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        commands = json.load(f)
+    if not isinstance(commands, dict) or not all(
+            isinstance(phrases, dict) and all(isinstance(action, str) for action in phrases.values())
+            for phrases in commands.values()):
+        raise ValueError('ожидается {"категория": {"фраза": "действие"}}')
+    return commands
+
+
+# Форматы файлов наборов команд по расширению
+COMMAND_FORMATS = {'.json': 'json', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.csv': 'csv'}
+COMMAND_FILE_FILTER = 'Наборы команд (*.json *.jsonl *.ndjson *.csv);;JSON (*.json);;JSON Lines (*.jsonl);;CSV (*.csv)'
+CSV_COLUMNS = ('category', 'phrase', 'action')
+
+
+def command_format(path):
+    fmt = COMMAND_FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise ValueError(f'Неизвестный формат файла "{path}", ожидается .json, .jsonl или .csv')
+    return fmt
+
+
+class _JsonReader:
+    """Чтение JSON по частям: в памяти только непрочитанный остаток буфера"""
+
+    _decoder = json.JSONDecoder()
+    _whitespace = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, f, chunk_size=1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self._line = 1  # номер строки начала буфера
+
+    @property
+    def line(self):
+        return self._line + self.buffer.count('\n', 0, self.pos)
+
+    def _fill(self):
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        self._line = self.line
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return not self.eof
+
+    def peek(self):
+        while True:
+            self.pos = self._whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            expected = ' или '.join(f"'{c}'" for c in chars)
+            raise ValueError(f'строка {self.line}: ожидается {expected}, найдено {char!r}')
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if self._fill():
+                    continue
+                raise ValueError(f'строка {self.line}: {e.msg}')
+            # Число в конце буфера может продолжаться в следующем блоке
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def key(self):
+        if self.peek() != '"':
+            raise ValueError(f'строка {self.line}: ожидается строка в кавычках')
+        return self.value()
+
+
+def _iter_json_commands(f):
+    """{"категория": {"фраза": "действие"}} - формат commands.json"""
+    reader = _JsonReader(f)
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.pos += 1
+        return
+    while True:
+        category = reader.key()
+        reader.expect(':')
+        reader.expect('{')
+        if reader.peek() == '}':
+            reader.pos += 1
+        else:
+            while True:
+                line = reader.line
+                phrase = reader.key()
+                reader.expect(':')
+                yield line, category, phrase, reader.value()
+                if reader.expect(',}') == '}':
+                    break
+        if reader.expect(',}') == '}':
+            break
+    if reader.peek():
+        raise ValueError(f'строка {reader.line}: лишние данные после набора команд')
+
+
+def iter_command_file(path, fmt=None):
+    """Потоковое чтение набора команд: (номер строки, категория, фраза, действие).
+
+    Строки JSONL и CSV, которые не удалось разобрать, отдаются с ошибкой вместо
+    действия (ValueError), синтаксическая ошибка JSON прерывает чтение.
+    """
+    fmt = fmt or command_format(path)
+    if fmt == 'json':
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            yield from _iter_json_commands(f)
+    elif fmt == 'jsonl':
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            for line, text in enumerate(f, start=1):
+                if not text.strip():
+                    continue
+                try:
+                    record = json.loads(text)
+                    yield line, record.get('category'), record.get('phrase'), record.get('action')
+                except (ValueError, AttributeError):
+                    yield line, None, None, ValueError('строка не является объектом JSON')
+    else:
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.DictReader(f)
+            missing = set(CSV_COLUMNS) - set(reader.fieldnames or ())
+            if missing:
+                raise ValueError(f"в CSV нет столбцов: {', '.join(sorted(missing))}")
+            for record in reader:
+                yield reader.line_num, record['category'], record['phrase'], record['action']
+
+
+def validate_command(category, phrase, action):
+    """Текст ошибки для записи набора команд или None"""
+    if isinstance(action, Exception):
+        return str(action)
+    for name, value in (('категория', category), ('фраза', phrase), ('действие', action)):
+        if not isinstance(value, str) or not value.strip():
+            return f'пустое или нестроковое поле: {name}'
+    prefix, separator, argument = action.partition(':')
+    if separator and prefix in ParsedAction.PREFIXES:
+        if not argument.strip():
+            return f'пустое действие {prefix}:'
+    elif action not in LEGACY_ACTIONS:
+        return f'неизвестное действие "{action[:60]}"'
+    if is_template(phrase):
+        try:
+            compile_template(phrase)
+        except ValueError as e:
+            return str(e)
+    elif not normalize_phrase(phrase):
+        return 'фраза не содержит слов'
+    return None
+
+
+ImportConflict = namedtuple('ImportConflict', 'line category phrase action existing_category existing_action')
+
+
+class ImportReport:
+    """Итог импорта: счётчики и первые MAX_SAMPLES ошибок и конфликтов"""
+
+    MAX_SAMPLES = 100
+
     def __init__(self):
+        self.total = 0
+        self.added = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.duplicates = 0  # записи, заменённые более поздней записью с той же категорией и фразой
+        self.invalid = 0
+        self.conflict_count = 0
+        self.errors = []      # (строка, текст)
+        self.conflicts = []   # ImportConflict
+        self.applied = False
+
+    def error(self, line, message):
+        self.invalid += 1
+        if len(self.errors) < self.MAX_SAMPLES:
+            self.errors.append((line, message))
+
+    def conflict(self, *fields):
+        self.conflict_count += 1
+        if len(self.conflicts) < self.MAX_SAMPLES:
+            self.conflicts.append(ImportConflict(*fields))
+
+    def summary(self):
+        return (f"записей: {self.total}, добавлено: {self.added}, изменено: {self.updated}, "
+                f"без изменений: {self.unchanged}, пропущено: {self.skipped}, "
+                f"повторов в файле: {self.duplicates}, с ошибками: {self.invalid}, конфликтов: {self.conflict_count}")
+
+    def details(self):
+        lines = list(self.errors)
+        for c in self.conflicts:
+            where = "" if c.existing_category == c.category else f' в категории "{c.existing_category}"'
+            lines.append((c.line, f'"{c.phrase}" уже есть{where}: {c.existing_action} -> {c.action}'))
+        lines = [f"строка {line}: {message}" for line, message in sorted(lines, key=lambda item: item[0])]
+        hidden = self.invalid + self.conflict_count - len(self.errors) - len(self.conflicts)
+        if hidden > 0:
+            lines.append(f"... и ещё {hidden}")
+        return '\n'.join(lines)
+
+
+class _DryRun(Exception):
+    pass
+
+
+def import_commands(store, path, fmt=None, on_conflict='replace', dry_run=False, batch_size=1000):
+    """Импорт набора команд одной транзакцией.
+
+    Файл читается потоком, записи проверяются и сверяются с хранилищем
+    пачками по batch_size. Из повторов одной категории и фразы в пачке
+    остаётся последняя запись, в счётчиках ключ учитывается один раз.
+    Конфликт - фраза, которая уже есть с другим действием; при on_conflict='skip' такие записи пропускаются. При
+    dry_run транзакция откатывается, отчёт тот же. Ошибка чтения файла
+    откатывает весь импорт.
+    """
+    report = ImportReport()
+    try:
+        with store.transaction():
+            batch = {}
+            for line, category, phrase, action in iter_command_file(path, fmt):
+                report.total += 1
+                error = validate_command(category, phrase, action)
+                if error:
+                    report.error(line, error)
+                    continue
+                key = (category, phrase)
+                if batch.pop(key, None) is not None:
+                    report.duplicates += 1
+                batch[key] = (line, action)
+                if len(batch) >= batch_size:
+                    _import_batch(store, batch, report, on_conflict)
+                    batch = {}
+            if batch:
+                _import_batch(store, batch, report, on_conflict)
+            if dry_run:
+                raise _DryRun()
+    except _DryRun:
+        pass
+    else:
+        report.applied = True
+    return report
+
+
+def _import_batch(store, batch, report, on_conflict):
+    existing = {}
+    for category, phrase, action in store.findPhrases({phrase for _, phrase in batch}):
+        existing.setdefault(phrase, []).append((category, action))
+
+    rows = []
+    for (category, phrase), (line, action) in batch.items():
+        current = None
+        conflicted = False
+        for other_category, other_action in existing.get(phrase, ()):
+            if other_category == category:
+                current = other_action
+            elif other_action != action:
+                # Одна фраза с разными действиями в разных категориях
+                report.conflict(line, category, phrase, action, other_category, other_action)
+                conflicted = True
+        if current == action:
+            report.unchanged += 1
+            continue
+        if current is not None:
+            report.conflict(line, category, phrase, action, category, current)
+            conflicted = True
+        if conflicted and on_conflict == 'skip':
+            report.skipped += 1
+            continue
+        if current is not None:
+            report.updated += 1
+        else:
+            report.added += 1
+        rows.append((category, phrase, action))
+    store.upsertMany(rows)
+
+
+def export_commands(store, path, fmt=None):
+    """Выгрузка набора команд в JSON, JSONL или CSV построчно; возвращает число команд"""
+    fmt = fmt or command_format(path)
+    if fmt == 'json':
+        store.exportJson(path)
+        return len(store)
+
+    count = 0
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, newline='',
+                                     suffix='.tmp', delete=False) as f:
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(CSV_COLUMNS)
+            for row in store.iterCommands():
+                writer.writerow(row)
+                count += 1
+        else:
+            for category, phrase, action in store.iterCommands():
+                f.write(json.dumps({'category': category, 'phrase': phrase, 'action': action},
+                                   ensure_ascii=False) + '\n')
+                count += 1
+    os.replace(f.name, path)
+    return count
+
+
+class FileWatcher(QObject):
+    """Отслеживание изменения файлов по времени изменения и размеру.
+
+    Опрос раз в interval мс стоит один os.stat на файл. Сигнал fileChanged
+    приходит в потоке GUI.
+    """
+    fileChanged = pyqtSignal(str)
+
+    def __init__(self, paths, interval=1000, parent=None):
+        super().__init__(parent)
+        self._signatures = {path: self._signature(path) for path in paths}
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.poll)
+        self._timer.start(interval)
+
+    @staticmethod
+    def _signature(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def refresh(self, path):
+        """Запоминание текущего состояния файла без сигнала"""
+        if path in self._signatures:
+            self._signatures[path] = self._signature(path)
+
+    def poll(self):
+        for path, signature in self._signatures.items():
+            current = self._signature(path)
+            if current != signature:
+                self._signatures[path] = current
+                if current is not None:
+                    self.fileChanged.emit(path)
+
+
+class CommandSearchIndex:
+    """Поиск подстроки по заранее приведённым к нижнему регистру строкам таблицы.
+
+    Тексты строк (категория, фраза, действие) склеиваются в один текст, и
+    совпадения находятся последовательными вызовами str.find. Результат
+    выдаётся лениво: для первой страницы таблицы не нужно просматривать
+    остальные строки.
+    """
+
+    COLUMN_SEPARATOR = '\x1f'
+    ROW_SEPARATOR = '\n'
+
+    def __init__(self):
+        self._texts = {}  # (категория, фраза) -> текст строки
+        self._snapshot = None  # (общий текст, ключи, начала строк)
+
+    def __contains__(self, key):
+        return key in self._texts
+
+    @classmethod
+    def rowText(cls, category, phrase, action):
+        return cls.COLUMN_SEPARATOR.join((category, phrase, action)).lower()
+
+    def rebuild(self, commands):
+        self._texts = {(category, phrase): self.rowText(category, phrase, action)
+                       for category, phrases in commands.items() for phrase, action in phrases.items()}
+        self._snapshot = None
+        self._snapshotText()
+
+    def set(self, category, phrase, action):
+        self._texts[(category, phrase)] = self.rowText(category, phrase, action)
+        self._snapshot = None
+
+    def remove(self, category, phrase):
+        self._texts.pop((category, phrase), None)
+        self._snapshot = None
+
+    def matches(self, key, query):
+        return query.lower() in self._texts.get(key, '')
+
+    def _snapshotText(self):
+        if self._snapshot is None:
+            starts = []
+            position = 0
+            for text in self._texts.values():
+                starts.append(position)
+                position += len(text) + 1
+            self._snapshot = (self.ROW_SEPARATOR.join(self._texts.values()), list(self._texts), starts)
+        return self._snapshot
+
+    def iterMatches(self, query):
+        """Ключи строк с подстрокой query в порядке таблицы"""
+        query = query.lower()
+        joined, keys, starts = self._snapshotText()
+        position = joined.find(query)
+        while position >= 0:
+            row = bisect.bisect_right(starts, position) - 1
+            yield keys[row]
+            if row + 1 >= len(starts):
+                return
+            # Следующий поиск начинается со следующей строки таблицы
+            position = joined.find(query, starts[row + 1])
+
+
+class CommandTableModel(QAbstractTableModel):
+    """Таблица команд поверх словаря категорий без копирования строк.
+
+    Модель хранит только порядок ключей (категория, фраза), текст берётся
+    из хранилища при отрисовке. Строки подгружаются порциями по мере
+    прокрутки, одиночные изменения сообщаются через begin/endInsertRows и
+    begin/endRemoveRows без перестроения всей таблицы. При фильтре видимые
+    строки набираются из ленивого поиска по индексу той же порцией.
+    """
+
+    HEADERS = ('Категория', 'Команда', 'Действие')
+    FETCH_BATCH = 1000
+
+    def __init__(self, commands=None, parent=None):
+        super().__init__(parent)
+        self._commands = commands if commands is not None else {}
+        self._rows = []      # (категория, фраза) в порядке отображения
+        self._visible = self._rows  # строки, прошедшие фильтр
+        self._query = ''
+        self._matches = None  # итератор ещё не выданных совпадений фильтра
+        self._loaded = 0     # сколько видимых строк уже отдано представлению
+        self.search = CommandSearchIndex()
+
+    def reset(self, commands):
+        self.beginResetModel()
+        self._commands = commands
+        self._rows = [(category, phrase) for category, phrases in commands.items() for phrase in phrases]
+        self.search.rebuild(commands)
+        self._applyFilter()
+        self.endResetModel()
+
+    def setFilterText(self, text):
+        self.beginResetModel()
+        self._query = text
+        self._applyFilter()
+        self.endResetModel()
+
+    def _filtered(self):
+        return self._visible is not self._rows
+
+    def _applyFilter(self):
+        if not self._query:
+            self._visible = self._rows
+            self._matches = None
+            self._loaded = min(len(self._rows), self.FETCH_BATCH)
+            return
+        self._visible = []
+        self._matches = self.search.iterMatches(self._query)
+        self._visible.extend(self._nextMatches(self.FETCH_BATCH))
+        self._loaded = len(self._visible)
+
+    def _nextMatches(self, count):
+        batch = []
+        while self._matches is not None and len(batch) < count:
+            key = next(self._matches, None)
+            if key is None:
+                self._matches = None
+            elif key in self.search:  # строка могла быть удалена после начала поиска
+                batch.append(key)
+        return batch
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._loaded
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        if self._filtered():
+            return self._matches is not None
+        return self._loaded < len(self._rows)
+
+    def fetchMore(self, parent=QModelIndex()):
+        self._fetch(self.FETCH_BATCH, parent)
+
+    def fetchAll(self):
+        self._fetch(len(self._rows))
+
+    def _fetch(self, count, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        if self._filtered():
+            batch = self._nextMatches(count)
+            if not batch:
+                return
+            self.beginInsertRows(QModelIndex(), self._loaded, self._loaded + len(batch) - 1)
+            self._visible.extend(batch)
+            self._loaded = len(self._visible)
+            self.endInsertRows()
+            return
+        count = min(count, len(self._rows) - self._loaded)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._loaded, self._loaded + count - 1)
+        self._loaded += count
+        self.endInsertRows()
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            category, phrase = self._visible[index.row()]
+            column = index.column()
+            if column == 0:
+                return category
+            if column == 1:
+                return phrase
+            return self._commands.get(category, {}).get(phrase, '')
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignCenter if index.column() == 0 else Qt.AlignLeft | Qt.AlignVCenter
+        return None
+
+    def keyAt(self, row):
+        """(категория, фраза) строки или None"""
+        if 0 <= row < self._loaded:
+            return self._visible[row]
+        return None
+
+    def rowOf(self, category, phrase):
+        try:
+            return self._visible.index((category, phrase))
+        except ValueError:
+            return -1
+
+    def commandAdded(self, category, phrase):
+        key = (category, phrase)
+        self.search.set(category, phrase, self._commands[category][phrase])
+        self._rows.append(key)
+        if self._filtered():
+            # Незавершённый поиск идёт по прежнему тексту и этой строки не выдаст
+            if not self.search.matches(key, self._query) or key in self._visible:
+                return
+            row = len(self._visible)
+        else:
+            row = len(self._rows) - 1
+            if self._loaded < row:
+                # Хвост ещё не загружен: строка появится при прокрутке
+                return
+        self.beginInsertRows(QModelIndex(), row, row)
+        if self._filtered():
+            self._visible.append(key)
+        self._loaded += 1
+        self.endInsertRows()
+
+    def commandChanged(self, category, phrase):
+        self.search.set(category, phrase, self._commands[category][phrase])
+        row = self.rowOf(category, phrase)
+        if 0 <= row < self._loaded:
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.HEADERS) - 1))
+
+    def commandRemoved(self, category, phrase):
+        key = (category, phrase)
+        self.search.remove(category, phrase)
+        row = self.rowOf(category, phrase)
+        if self._filtered() and key in self._rows:
+            self._rows.remove(key)
+        if row < 0:
+            return
+        if row >= self._loaded:
+            del self._visible[row]
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self._visible[row]
+        self._loaded -= 1
+        self.endRemoveRows()
+
+
+class LogModel(QAbstractListModel):
+    """Журнал в кольцевом буфере: при заполнении вытесняются старые строки"""
+
+    def __init__(self, limit=10000, parent=None):
+        super().__init__(parent)
+        self._items = [None] * max(1, limit)
+        self._start = 0
+        self._count = 0
+
+    @property
+    def limit(self):
+        return len(self._items)
+
+    def setLimit(self, limit):
+        limit = max(1, limit)
+        if limit == len(self._items):
+            return
+        self.beginResetModel()
+        items = [self._items[(self._start + i) % len(self._items)] for i in range(self._count)][-limit:]
+        self._items = items + [None] * (limit - len(items))
+        self._start = 0
+        self._count = len(items)
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._count
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return self._items[(self._start + index.row()) % len(self._items)]
+        return None
+
+    def append(self, line):
+        if self._count == len(self._items):
+            self.beginRemoveRows(QModelIndex(), 0, 0)
+            self._items[self._start] = None
+            self._start = (self._start + 1) % len(self._items)
+            self._count -= 1
+            self.endRemoveRows()
+        self.beginInsertRows(QModelIndex(), self._count, self._count)
+        self._items[(self._start + self._count) % len(self._items)] = line
+        self._count += 1
+        self.endInsertRows()
+
+    def lines(self):
+        return [self._items[(self._start + i) % len(self._items)] for i in range(self._count)]
+
+
+class SizedTimedRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+    """Ротация журнала по времени и дополнительно по размеру файла"""
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.max_bytes = max_bytes
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return True
+        if not self.max_bytes:
+            return False
+        if self.stream is None:
+            self.stream = self._open()
+        return self.stream.tell() + len(self.format(record)) + 1 >= self.max_bytes
+
+    def rotation_filename(self, default_name):
+        # Несколько ротаций по размеру за один период получают номера .1, .2, ...
+        name, number = default_name, 0
+        while os.path.exists(name):
+            number += 1
+            name = f"{default_name}.{number}"
+        return name
+
+
+class AssistantCore:
+    """Общая часть окна и фонового режима: голосовой поток, речь, исполнитель
+    действий, хранилище и сопоставление команд.
+
+    Наследник - QObject с сигналом backgroundReady(str) - задаёт logMessage(),
+    updateStatus(), fuzzyThreshold(), selectedDevice(kind), обработчики
+    onAudioDevicesReady/Added/Removed, serverAddress(), serverToken() и атрибуты
+    profile_startup, startup_finished, _startup_pending, settings_store,
+    command_splitter.
+    """
+
+    def initVoiceAssistant(self):
+        self.voice_thread = VoiceThread()
+        self.voice_thread.hypothesesDetected.connect(self.onHypothesesDetected)
+        self.voice_thread.statusUpdate.connect(self.updateStatus)
+        self.speech_cache = SpeechCache()
+        self.speech_worker = SpeechWorker(self.speech_cache)
+        self.speech_worker.speechError.connect(
+            lambda error: self.logMessage(f"Ошибка воспроизведения речи: {error}"))
+        self.speech_worker.start()
+        self.action_executor = ActionExecutor()
+        self.action_executor.actionFinished.connect(self.onActionFinished)
+        self.command_server = None
+        # Устройства хранятся по именам, таблица опрашивается в фоне
+        self.device_preferences = {'output': None, 'input': None}
+        self.audio_devices = AudioDeviceRegistry(parent=self)
+        self.audio_devices.devicesReady.connect(self.onAudioDevicesReady)
+        self.audio_devices.devicesAdded.connect(self.onAudioDevicesAdded)
+        self.audio_devices.devicesRemoved.connect(self.onAudioDevicesRemoved)
+        self.audio_devices.scanFailed.connect(self.onAudioDevicesFailed)
+        QCoreApplication.instance().aboutToQuit.connect(self.shutdown)
+
+    def setupLogging(self, console=False):
+        # Ротация в полночь и при превышении размера вместо нового файла на каждый день
+        file_handler = SizedTimedRotatingFileHandler(
+            'voice_assistant.log', max_bytes=10 * 1024 * 1024,
+            when='midnight', backupCount=14, encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+        log_queue = queue.Queue()
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        handlers = [file_handler]
+        if console:
+            console_handler = logging.StreamHandler()
+            console_handler.setFormatter(file_handler.formatter)
+            handlers.append(console_handler)
+        self.log_listener = logging.handlers.QueueListener(log_queue, *handlers)
+        self.log_listener.start()
+
+    def initBackground(self):
+        """Импорт распознавания и numpy вне основного потока"""
+        try:
+            with STARTUP.phase('распознаватель и VAD'):
+                self.voice_thread.prepare()
+        except Exception as e:
+            self.backgroundReady.emit(f"Ошибка инициализации распознавания: {str(e)}")
+            return
+        self.backgroundReady.emit('')
+
+    def onBackgroundReady(self, error):
+        if error:
+            self.logMessage(error)
+        self.startupStepDone('background')
+
+    def startupStepDone(self, step):
+        self._startup_pending.discard(step)
+        if self._startup_pending or self.startup_finished:
+            return
+        self.startup_finished = True
+        STARTUP.mark('фоновая инициализация завершена')
+
+        if self.profile_startup:
+            print(STARTUP.report(), flush=True)
+            QCoreApplication.quit()
+        else:
+            self.onStartupFinished()
+
+    def onStartupFinished(self):
+        if self.action_executor.script_pool is not None:
+            # Процессы скриптов импортируют зависимости и не должны мешать запуску
+            self.action_executor.script_pool.start()
+        self.applyServerSettings()
+
+    def applyServerSettings(self):
+        """Запуск, остановка или перезапуск сервера команд по адресу из serverAddress()"""
+        if not self.startup_finished:
+            return
+        address = self.serverAddress()
+        server = self.command_server
+        if server is not None and server.address != address:
+            self.command_server = None
+            self.action_executor.actionFinished.disconnect(server.onActionFinished)
+            server.stop()
+            self.logMessage(f"Сервер команд на {server.address} остановлен")
+        if not address:
+            return
+        token = self.serverToken()
+        if self.command_server is not None:
+            # Новый токен действует со следующего запроса, без перезапуска
+            self.command_server.token = token
+            return
+        server = CommandServer(address, token, parent=self)
+        server.commandsReceived.connect(self.onServerCommands)
+        server.listening.connect(lambda address: self.logMessage(f"Сервер команд слушает {address}"))
+        server.serverFailed.connect(self.onServerFailed)
+        # Итоги действий передаются серверу прямо из потоков исполнителя
+        self.action_executor.actionFinished.connect(server.onActionFinished, Qt.DirectConnection)
+        self.command_server = server
+        try:
+            server.start()
+        except ValueError as e:
+            self.onServerFailed(str(e))
+
+    def onServerFailed(self, error):
+        server, self.command_server = self.command_server, None
+        if server is not None:
+            self.action_executor.actionFinished.disconnect(server.onActionFinished)
+        self.logMessage(f"Сервер команд не запущен: {error}")
+
+    def onServerCommands(self, requests):
+        # Строки, пришедшие за один проход цикла сервера, сопоставляются за одно событие Qt
+        for request in requests:
+            try:
+                dispatch = self.executeCommand(request.text, tag=request, execute=request.execute,
+                                               confirm=request.confirm)
+            except Exception as e:
+                request.failed(str(e))
+                continue
+            request.dispatched(dispatch)
+
+    def onAudioDevicesFailed(self, error):
+        self.logMessage(f"Ошибка при получении списка аудио устройств: {error}")
+        self.startupStepDone('devices')
+
+    def rescanAudioDevices(self):
+        self.audio_devices.rescan()
+        self.logMessage("Обновление списка аудиоустройств...")
+
+    def applyDeviceSettings(self):
+        output = self.audio_devices.find(self.selectedDevice('output'))
+        self.speech_worker.output_device = output.index if output else None
+        device = self.audio_devices.find(self.selectedDevice('input'))
+        index = device.index if device else None
+        # Поток записи переоткрывается только при смене микрофона
+        if index != self.voice_thread.input_device_index:
+            self.voice_thread.input_device_index = index
+            self.voice_thread.microphone = None
+
+    def loadCommands(self):
+        self.command_store = open_command_store(COMMANDS_DB, legacy_json='commands.json')
+        if not len(self.command_store):
+            with self.command_store.transaction():
+                for category, phrases in DEFAULT_COMMANDS.items():
+                    for phrase, action in phrases.items():
+                        self.command_store.upsert(category, phrase, action)
+        self.refreshCommands()
+
+    def refreshCommands(self):
+        """Полное перечитывание хранилища: одна перестройка индекса"""
+        # Строки читаются из хранилища потоком, без разбора одного большого документа
+        self.commands = {}
+        for category, phrase, action in self.command_store.iterCommands():
+            self.commands.setdefault(category, {})[phrase] = action
+        # Индекс строится один раз, дальше обновляется точечно
+        self.command_index = CommandIndex()
+        self.command_index.rebuild(self.commands)
+
+    def forgetScript(self, action):
+        # Скомпилированный код удаляемого или изменённого скрипта больше не нужен
+        parsed = ParsedAction.parse(action)
+        if parsed.kind == 'script':
+            self.action_executor.scripts.invalidate(parsed.argument)
+
+    def onHypothesesDetected(self, hypotheses):
+        # Все варианты сопоставляются сразу, выполняется лучший по оценке
+        with METRICS.span('lookup'):
+            candidates = self.matchStages([hypothesis.text for hypothesis in hypotheses],
+                                          self.fuzzyThreshold())
+        best = max(range(len(hypotheses)),
+                   key=lambda i: (hypothesis_score(hypotheses[i], candidates[i]), -i))
+        chosen = hypotheses[best]
+        if len(hypotheses) == 1:
+            self.logMessage(f"Распознано: {chosen.text}")
+        else:
+            confidence = f", уверенность {chosen.confidence:.0%}" if chosen.confidence is not None else ""
+            instead = f', первый: "{hypotheses[0].text}"' if chosen.rank else ""
+            self.logMessage(f'Распознано: {chosen.text} (вариант {chosen.rank + 1} из {len(hypotheses)}'
+                            f'{confidence}{instead})')
+        self.executeCommand(chosen.text, matches=candidates[best])
+
+    def matchStages(self, texts, threshold):
+        """Этапы [[(фрагмент, запись или None, сходство)]] для каждой фразы.
+
+        Сначала один проход по индексу для фраз целиком, затем один - для
+        фрагментов тех фраз, что целиком не нашлись или нашлись шаблоном,
+        параметр которого захватил союз ("громкость 5 потом открыть блокнот").
+        Во втором случае разбиение выигрывает, только если нашлись все фрагменты.
+        """
+        results = []
+        pending = []  # (номер фразы, этапы фрагментов, найдена ли фраза целиком)
+        for text, (entry, score) in zip(texts, self.command_index.matchMany(texts, threshold)):
+            if entry is None or any(map(self.command_splitter.contains, (entry.action.slots or {}).values())):
+                # Возможно, это несколько команд через союзы
+                stages = self.command_splitter.split(text)
+                if sum(map(len, stages)) >= 2:
+                    pending.append((len(results), stages, entry is not None))
+            results.append([[(text, entry, score)]])
+        segments = [segment for _, stages, _ in pending for stage in stages for segment in stage]
+        found = iter(self.command_index.matchMany(segments, threshold))
+        for n, stages, whole in pending:
+            split = [[(segment, *next(found)) for segment in stage] for stage in stages]
+            if whole and any(entry is None for stage in split for _, entry, _ in stage):
+                continue
+            results[n] = split
+        return results
+
+    def executeCommand(self, text, tag=None, execute=True, confirm=True, matches=None):
+        """Сопоставление фразы и постановка действий в очередь с меткой tag.
+
+        При execute=False только сопоставление, confirm=False - без
+        голосового подтверждения. matches - готовый результат matchStages()
+        для этой фразы.
+        """
+        if matches is None:
+            with METRICS.span('lookup'):
+                matches = self.matchStages([text], self.fuzzyThreshold())[0]
+        flat = [match for stage in matches for match in stage]
+        if not execute or (len(flat) == 1 and flat[0][1] is None):
+            return CommandDispatch(flat, [])
+
+        planned, replies = [], []
+        for stage in matches:
+            actions, stage_replies = [], []
+            for segment, entry, score in stage:
+                if entry is None:
+                    self.logMessage(f'Команда не найдена: "{segment}"')
+                    continue
+                resolved = self.resolveAction(entry, score)
+                if resolved is not None:
+                    actions.append(resolved[:2])
+                    stage_replies.append(resolved[2])
+            if actions:
+                planned.append(actions)
+                replies.append(stage_replies)
+        if not planned:
+            return CommandDispatch(flat, [])
+
+        # Действия выполняются исполнителем, основной поток не ждёт их завершения
+        if len(planned) == 1 and len(planned[0]) == 1:
+            self.action_executor.submit(*planned[0][0], tag=tag)
+        else:
+            self.action_executor.submitStages(planned, tag=tag)
+        if confirm:
+            # Одно подтверждение на всю фразу вместо отдельной реплики на каждое действие;
+            # ещё не произнесённое подтверждение прошлой команды заменяется
+            self.speak(combine_replies(replies), key='confirmation')
+        return CommandDispatch(flat, [action for stage in planned for action, _ in stage])
+
+    def resolveAction(self, entry, score):
+        """(действие, контекст, подтверждение) найденной команды или None"""
+        if score < 1.0:
+            self.logMessage(f'Нечёткое совпадение: "{entry.phrase}" (сходство {score:.0%})')
+
+        action = entry.action
+        self.logMessage(f"Выполняется команда: {action.raw}")
+
+        if action.kind == 'legacy':
+            # Поддержка старых команд
+            if action.argument not in LEGACY_ACTIONS:
+                self.logMessage(f"Неизвестное действие: {action.raw}")
+                return None
+            kind, argument, reply = LEGACY_ACTIONS[action.argument]
+            action = ParsedAction(kind, argument, action.raw)
+        else:
+            reply = ACTION_REPLIES[action.kind]
+
+        context = None
+        if action.kind == 'script':
+            context = {'self': self, 'slots': action.slots or {}}
+        return action, context, reply
+
+    def onActionFinished(self, result):
+        duration = f"{result.duration * 1000:.0f} мс"
+        if result.status == ActionExecutor.STATUS_OK:
+            details = f", код {result.exit_code}" if result.exit_code is not None else ""
+            self.logMessage(f"Команда выполнена: {result.action.raw} ({duration}{details})")
+            if result.output is not None:
+                self.logMessage(f"Результат скрипта: {result.output}")
+        elif result.status == ActionExecutor.STATUS_FAILED:
+            self.logMessage(f"Команда завершилась с кодом {result.exit_code}: {result.action.raw} ({duration})")
+        elif result.status == ActionExecutor.STATUS_CANCELLED:
+            reason = f" ({result.error})" if result.error else ""
+            self.logMessage(f"Команда отменена: {result.action.raw}{reason}")
+        else:
+            if result.status == ActionExecutor.STATUS_TIMEOUT:
+                still_running = ", программа продолжает работу" if result.action.kind == 'system' else ""
+                self.logMessage(f"Превышено время выполнения команды: {result.action.raw} ({duration}{still_running})")
+            else:
+                self.logMessage(f"Ошибка при выполнении команды: {result.error}")
+            self.speak("Произошла ошибка при выполнении команды", priority=True)
+
+    def cancelActions(self):
+        count = self.action_executor.cancelAll()
+        if count:
+            self.logMessage(f"Отменено действий: {count}")
+
+    def speak(self, text, priority=False, key=None):
+        # Речь синтезируется в отдельном потоке, основной поток не блокируется
+        self.speech_worker.say(text, priority, key)
+        self.logMessage(f"Ассистент: {text}")
+
+    def shutdown(self):
+        if self.command_server is not None:
+            self.command_server.stop()
+        if self.voice_thread.is_listening:
+            self.voice_thread.stop()
+        self.action_executor.shutdown()
+        self.audio_devices.stop()
+        self.speech_worker.shutdown()
+        self.settings_store.close()
+        self.command_store.close()
+        self.log_listener.stop()
+
+
+class MainWindow(QMainWindow, AssistantCore):
+    # Итог фоновой инициализации: текст ошибок, пустой при успехе
+    backgroundReady = pyqtSignal(str)
+
+    def __init__(self, profile_startup=False, server_address=None):
         super().__init__()
+        self.profile_startup = profile_startup
+        self.server_address = server_address
+        self.startup_finished = False
+        self._startup_pending = {'background', 'devices'}
         self.theme_manager = ThemeManager()
         self.current_theme = "light"
-        self.initUI()
-        self.loadCommands()
-        self.initVoiceAssistant()
-        self.initTrayIcon()
+        with STARTUP.phase('initUI'):
+            self.initUI()
+        with STARTUP.phase('loadCommands'):
+            self.loadCommands()
+        with STARTUP.phase('initVoiceAssistant'):
+            self.initVoiceAssistant()
+        with STARTUP.phase('initTrayIcon'):
+            self.initTrayIcon()
         self.setupLogging()
-        self.loadSettings()
-        self.populateAudioDevices()
+        self.settings_store = SettingsStore(SETTINGS_FILE, parent=self)
+        self.settings_store.writeFailed.connect(
+            lambda error: self.logMessage(f"Не удалось сохранить настройки: {error}"))
+        with STARTUP.phase('loadSettings'):
+            self.loadSettings()
+        # Изменения, записанные внешними инструментами, применяются на лету.
+        # Содержимое commands.json запоминается, чтобы удалять из хранилища
+        # только команды, пропавшие из этого файла
+        try:
+            self.watched_commands = read_command_overlay('commands.json')
+        except (OSError, ValueError):
+            self.watched_commands = {}
+        self.file_watcher = FileWatcher(['commands.json', SETTINGS_FILE], parent=self)
+        self.file_watcher.fileChanged.connect(self.onWatchedFileChanged)
+        # Остальное - после показа окна, на первом проходе цикла событий
+        self.backgroundReady.connect(self.onBackgroundReady)
+        QTimer.singleShot(0, self.finishStartup)
+
+    def finishStartup(self):
+        STARTUP.mark('первый проход цикла событий')
+        threading.Thread(target=self.initBackground, name='startup', daemon=True).start()
+        self.audio_devices.start()
 
     def sendTextCommand(self):
         text = self.command_input.toPlainText().strip()
@@ -196,41 +3914,67 @@ class MainWindow(QMainWindow):
             self.executeCommand(text)
             self.command_input.clear()
 
-    def populateAudioDevices(self):
-        try:
-            # Получение списка аудио устройств
-            devices = sd.query_devices()
-
-            # Очистка комбобоксов
-            self.output_devices.clear()
-            self.input_devices.clear()
-
-            # Заполнение устройств вывода
-            for i, device in enumerate(devices):
-                if device['max_output_channels'] > 0:
-                    self.output_devices.addItem(device['name'], i)
-
-            # Заполнение устройств ввода
-            for i, device in enumerate(devices):
-                if device['max_input_channels'] > 0:
-                    self.input_devices.addItem(device['name'], i)
-
-            # Установка текущих устройств
-            default_output = sd.default.device[1]
-            default_input = sd.default.device[0]
-
-            if default_output is not None:
-                index = self.output_devices.findData(default_output)
+    def onAudioDevicesReady(self):
+        self.refreshDeviceCombos()
+        self.applyDeviceSettings()
+        self.startupStepDone('devices')
+
+    def onAudioDevicesAdded(self, devices):
+        for device in devices:
+            self.logMessage(f"Подключено аудиоустройство: {device.name}")
+        self.refreshDeviceCombos()
+        self.applyDeviceSettings()
+
+    def onAudioDevicesRemoved(self, devices):
+        for device in devices:
+            self.logMessage(f"Отключено аудиоустройство: {device.name}")
+        self.refreshDeviceCombos()
+        self.applyDeviceSettings()
+
+    def refreshDeviceCombos(self):
+        # Выбор по имени: из настроек, если устройство подключено, иначе текущий или по умолчанию
+        for combo, devices, kind, default in (
+                (self.output_devices, self.audio_devices.outputs(), 'output', self.audio_devices.default_output),
+                (self.input_devices, self.audio_devices.inputs(), 'input', self.audio_devices.default_input)):
+            candidates = (self.device_preferences[kind], combo.currentData(), default)
+            combo.clear()
+            for device in devices:
+                combo.addItem(device.name, device.name)
+            for name in candidates:
+                index = combo.findData(name) if name else -1
                 if index >= 0:
-                    self.output_devices.setCurrentIndex(index)
+                    combo.setCurrentIndex(index)
+                    break
 
-            if default_input is not None:
-                index = self.input_devices.findData(default_input)
-                if index >= 0:
-                    self.input_devices.setCurrentIndex(index)
+    def fuzzyThreshold(self):
+        return self.fuzzy_threshold.value() / 100 if self.fuzzy_matching.isChecked() else None
+
+    def serverAddress(self):
+        """Адрес сервера команд или None: --ipc в командной строке важнее настроек"""
+        if self.server_address:
+            return self.server_address
+        if not self.command_server_enabled.isChecked():
+            return None
+        return self.command_server_address.text().strip() or DEFAULT_SETTINGS['command_server_address']
+
+    def serverToken(self):
+        """Токен сервера команд; при первом запуске создаётся и сохраняется в настройках"""
+        token = self.command_server_token.text().strip()
+        if not token:
+            token = secrets.token_urlsafe(24)
+            self.command_server_token.setText(token)
+            self.saveSettings()
+        return token
 
-        except Exception as e:
-            self.logMessage(f"Ошибка при получении списка аудио устройств: {str(e)}")
+    def refreshCommands(self):
+        """Полное перечитывание хранилища: одна перестройка таблицы и индекса"""
+        super().refreshCommands()
+        self.command_model.reset(self.commands)
+
+    def selectedDevice(self, kind):
+        """Имя выбранного устройства, до первого опроса - сохранённое в настройках"""
+        combo = self.output_devices if kind == 'output' else self.input_devices
+        return combo.currentData() or self.device_preferences[kind]
 
     def initUI(self):
         self.setWindowTitle('Голосовой ассистент')
@@ -259,11 +4003,15 @@ class MainWindow(QMainWindow):
         self.stop_button.clicked.connect(self.stopListening)
         self.stop_button.setEnabled(False)
 
+        self.cancel_actions_button = QPushButton('Отменить действия')
+        self.cancel_actions_button.clicked.connect(self.cancelActions)
+
         top_layout.addWidget(self.theme_button)
         top_layout.addWidget(self.status_label)
         top_layout.addStretch()
         top_layout.addWidget(self.start_button)
         top_layout.addWidget(self.stop_button)
+        top_layout.addWidget(self.cancel_actions_button)
 
         main_layout.addWidget(top_panel)
 
@@ -280,15 +4028,34 @@ class MainWindow(QMainWindow):
         self.setup_settings_tab()
         self.tab_widget.addTab(self.settings_tab, "Настройки")
 
+        # Буфер журнала и флажок метрик нужны раньше, чем откроются их вкладки
+        self.log_model = LogModel(parent=self)
+        self.log_view = None
+        self.metrics_enabled = QCheckBox('Собирать метрики задержек')
+        self.metrics_enabled.toggled.connect(self.applyMetricsSettings)
+
         # Вкладка журнала
         self.log_tab = QWidget()
-        self.setup_log_tab()
         self.tab_widget.addTab(self.log_tab, "Журнал")
 
+        # Вкладка метрик
+        self.metrics_tab = QWidget()
+        self.tab_widget.addTab(self.metrics_tab, "Метрики")
+
+        # Содержимое скрытых вкладок строится при первом открытии
+        self.tab_builders = {self.log_tab: self.setup_log_tab, self.metrics_tab: self.setup_metrics_tab}
+        self.tab_widget.currentChanged.connect(self.buildTab)
+
         main_layout.addWidget(self.tab_widget)
 
         self.apply_theme(self.current_theme)
 
+    def buildTab(self, index):
+        builder = self.tab_builders.pop(self.tab_widget.widget(index), None)
+        if builder is not None:
+            with STARTUP.phase(f"вкладка {self.tab_widget.tabText(index)}"):
+                builder()
+
     def setup_commands_tab(self):
         layout = QVBoxLayout(self.commands_tab)
 
@@ -307,30 +4074,40 @@ class MainWindow(QMainWindow):
         remove_btn.setMinimumWidth(150)
         remove_btn.clicked.connect(self.removeCommand)
 
+        import_btn = QPushButton('Импорт...')
+        import_btn.setMinimumWidth(150)
+        import_btn.clicked.connect(self.importCommands)
+
+        export_btn = QPushButton('Экспорт...')
+        export_btn.setMinimumWidth(150)
+        export_btn.clicked.connect(self.exportCommands)
+
         tools_layout.addWidget(add_btn)
         tools_layout.addWidget(remove_btn)
+        tools_layout.addWidget(import_btn)
+        tools_layout.addWidget(export_btn)
         tools_layout.addStretch()
 
         layout.addLayout(tools_layout)
 
         # Таблица команд
-        self.command_table = QTableWidget()
-        self.command_table.setColumnCount(3)
-        self.command_table.setHorizontalHeaderLabels(['Категория', 'Команда', 'Действие'])
+        self.command_model = CommandTableModel(parent=self)
+        self.command_table = QTableView()
+        self.command_table.setModel(self.command_model)
 
         # Настройка внешнего вида таблицы
         self.command_table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 border: 1px solid #ddd;
                 border-radius: 6px;
                 background-color: transparent;
                 gridline-color: #f0f0f0;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 5px;
                 border-bottom: 1px solid #f0f0f0;
             }
-            QTableWidget::item:selected {
+            QTableView::item:selected {
                 background-color: #e3f2fd;
                 color: #1976D2;
             }
@@ -341,7 +4118,7 @@ class MainWindow(QMainWindow):
                 border-bottom: 2px solid #ddd;
                 font-weight: bold;
             }
-            QTableWidget::item:hover {
+            QTableView::item:hover {
                 background-color: #f5f5f5;
             }
         """)
@@ -353,8 +4130,8 @@ class MainWindow(QMainWindow):
         header.setSectionResizeMode(2, QHeaderView.Stretch)
 
         # Дополнительные настройки таблицы
-        self.command_table.setSelectionBehavior(QTableWidget.SelectRows)
-        self.command_table.setSelectionMode(QTableWidget.SingleSelection)
+        self.command_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.command_table.setSelectionMode(QAbstractItemView.SingleSelection)
         self.command_table.setShowGrid(False)
         self.command_table.verticalHeader().setVisible(False)
         self.command_table.setFocusPolicy(Qt.StrongFocus)
@@ -364,7 +4141,12 @@ class MainWindow(QMainWindow):
         search_label = QLabel("Поиск:")
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("Введите текст для поиска...")
-        self.search_input.textChanged.connect(self.filterCommands)
+        # Фильтр применяется после паузы в наборе, а не на каждую клавишу
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(150)
+        self.search_timer.timeout.connect(self.filterCommands)
+        self.search_input.textChanged.connect(lambda text: self.search_timer.start())
 
         search_layout.addWidget(search_label)
         search_layout.addWidget(self.search_input)
@@ -372,44 +4154,12 @@ class MainWindow(QMainWindow):
         layout.addLayout(search_layout)
         layout.addWidget(self.command_table)
 
-    def filterCommands(self, text):
-        """Фильтрация команд в таблице"""
-        for row in range(self.command_table.rowCount()):
-            match = False
-            for column in range(self.command_table.columnCount()):
-                item = self.command_table.item(row, column)
-                if item and text.lower() in item.text().lower():
-                    match = True
-                    break
-            self.command_table.setRowHidden(row, not match)
-
-    def updateCommandTable(self):
-        """Обновленный метод заполнения таблицы"""
-        self.command_table.setRowCount(0)
-        row = 0
-        for category, commands in self.commands.items():
-            for command, action in commands.items():
-                self.command_table.insertRow(row)
-
-                # Создаем и настраиваем элементы таблицы
-                category_item = QTableWidgetItem(category)
-                command_item = QTableWidgetItem(command)
-                action_item = QTableWidgetItem(action)
-
-                # Устанавливаем выравнивание и стили
-                category_item.setTextAlignment(Qt.AlignCenter)
-                command_item.setTextAlignment(Qt.AlignLeft | Qt.AlignVCenter)
-                action_item.setTextAlignment(Qt.AlignLeft | Qt.AlignVCenter)
+        self.setupContextMenu()
+        self.command_table.doubleClicked.connect(self.editCurrentCommand)
 
-                # Добавляем элементы в таблицу
-                self.command_table.setItem(row, 0, category_item)
-                self.command_table.setItem(row, 1, command_item)
-                self.command_table.setItem(row, 2, action_item)
-
-                row += 1
-
-        # Подгоняем размеры столбцов
-        self.command_table.resizeColumnsToContents()
+    def filterCommands(self):
+        """Фильтрация команд в таблице"""
+        self.command_model.setFilterText(self.search_input.text())
 
     def setupContextMenu(self):
         self.command_table.setContextMenuPolicy(Qt.CustomContextMenu)
@@ -456,11 +4206,76 @@ class MainWindow(QMainWindow):
         self.language.addItems(['Русский', 'English'])
         form_layout.addRow('Язык распознавания:', self.language)
 
+        # Нечёткое сопоставление команд
+        self.fuzzy_matching = QCheckBox('Нечёткое сопоставление команд')
+        form_layout.addRow(self.fuzzy_matching)
+
+        self.fuzzy_threshold = QSpinBox()
+        self.fuzzy_threshold.setRange(50, 100)
+        form_layout.addRow('Порог сходства (%):', self.fuzzy_threshold)
+
+        self.continuous_capture = QCheckBox('Непрерывный захват звука')
+        form_layout.addRow(self.continuous_capture)
+
+        self.recognizer_workers = QSpinBox()
+        self.recognizer_workers.setRange(1, 8)
+        form_layout.addRow('Потоков распознавания:', self.recognizer_workers)
+
+        self.overflow_policy = QComboBox()
+        self.overflow_policy.addItem('Отбрасывать старые фрагменты', RecognitionPipeline.POLICY_DROP_OLDEST)
+        self.overflow_policy.addItem('Приостанавливать запись', RecognitionPipeline.POLICY_BLOCK)
+        form_layout.addRow('При переполнении очереди:', self.overflow_policy)
+
+        self.vad_enabled = QCheckBox('Отсеивать фрагменты без речи')
+        form_layout.addRow(self.vad_enabled)
+
+        self.speech_cache_on_disk = QCheckBox('Сохранять синтезированные фразы на диск')
+        form_layout.addRow(self.speech_cache_on_disk)
+
+        # Выполнение действий
+        self.action_timeout = QSpinBox()
+        self.action_timeout.setRange(1, 600)
+        form_layout.addRow('Таймаут действия (с):', self.action_timeout)
+
+        self.max_concurrent_actions = QSpinBox()
+        self.max_concurrent_actions.setRange(1, 16)
+        form_layout.addRow('Одновременных действий:', self.max_concurrent_actions)
+
+        self.command_conjunctions = QLineEdit()
+        self.command_conjunctions.setToolTip('Слова, которыми разделяются несколько команд в одной фразе, '
+                                             f"через запятую. Порядок выполнения задают: {', '.join(SEQUENCE_WORDS)}")
+        form_layout.addRow('Союзы между командами:', self.command_conjunctions)
+
+        self.command_server_enabled = QCheckBox('Принимать текстовые команды через локальный сокет')
+        form_layout.addRow(self.command_server_enabled)
+
+        self.command_server_address = QLineEdit()
+        self.command_server_address.setPlaceholderText(DEFAULT_SETTINGS['command_server_address'])
+        self.command_server_address.setToolTip('хост:порт на этой машине или unix:путь к сокету')
+        form_layout.addRow('Адрес сервера команд:', self.command_server_address)
+
+        self.command_server_token = QLineEdit()
+        self.command_server_token.setPlaceholderText('создаётся при первом запуске сервера')
+        self.command_server_token.setToolTip('Клиент передаёт его в поле token каждого запроса')
+        form_layout.addRow('Токен сервера команд:', self.command_server_token)
+
+        self.script_processes = QCheckBox('Выполнять скрипты в отдельных процессах')
+        form_layout.addRow(self.script_processes)
+
+        self.log_limit = QSpinBox()
+        self.log_limit.setRange(100, 1000000)
+        self.log_limit.setSingleStep(1000)
+        form_layout.addRow('Строк в журнале:', self.log_limit)
+
         # Аудио устройства
         self.output_devices = QComboBox()
         self.input_devices = QComboBox()
         form_layout.addRow('Устройство вывода:', self.output_devices)
         form_layout.addRow('Устройство ввода:', self.input_devices)
+        # Подключённые устройства находятся сами, если система сообщает их число
+        refresh_devices_btn = QPushButton('Обновить список устройств')
+        refresh_devices_btn.clicked.connect(self.rescanAudioDevices)
+        form_layout.addRow('', refresh_devices_btn)
 
         layout.addLayout(form_layout)
 
@@ -474,9 +4289,20 @@ class MainWindow(QMainWindow):
         layout = QVBoxLayout(self.log_tab)
 
         # Лог
-        self.log_text = QTextEdit()
-        self.log_text.setReadOnly(True)
-        layout.addWidget(self.log_text)
+        # Показываются только видимые строки буфера, а не весь документ
+        self.log_view = QListView()
+        self.log_view.setModel(self.log_model)
+        self.log_view.setUniformItemSizes(True)
+        self.log_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.log_view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        layout.addWidget(self.log_view)
+
+        # Прокрутка к новым строкам один раз за проход цикла событий, а не на каждую строку
+        self.log_scroll_timer = QTimer(self)
+        self.log_scroll_timer.setSingleShot(True)
+        self.log_scroll_timer.setInterval(0)
+        self.log_scroll_timer.timeout.connect(self.log_view.scrollToBottom)
+        self.log_scroll_timer.start()
 
         # Панель ввода команд
         input_panel = QWidget()
@@ -494,6 +4320,87 @@ class MainWindow(QMainWindow):
 
         layout.addWidget(input_panel)
 
+    def setup_metrics_tab(self):
+        layout = QVBoxLayout(self.metrics_tab)
+
+        controls = QHBoxLayout()
+        reset_btn = QPushButton('Сбросить')
+        reset_btn.clicked.connect(self.resetMetrics)
+        json_btn = QPushButton('Экспорт JSON')
+        json_btn.clicked.connect(lambda: self.exportMetrics('json'))
+        prometheus_btn = QPushButton('Экспорт Prometheus')
+        prometheus_btn.clicked.connect(lambda: self.exportMetrics('prometheus'))
+        controls.addWidget(self.metrics_enabled)
+        controls.addStretch()
+        controls.addWidget(reset_btn)
+        controls.addWidget(json_btn)
+        controls.addWidget(prometheus_btn)
+        layout.addLayout(controls)
+
+        socket_layout = QHBoxLayout()
+        self.metrics_socket = QLineEdit()
+        self.metrics_socket.setPlaceholderText("localhost:9091")
+        send_btn = QPushButton('Отправить в сокет')
+        send_btn.clicked.connect(self.sendMetrics)
+        socket_layout.addWidget(QLabel('Адрес сокета:'))
+        socket_layout.addWidget(self.metrics_socket)
+        socket_layout.addWidget(send_btn)
+        layout.addLayout(socket_layout)
+
+        self.metrics_table = QTableWidget(len(LatencyMetrics.STAGES), 6)
+        self.metrics_table.setHorizontalHeaderLabels(['Этап', 'Замеров', 'p50, мс', 'p95, мс', 'p99, мс', 'Макс., мс'])
+        self.metrics_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.metrics_table.verticalHeader().setVisible(False)
+        self.metrics_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        for row, label in enumerate(LatencyMetrics.STAGES.values()):
+            self.metrics_table.setItem(row, 0, QTableWidgetItem(label))
+            for column in range(1, 6):
+                self.metrics_table.setItem(row, column, QTableWidgetItem('-'))
+        layout.addWidget(self.metrics_table)
+
+        # Таблица обновляется раз в секунду и только пока вкладка открыта
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.timeout.connect(self.refreshMetrics)
+        self.metrics_timer.start(1000)
+
+    def refreshMetrics(self):
+        if self.tab_widget.currentWidget() is not self.metrics_tab:
+            return
+        for row, values in enumerate(METRICS.snapshot().values()):
+            cells = [str(values['count'])]
+            if values['count']:
+                cells += [f"{values[key] * 1000:.1f}" for key in ('p50', 'p95', 'p99', 'max')]
+            else:
+                cells += ['-'] * 4
+            for column, text in enumerate(cells, start=1):
+                self.metrics_table.item(row, column).setText(text)
+
+    def applyMetricsSettings(self):
+        METRICS.enabled = self.metrics_enabled.isChecked()
+
+    def resetMetrics(self):
+        METRICS.reset()
+        self.refreshMetrics()
+
+    def exportMetrics(self, fmt):
+        default, pattern = ('metrics.json', 'JSON (*.json)') if fmt == 'json' else ('metrics.prom', 'Prometheus (*.prom)')
+        path, _ = QFileDialog.getSaveFileName(self, 'Экспорт метрик', default, pattern)
+        if not path:
+            return
+        try:
+            METRICS.export(path, fmt)
+            self.logMessage(f"Метрики выгружены в {path}")
+        except Exception as e:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось выгрузить метрики: {str(e)}")
+
+    def sendMetrics(self):
+        address = self.metrics_socket.text().strip() or self.metrics_socket.placeholderText()
+        try:
+            METRICS.export(f'tcp://{address}', 'prometheus')
+            self.logMessage(f"Метрики отправлены на {address}")
+        except Exception as e:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось отправить метрики: {str(e)}")
+
     def toggle_theme(self):
         self.current_theme = "dark" if self.current_theme == "light" else "light"
         self.apply_theme(self.current_theme)
@@ -510,14 +4417,15 @@ class MainWindow(QMainWindow):
     def applySettings(self):
         try:
             # Применяем настройки голосового движка
-            self.engine.setProperty('rate', self.voice_speed.value())
-            self.engine.setProperty('volume', self.voice_volume.value() / 100)
+            self.applySpeechSettings()
 
             # Установка языка распознавания
-            if self.language.currentText() == 'Русский':
-                self.voice_thread.recognition_language = 'ru-RU'
-            else:
-                self.voice_thread.recognition_language = 'en-US'
+            self.voice_thread.recognition_language = RECOGNITION_LANGUAGES[self.language.currentText()]
+
+            # Параметры захвата применяются со следующего запуска прослушивания
+            self.applyCaptureSettings()
+            self.applyActionSettings()
+            self.log_model.setLimit(self.log_limit.value())
 
             # Настройка автозапуска
             key = reg.HKEY_CURRENT_USER
@@ -536,20 +4444,14 @@ class MainWindow(QMainWindow):
             except WindowsError:
                 self.logMessage("Не удалось настроить автозапуск")
 
+            # Устройства ввода-вывода запоминаются по имени
+            self.device_preferences = {kind: self.selectedDevice(kind) for kind in ('output', 'input')}
+            self.applyDeviceSettings()
+            self.applyServerSettings()
+
             # Сохранение настроек в файл
             self.saveSettings()
 
-            # Обновление устройств ввода-вывода
-            if hasattr(self, 'output_devices') and hasattr(self, 'input_devices'):
-                output_device_index = self.output_devices.currentData()
-                input_device_index = self.input_devices.currentData()
-
-                if output_device_index is not None:
-                    sd.default.device[1] = output_device_index
-                if input_device_index is not None:
-                    sd.default.device[0] = input_device_index
-                    self.voice_thread.microphone = None  # Сброс микрофона для переинициализации
-
             QMessageBox.information(self, "Успех", "Настройки успешно применены")
             self.logMessage("Настройки применены")
 
@@ -557,11 +4459,28 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "Ошибка", f"Не удалось применить настройки: {str(e)}")
             self.logMessage(f"Ошибка при применении настроек: {str(e)}")
 
-    def initVoiceAssistant(self):
-        self.voice_thread = VoiceThread()
-        self.voice_thread.textDetected.connect(self.onTextDetected)
-        self.voice_thread.statusUpdate.connect(self.updateStatus)
-        self.engine = pyttsx3.init()
+    def applySpeechSettings(self):
+        # Смена скорости или громкости сбрасывает кэш фраз внутри потока речи
+        self.speech_worker.setVoiceProperties(self.voice_speed.value(), self.voice_volume.value() / 100)
+        self.speech_cache.directory = 'speech_cache' if self.speech_cache_on_disk.isChecked() else None
+
+    def applyCaptureSettings(self):
+        self.voice_thread.continuous_capture = self.continuous_capture.isChecked()
+        self.voice_thread.recognizer_workers = self.recognizer_workers.value()
+        self.voice_thread.overflow_policy = self.overflow_policy.currentData()
+        self.voice_thread.vad_enabled = self.vad_enabled.isChecked()
+
+    def applyActionSettings(self):
+        self.action_executor.timeout = self.action_timeout.value()
+        self.action_executor.setMaxConcurrent(self.max_concurrent_actions.value())
+        # В отдельном процессе скрипту недоступен self, только словарь slots.
+        # При запуске процессы стартуют после фоновой инициализации
+        self.action_executor.setScriptProcesses(self.script_processes.isChecked(),
+                                                start=self.startup_finished)
+        self.command_splitter = UtteranceSplitter(self.commandConjunctions())
+
+    def commandConjunctions(self):
+        return [word.strip() for word in self.command_conjunctions.text().split(',') if word.strip()]
 
     def initTrayIcon(self):
         self.tray_icon = QSystemTrayIcon(self)
@@ -576,61 +4495,208 @@ class MainWindow(QMainWindow):
         self.tray_icon.setContextMenu(tray_menu)
         self.tray_icon.show()
 
-    def setupLogging(self):
-        logging.basicConfig(
-            filename=f'voice_assistant_{datetime.now().strftime("%Y%m%d")}.log',
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s'
-        )
-
     def loadSettings(self):
         try:
-            with open('settings.json', 'r', encoding='utf-8') as f:
-                settings = json.load(f)
-                self.current_theme = settings.get('theme', 'light')
-                self.voice_speed.setValue(settings.get('voice_speed', 180))
-                self.voice_volume.setValue(settings.get('voice_volume', 100))
-                self.autostart.setChecked(settings.get('autostart', False))
-                self.minimize_to_tray.setChecked(settings.get('minimize_to_tray', True))
-                self.language.setCurrentText(settings.get('language', 'Русский'))
+            settings = self.settings_store.load()
+        except (OSError, ValueError) as e:
+            # Испорченный файл откладывается, чтобы запись настроек его не затёрла
+            broken = SETTINGS_FILE + '.broken'
+            try:
+                os.replace(SETTINGS_FILE, broken)
+            except OSError:
+                pass
+            self.logMessage(f"Не удалось прочитать {SETTINGS_FILE}, он сохранён как {broken}: {str(e)}")
+            settings = None
 
-                self.apply_theme(self.current_theme)
-        except FileNotFoundError:
+        if settings is None:
             self.setDefaultSettings()
+            return
+        self.setSettingsWidgets(settings)
+        self.applyCaptureSettings()
+        self.applySpeechSettings()
+        self.applyActionSettings()
+        self.log_model.setLimit(self.log_limit.value())
 
-    def saveSettings(self):
-        settings = {
+        self.apply_theme(self.current_theme)
+
+    def setSettingsWidgets(self, settings):
+        settings = {**DEFAULT_SETTINGS, **settings}
+        self.current_theme = settings['theme']
+        self.voice_speed.setValue(settings['voice_speed'])
+        self.voice_volume.setValue(settings['voice_volume'])
+        self.autostart.setChecked(settings['autostart'])
+        self.minimize_to_tray.setChecked(settings['minimize_to_tray'])
+        self.language.setCurrentText(settings['language'])
+        self.fuzzy_matching.setChecked(settings['fuzzy_matching'])
+        self.fuzzy_threshold.setValue(settings['fuzzy_threshold'])
+        self.continuous_capture.setChecked(settings['continuous_capture'])
+        self.recognizer_workers.setValue(settings['recognizer_workers'])
+        self.overflow_policy.setCurrentIndex(max(0, self.overflow_policy.findData(settings['overflow_policy'])))
+        self.vad_enabled.setChecked(settings['vad_enabled'])
+        self.speech_cache_on_disk.setChecked(settings['speech_cache_on_disk'])
+        self.action_timeout.setValue(settings['action_timeout'])
+        self.max_concurrent_actions.setValue(settings['max_concurrent_actions'])
+        self.command_conjunctions.setText(', '.join(settings['command_conjunctions']))
+        self.script_processes.setChecked(settings['script_processes'])
+        self.log_limit.setValue(settings['log_limit'])
+        self.metrics_enabled.setChecked(settings['metrics_enabled'])
+        self.command_server_enabled.setChecked(settings['command_server'])
+        self.command_server_address.setText(settings['command_server_address'])
+        self.command_server_token.setText(settings['command_server_token'])
+        self.device_preferences = {kind: (settings[f'{kind}_device'] or {}).get('name')
+                                   for kind in ('output', 'input')}
+        if self.audio_devices.ready:
+            self.refreshDeviceCombos()
+
+    def settingsDict(self):
+        return {
             'theme': self.current_theme,
             'voice_speed': self.voice_speed.value(),
             'voice_volume': self.voice_volume.value(),
             'autostart': self.autostart.isChecked(),
             'minimize_to_tray': self.minimize_to_tray.isChecked(),
             'language': self.language.currentText(),
-            'output_device': {
-                'name': self.output_devices.currentText(),
-                'index': self.output_devices.currentData()
-            },
-            'input_device': {
-                'name': self.input_devices.currentText(),
-                'index': self.input_devices.currentData()
-            }
+            'fuzzy_matching': self.fuzzy_matching.isChecked(),
+            'fuzzy_threshold': self.fuzzy_threshold.value(),
+            'continuous_capture': self.continuous_capture.isChecked(),
+            'recognizer_workers': self.recognizer_workers.value(),
+            'overflow_policy': self.overflow_policy.currentData(),
+            'vad_enabled': self.vad_enabled.isChecked(),
+            'speech_cache_on_disk': self.speech_cache_on_disk.isChecked(),
+            'action_timeout': self.action_timeout.value(),
+            'max_concurrent_actions': self.max_concurrent_actions.value(),
+            'script_processes': self.script_processes.isChecked(),
+            'command_conjunctions': self.commandConjunctions(),
+            'log_limit': self.log_limit.value(),
+            'metrics_enabled': self.metrics_enabled.isChecked(),
+            'output_device': self.deviceSetting('output'),
+            'input_device': self.deviceSetting('input'),
+            'command_server': self.command_server_enabled.isChecked(),
+            'command_server_address': self.command_server_address.text().strip()
+                                      or DEFAULT_SETTINGS['command_server_address'],
+            'command_server_token': self.command_server_token.text().strip(),
         }
 
-        with open('settings.json', 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=4)
+    def deviceSetting(self, kind):
+        name = self.selectedDevice(kind)
+        device = self.audio_devices.find(name)
+        return {'name': name, 'index': device.index if device else None}
+
+    def saveSettings(self):
+        # Запись на диск отложена и выполняется в фоне, серия изменений даёт одну запись
+        self.settings_store.update(self.settingsDict())
+
+    def reloadSettings(self):
+        """Применение изменённого извне settings.json без перезапуска прослушивания"""
+        started = time.perf_counter()
+        try:
+            changes = self.settings_store.load()
+        except (OSError, ValueError) as e:
+            self.logMessage(f"Не удалось перечитать {SETTINGS_FILE}: {str(e)}")
+            return
+        if changes is None:
+            return
+
+        current = self.settingsDict()
+        changed = {key for key, value in changes.items() if current.get(key) != value}
+        if not changed:
+            return
+        # Отсутствующие в файле ключи сохраняют текущие значения, а не значения по умолчанию
+        self.setSettingsWidgets({**current, **changes})
+
+        if changed & SETTINGS_GROUPS['speech']:
+            self.applySpeechSettings()
+        if changed & SETTINGS_GROUPS['capture']:
+            self.applyCaptureSettings()
+        if changed & SETTINGS_GROUPS['actions']:
+            self.applyActionSettings()
+        if 'log_limit' in changed:
+            self.log_model.setLimit(self.log_limit.value())
+        if 'language' in changed:
+            self.voice_thread.recognition_language = RECOGNITION_LANGUAGES[self.language.currentText()]
+        if 'theme' in changed:
+            self.apply_theme(self.current_theme)
+        if changed & SETTINGS_GROUPS['server']:
+            self.applyServerSettings()
+        if changed & {'output_device', 'input_device'}:
+            # Устройство находится по имени в кэше, без пересканирования
+            self.applyDeviceSettings()
+
+        elapsed = (time.perf_counter() - started) * 1000
+        self.logMessage(f"Настройки перечитаны: {', '.join(sorted(changed))} ({elapsed:.1f} мс)")
+
+    def reloadCommands(self):
+        """Применение изменённого извне commands.json поверх хранилища.
+
+        Применяется только разница с прошлым чтением файла: добавленные или
+        изменённые в нём команды записываются в хранилище, а пропавшие
+        удаляются, если с тех пор не менялись в приложении. Команды, которые
+        в файле не трогали, остаются такими, какими их сделало приложение.
+        """
+        started = time.perf_counter()
+        try:
+            changes = read_command_overlay('commands.json')
+        except (OSError, ValueError) as e:
+            self.logMessage(f"Не удалось перечитать commands.json: {str(e)}")
+            return
+
+        previous, self.watched_commands = self.watched_commands, changes
+        edited, dropped = diff_commands(previous, changes)
+        upserts = [(category, phrase, action) for category, phrase, action in edited
+                   if self.commands.get(category, {}).get(phrase) != action]
+        removals = [(category, phrase) for category, phrase in dropped
+                    if self.commands.get(category, {}).get(phrase) == previous[category][phrase]]
+        if not upserts and not removals:
+            return
+
+        with self.command_store.transaction():
+            for category, phrase in removals:
+                self.command_store.delete(category, phrase)
+            for category, phrase, action in upserts:
+                self.command_store.upsert(category, phrase, action)
+
+        for category, phrase in removals:
+            self.forgetScript(self.commands[category].pop(phrase))
+            self.command_index.remove(category, phrase)
+            self.command_model.commandRemoved(category, phrase)
+        for category, phrase, action in upserts:
+            phrases = self.commands.setdefault(category, {})
+            exists = phrase in phrases
+            if exists:
+                self.forgetScript(phrases[phrase])
+            phrases[phrase] = action
+            try:
+                self.command_index.add(category, phrase, action)
+            except ValueError as e:
+                self.logMessage(f"Шаблон пропущен: {str(e)}")
+            if exists:
+                self.command_model.commandChanged(category, phrase)
+            else:
+                self.command_model.commandAdded(category, phrase)
+
+        elapsed = (time.perf_counter() - started) * 1000
+        self.logMessage(f"Команды перечитаны из commands.json: изменено {len(upserts)}, "
+                        f"удалено {len(removals)} ({elapsed:.1f} мс)")
+
+    def onWatchedFileChanged(self, path):
+        if path == 'commands.json':
+            self.reloadCommands()
+        elif path == SETTINGS_FILE and not self.settings_store.isOwnWrite():
+            # Собственная отложенная запись не считается внешним изменением
+            self.reloadSettings()
 
     def setDefaultSettings(self):
-        self.current_theme = "light"
-        self.voice_speed.setValue(180)
-        self.voice_volume.setValue(100)
-        self.autostart.setChecked(False)
-        self.minimize_to_tray.setChecked(True)
-        self.language.setCurrentText('Русский')
+        self.setSettingsWidgets(DEFAULT_SETTINGS)
+        self.applyCaptureSettings()
+        self.applySpeechSettings()
+        self.applyActionSettings()
+        self.log_model.setLimit(self.log_limit.value())
         self.apply_theme(self.current_theme)
 
     def startListening(self):
         self.start_button.setEnabled(False)
         self.stop_button.setEnabled(True)
+        self.voice_thread.start_requested_at = time.monotonic()
         self.voice_thread.start()
         self.updateStatus("Прослушивание активно")
 
@@ -638,6 +4704,8 @@ class MainWindow(QMainWindow):
         self.start_button.setEnabled(True)
         self.stop_button.setEnabled(False)
         self.voice_thread.stop()
+        # Ответы на уже распознанные фразы после остановки не нужны
+        self.flushSpeech()
         self.updateStatus("Прослушивание остановлено")
 
     def updateStatus(self, status):
@@ -646,55 +4714,92 @@ class MainWindow(QMainWindow):
 
     def logMessage(self, message):
         timestamp = datetime.now().strftime("%H:%M:%S")
-        self.log_text.append(f"[{timestamp}] {message}")
+        if self.log_view is not None:
+            scrollbar = self.log_view.verticalScrollBar()
+            if scrollbar.value() == scrollbar.maximum() and not self.log_scroll_timer.isActive():
+                self.log_scroll_timer.start()
+        self.log_model.append(f"[{timestamp}] {message}")
+        # Запись в файл выполняет фоновый поток QueueListener
         logging.info(message)
 
-    def onTextDetected(self, text):
-        self.logMessage(f"Распознано: {text}")
-        self.executeCommand(text)
+    def exportCommands(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Экспорт команд', 'commands.json', COMMAND_FILE_FILTER)
+        if not path:
+            return
+        try:
+            count = export_commands(self.command_store, path)
+            self.logMessage(f"Команды выгружены в {path}: {count}")
+        except Exception as e:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось выгрузить команды: {str(e)}")
 
-    def loadCommands(self):
+    def importCommands(self):
+        path, _ = QFileDialog.getOpenFileName(self, 'Импорт команд', '', COMMAND_FILE_FILTER)
+        if not path:
+            return
+
+        # Пробный проход откатывается и показывает, что изменится
+        QApplication.setOverrideCursor(Qt.WaitCursor)
         try:
-            with open('commands.json', 'r', encoding='utf-8') as file:
-                self.commands = json.load(file)
-            self.updateCommandTable()
-        except FileNotFoundError:
-            self.commands = {
-                "системные": {
-                    "выключить компьютер": "shutdown",
-                    "перезагрузить": "restart"
-                },
-                "приложения": {
-                    "открыть браузер": "browser",
-                    "открыть блокнот": "notepad"
-                }
-            }
-            self.saveCommands()
-
-    def updateCommandTable(self):
-        self.command_table.setRowCount(0)
-        row = 0
-        for category, commands in self.commands.items():
-            for command, action in commands.items():
-                self.command_table.insertRow(row)
-                self.command_table.setItem(row, 0, QTableWidgetItem(category))
-                self.command_table.setItem(row, 1, QTableWidgetItem(command))
-                self.command_table.setItem(row, 2, QTableWidgetItem(action))
-                row += 1
-
-    def saveCommands(self):
-        with open('commands.json', 'w', encoding='utf-8') as file:
-            json.dump(self.commands, file, ensure_ascii=False, indent=4)
+            preview = import_commands(self.command_store, path, dry_run=True)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Ошибка", f"Не удалось прочитать {path}: {str(e)}")
+            return
+        finally:
+            QApplication.restoreOverrideCursor()
+
+        box = QMessageBox(self)
+        box.setWindowTitle('Импорт команд')
+        box.setIcon(QMessageBox.Question)
+        box.setText(f"{os.path.basename(path)}\n{preview.summary()}")
+        if preview.invalid or preview.conflict_count:
+            box.setInformativeText('Записи с ошибками будут пропущены. '
+                                   'Как поступить с фразами, которые уже есть?')
+            box.setDetailedText(preview.details())
+        replace_btn = box.addButton('Заменить', QMessageBox.AcceptRole)
+        skip_btn = box.addButton('Пропустить', QMessageBox.AcceptRole) if preview.conflict_count else None
+        box.addButton('Отмена', QMessageBox.RejectRole)
+        box.exec_()
+        clicked = box.clickedButton()
+        if clicked not in (replace_btn, skip_btn):
+            return
+
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            report = import_commands(self.command_store, path,
+                                     on_conflict='skip' if clicked is skip_btn else 'replace')
+            self.action_executor.scripts.clear()
+            self.refreshCommands()
+        except (OSError, ValueError, sqlite3.Error) as e:
+            QMessageBox.warning(self, "Ошибка", f"Импорт не выполнен: {str(e)}")
+            return
+        finally:
+            QApplication.restoreOverrideCursor()
+        self.logMessage(f"Импорт из {path}: {report.summary()}")
 
     def addCommand(self):
         dialog = CommandConstructorDialog(self)
         dialog.exec_()
 
+    def currentCommandKey(self):
+        return self.command_model.keyAt(self.command_table.currentIndex().row())
+
+    def editCurrentCommand(self):
+        key = self.currentCommandKey()
+        if key is not None:
+            category, command = key
+            action = self.commands[category][command]
+            dialog = CommandConstructorDialog(self, category, command, action)
+            dialog.exec_()
+
+    def copyCommand(self):
+        key = self.currentCommandKey()
+        if key is not None:
+            QApplication.clipboard().setText(key[1])
+
     def removeCommand(self):
-        current_row = self.command_table.currentRow()
-        if current_row >= 0:
-            category = self.command_table.item(current_row, 0).text()
-            command = self.command_table.item(current_row, 1).text()
+        key = self.currentCommandKey()
+        if key is not None:
+            category, command = key
 
             reply = QMessageBox.question(
                 self, 'Подтверждение',
@@ -703,65 +4808,15 @@ class MainWindow(QMainWindow):
                 QMessageBox.No)
 
             if reply == QMessageBox.Yes:
+                self.forgetScript(self.commands[category][command])
                 del self.commands[category][command]
-                self.saveCommands()
-                self.updateCommandTable()
+                self.command_index.remove(category, command)
+                self.command_store.delete(category, command)
+                self.command_model.commandRemoved(category, command)
                 self.logMessage(f"Удалена команда: {command}")
 
-    def executeCommand(self, text):
-        for category, commands in self.commands.items():
-            if text in commands:
-                action = commands[text]
-                self.logMessage(f"Выполняется команда: {action}")
-
-                try:
-                    if action.startswith("system:"):
-                        command = action.replace("system:", "", 1)
-                        os.system(command)
-                        self.speak("Выполняю системную команду")
-
-                    elif action.startswith("app:"):
-                        path = action.replace("app:", "", 1)
-                        os.startfile(path)
-                        self.speak("Запускаю приложение")
-
-                    elif action.startswith("url:"):
-                        url = action.replace("url:", "", 1)
-                        webbrowser.open(url)
-                        self.speak("Открываю веб-страницу")
-
-                    elif action.startswith("script:"):
-                        script = action.replace("script:", "", 1)
-                        exec(script)
-                        self.speak("Выполняю скрипт")
-
-                    else:
-                        # Поддержка старых команд
-                        if action == "shutdown":
-                            os.system("shutdown /s /t 60")
-                            self.speak("Компьютер будет выключен через минуту")
-                        elif action == "restart":
-                            os.system("shutdown /r /t 60")
-                            self.speak("Компьютер будет перезагружен через минуту")
-                        elif action == "browser":
-                            webbrowser.open('http://google.com')
-                            self.speak("Открываю браузер")
-                        elif action == "notepad":
-                            os.system("notepad")
-                            self.speak("Открываю блокнот")
-
-                except Exception as e:
-                    self.logMessage(f"Ошибка при выполнении команды: {str(e)}")
-                    self.speak("Произошла ошибка при выполнении команды")
-                break
-
-    def speak(self, text):
-        try:
-            self.engine.say(text)
-            self.engine.runAndWait()
-            self.logMessage(f"Ассистент: {text}")
-        except Exception as e:
-            self.logMessage(f"Ошибка воспроизведения речи: {str(e)}")
+    def flushSpeech(self):
+        self.speech_worker.flush()
 
     def closeEvent(self, event):
         if hasattr(self, 'minimize_to_tray') and self.minimize_to_tray and not self.isHidden():
@@ -790,10 +4845,16 @@ class CommandTextEdit(QTextEdit):
             super().keyPressEvent(event)
 
 class CommandConstructorDialog(QDialog):
-    def __init__(self, parent=None):
+    ACTION_PREFIXES = ('system', 'app', 'url', 'script')
+
+    def __init__(self, parent=None, category=None, command=None, action=None):
         super().__init__(parent)
         self.parent = parent
+        # (категория, команда) редактируемой записи, None для новой
+        self.original = (category, command) if command is not None else None
         self.initUI()
+        if self.original is not None:
+            self.fillFromCommand(category, command, action)
 
     def initUI(self):
         self.setWindowTitle('Конструктор команд')
@@ -819,6 +4880,12 @@ class CommandConstructorDialog(QDialog):
         command_layout.addWidget(self.command_input)
         layout.addLayout(command_layout)
 
+        template_hint = QLabel('Параметры задаются в фигурных скобках: "открыть сайт {site}". '
+                               'В действии они подставляются так же: "url:https://{site}", '
+                               'а скрипту передаются в словаре slots.')
+        template_hint.setWordWrap(True)
+        layout.addWidget(template_hint)
+
         # Выбор типа действия
         action_type_layout = QHBoxLayout()
         action_type_label = QLabel('Тип действия:')
@@ -884,6 +4951,18 @@ class CommandConstructorDialog(QDialog):
     def onActionTypeChanged(self, index):
         self.action_stack.setCurrentIndex(index)
 
+    def fillFromCommand(self, category, command, action):
+        self.setWindowTitle('Редактирование команды')
+        self.category_combo.setCurrentText(category)
+        self.command_input.setPlainText(command)
+
+        prefix, separator, argument = action.partition(':')
+        if separator and prefix in self.ACTION_PREFIXES:
+            index = self.ACTION_PREFIXES.index(prefix)
+            self.action_type_combo.setCurrentIndex(index)
+            inputs = [self.system_command_input, self.app_path_input, self.url_input, self.script_input]
+            inputs[index].setPlainText(argument)
+
     def browseApplication(self):
         file_name, _ = QFileDialog.getOpenFileName(self, 'Выберите приложение', '',
                                                     'Executable files (*.exe);;All files (*.*)')
@@ -910,28 +4989,293 @@ class CommandConstructorDialog(QDialog):
         elif action_type == 3:  # Скрипт
             action = f"script:{self.script_input.toPlainText()}"
 
-        if not action:
+        if not action.partition(':')[2].strip():
             QMessageBox.warning(self, 'Ошибка', 'Заполните действие')
             return
 
+        if is_template(command):
+            try:
+                _, slots = compile_template(command)
+            except ValueError as e:
+                QMessageBox.warning(self, 'Ошибка', str(e))
+                return
+            unknown = set(_SLOT_RE.findall(action)) - set(slots)
+            if unknown and action_type != 3:
+                QMessageBox.warning(self, 'Ошибка',
+                                    f'В действии есть параметры, которых нет в команде: {", ".join(sorted(unknown))}')
+                return
+
+        if action_type == 3:
+            # Синтаксис проверяется сразу, код попадает в кэш к первому запуску
+            try:
+                self.parent.action_executor.scripts.get(action.partition(':')[2])
+            except SyntaxError as e:
+                QMessageBox.warning(self, 'Ошибка', f'Ошибка в скрипте, строка {e.lineno}: {e.msg}')
+                return
+
+        if self.original is not None:
+            old_category, old_command = self.original
+            old_action = self.parent.commands.get(old_category, {}).get(old_command)
+            if old_action is not None and old_action != action:
+                self.parent.forgetScript(old_action)
+
+        # Переименование - удаление и добавление одной транзакцией
+        store = self.parent.command_store
+        with store.transaction():
+            if self.original is not None and self.original != (category, command):
+                store.delete(*self.original)
+            store.upsert(category, command, action)
+
+        if self.original is not None and self.original != (category, command):
+            old_category, old_command = self.original
+            self.parent.commands.get(old_category, {}).pop(old_command, None)
+            self.parent.command_index.remove(old_category, old_command)
+            self.parent.command_model.commandRemoved(old_category, old_command)
+
         if category not in self.parent.commands:
             self.parent.commands[category] = {}
 
+        exists = command in self.parent.commands[category]
         self.parent.commands[category][command] = action
-        self.parent.saveCommands()
-        self.parent.updateCommandTable()
-        self.parent.logMessage(f"Добавлена новая команда: {command}")
+        self.parent.command_index.add(category, command, action)
+        if exists:
+            self.parent.command_model.commandChanged(category, command)
+        else:
+            self.parent.command_model.commandAdded(category, command)
+        if self.original is not None:
+            self.parent.logMessage(f"Изменена команда: {command}")
+        else:
+            self.parent.logMessage(f"Добавлена новая команда: {command}")
 
         self.accept()
 
+class HeadlessAssistant(QObject, AssistantCore):
+    """Фоновый режим без окна: захват, распознавание, команды, действия и речь.
+
+    Работает в цикле событий QCoreApplication, настройки и команды - те же
+    файлы, что у окна, читаются при запуске. SIGTERM и SIGINT завершают
+    цикл событий, дальше выполняется обычное завершение shutdown().
+    """
+    backgroundReady = pyqtSignal(str)
+
+    def __init__(self, profile_startup=False, server_address=None, parent=None):
+        super().__init__(parent)
+        self.profile_startup = profile_startup
+        self.server_address = server_address
+        self.startup_finished = False
+        self._startup_pending = {'background', 'devices'}
+        self.setupLogging(console=True)
+        self.settings_store = SettingsStore(SETTINGS_FILE, parent=self)
+        self.settings_store.writeFailed.connect(
+            lambda error: self.logMessage(f"Не удалось сохранить настройки: {error}"))
+        with STARTUP.phase('loadSettings'):
+            self.settings = dict(DEFAULT_SETTINGS)
+            try:
+                self.settings.update(self.settings_store.load() or {})
+            except (OSError, ValueError) as e:
+                # Файл не трогается: его может исправить окно или администратор
+                self.logMessage(f"Не удалось прочитать {SETTINGS_FILE}, используются значения по умолчанию: {str(e)}")
+        with STARTUP.phase('loadCommands'):
+            self.loadCommands()
+        with STARTUP.phase('initVoiceAssistant'):
+            self.initVoiceAssistant()
+        self.applySettings()
+        self.backgroundReady.connect(self.onBackgroundReady)
+        self.installSignalHandlers()
+        QTimer.singleShot(0, self.finishStartup)
+
+    def installSignalHandlers(self):
+        # Обработчик сигнала Python выполняется, только когда управление возвращается
+        # интерпретатору: номер сигнала пишется в сокет и будит цикл событий
+        self._signal_socket, signal_writer = socket.socketpair()
+        self._signal_socket.setblocking(False)
+        signal_writer.setblocking(False)
+        self._signal_writer = signal_writer
+        signal.set_wakeup_fd(signal_writer.fileno())
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: None)
+        self._signal_notifier = QSocketNotifier(self._signal_socket.fileno(), QSocketNotifier.Read, self)
+        self._signal_notifier.activated.connect(self.onSignal)
+
+    def onSignal(self):
+        try:
+            signums = self._signal_socket.recv(64)
+        except OSError:
+            return
+        for signum in signums:
+            if signum in (signal.SIGTERM, signal.SIGINT):
+                self.logMessage(f"Получен сигнал {signal.Signals(signum).name}, завершение работы")
+                QCoreApplication.quit()
+                return
+
+    def applySettings(self):
+        settings = self.settings
+        self.voice_thread.recognition_language = RECOGNITION_LANGUAGES.get(settings['language'], 'ru-RU')
+        self.voice_thread.continuous_capture = settings['continuous_capture']
+        self.voice_thread.recognizer_workers = settings['recognizer_workers']
+        self.voice_thread.overflow_policy = settings['overflow_policy']
+        self.voice_thread.vad_enabled = settings['vad_enabled']
+        self.speech_worker.setVoiceProperties(settings['voice_speed'], settings['voice_volume'] / 100)
+        self.speech_cache.directory = 'speech_cache' if settings['speech_cache_on_disk'] else None
+        self.action_executor.timeout = settings['action_timeout']
+        self.action_executor.setMaxConcurrent(settings['max_concurrent_actions'])
+        self.action_executor.setScriptProcesses(settings['script_processes'], start=False)
+        self.command_splitter = UtteranceSplitter(settings['command_conjunctions'])
+        METRICS.enabled = settings['metrics_enabled']
+
+    def finishStartup(self):
+        STARTUP.mark('первый проход цикла событий')
+        threading.Thread(target=self.initBackground, name='startup', daemon=True).start()
+        self.audio_devices.start()
+
+    def onStartupFinished(self):
+        self.voice_thread.start_requested_at = time.monotonic()
+        self.voice_thread.start()
+        self.logMessage("Фоновый режим: прослушивание запущено")
+        super().onStartupFinished()
+
+    def fuzzyThreshold(self):
+        return self.settings['fuzzy_threshold'] / 100 if self.settings['fuzzy_matching'] else None
+
+    def selectedDevice(self, kind):
+        return (self.settings[f'{kind}_device'] or {}).get('name')
+
+    def serverAddress(self):
+        if self.server_address:
+            return self.server_address
+        return self.settings['command_server_address'] if self.settings['command_server'] else None
+
+    def serverToken(self):
+        token = self.settings['command_server_token']
+        if not token:
+            token = self.settings['command_server_token'] = secrets.token_urlsafe(24)
+            self.settings_store.update(self.settings)
+            self.logMessage(f"Токен сервера команд создан и сохранён в {SETTINGS_FILE}")
+        return token
+
+    def onAudioDevicesReady(self):
+        self.applyDeviceSettings()
+        self.startupStepDone('devices')
+
+    def onAudioDevicesAdded(self, devices):
+        for device in devices:
+            self.logMessage(f"Подключено аудиоустройство: {device.name}")
+        self.applyDeviceSettings()
+
+    def onAudioDevicesRemoved(self, devices):
+        for device in devices:
+            self.logMessage(f"Отключено аудиоустройство: {device.name}")
+        self.applyDeviceSettings()
+
+    def updateStatus(self, status):
+        self.logMessage(status)
+
+    def logMessage(self, message):
+        # Журнал пишет фоновый поток QueueListener: в файл и в stderr службы
+        logging.info(message)
+
+    def shutdown(self):
+        super().shutdown()
+        signal.set_wakeup_fd(-1)
+        self._signal_socket.close()
+        self._signal_writer.close()
+
+
+def profile_imports(top=30):
+    """Перезапуск с -X importtime и сводка самых долгих импортов.
+
+    Дочерний процесс сам печатает профиль этапов запуска и завершается после
+    фоновой инициализации, здесь разбирается его stderr.
+    """
+    completed = subprocess.run([sys.executable, '-X', 'importtime'] + sys.argv,
+                               stderr=subprocess.PIPE, text=True, errors='replace')
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:'):
+            print(line, file=sys.stderr)
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) == 3 and fields[0].strip().isdigit():
+            imports.append((int(fields[1]), int(fields[0]), fields[2].rstrip()))
+
+    imports.sort(reverse=True)
+    print(f"\nСамые долгие импорты, мкс (всего модулей: {len(imports)}):")
+    print("import time: self [us] | cumulative | imported package")
+    for cumulative, own, name in imports[:top]:
+        print(f"import time: {own:>9} | {cumulative:>10} |{name}")
+    return completed.returncode
+
+
+def run_command_cli(argv):
+    """Импорт и экспорт набора команд без запуска окна"""
+    parser = argparse.ArgumentParser(prog='main.py', description='Импорт и экспорт команд голосового ассистента')
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument('--import', dest='import_path', metavar='ФАЙЛ', help='загрузить команды из .json, .jsonl или .csv')
+    action.add_argument('--export', dest='export_path', metavar='ФАЙЛ', help='выгрузить команды в .json, .jsonl или .csv')
+    parser.add_argument('--format', choices=sorted(set(COMMAND_FORMATS.values())),
+                        help='формат файла, если его не видно по расширению')
+    parser.add_argument('--on-conflict', choices=('replace', 'skip'), default='replace',
+                        help='что делать с фразами, которые уже есть с другим действием')
+    parser.add_argument('--dry-run', action='store_true', help='только проверить файл, ничего не менять')
+    parser.add_argument('--db', default=COMMANDS_DB, help=f'хранилище команд (по умолчанию {COMMANDS_DB})')
+    args = parser.parse_args(argv)
+
+    try:
+        store = open_command_store(args.db, legacy_json='commands.json')
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Не удалось открыть {args.db}: {e}", file=sys.stderr)
+        return 1
+    try:
+        if args.export_path:
+            count = export_commands(store, args.export_path, args.format)
+            print(f"Выгружено команд: {count} -> {args.export_path}")
+            return 0
+        report = import_commands(store, args.import_path, args.format,
+                                 on_conflict=args.on_conflict, dry_run=args.dry_run)
+        details = report.details()
+        if details:
+            print(details)
+        print(('Проверка: ' if args.dry_run else 'Импорт: ') + report.summary())
+        return 0
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+    finally:
+        store.close()
+
+
 def main():
+    multiprocessing.freeze_support()
     warnings.filterwarnings("ignore", category=DeprecationWarning)
 
-    app = QApplication(sys.argv)
-    app.setStyle('Fusion')
-
-    window = MainWindow()
-    window.show()
+    # --import/--export: работа с набором команд из командной строки, без окна
+    if any(arg.split('=')[0] in ('--import', '--export') for arg in sys.argv[1:]):
+        sys.exit(run_command_cli(sys.argv[1:]))
+
+    # --profile-startup: этапы запуска и время импортов, затем выход
+    profile = '--profile-startup' in sys.argv
+    if profile and 'importtime' not in sys._xoptions and not getattr(sys, 'frozen', False):
+        sys.exit(profile_imports())
+
+    # --ipc АДРЕС: сервер текстовых команд независимо от настроек
+    server = argparse.ArgumentParser(add_help=False)
+    server.add_argument('--ipc', metavar='АДРЕС')
+    server_address = server.parse_known_args()[0].ipc
+
+    # --headless: служба без окна, виджеты и стили не создаются
+    if '--headless' in sys.argv:
+        with STARTUP.phase('QCoreApplication'):
+            app = QCoreApplication(sys.argv)
+        assistant = HeadlessAssistant(profile_startup=profile, server_address=server_address)
+        sys.exit(app.exec_())
+
+    with STARTUP.phase('QApplication'):
+        app = QApplication(sys.argv)
+        app.setStyle('Fusion')
+
+    window = MainWindow(profile_startup=profile, server_address=server_address)
+    with STARTUP.phase('show'):
+        window.show()
 
     sys.exit(app.exec_())
 